@@ -0,0 +1,219 @@
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+
+# inotify events (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | \
+			 IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+class FolderEvent:
+	"""something changed in folder (name is None when the folder itself was removed or when the events
+	were lost, in which case the folder must be scanned again)"""
+
+	def __init__(self, folder, name=None, is_dir=False):
+		self.folder = folder
+		self.name = name
+		self.is_dir = is_dir
+
+	@property
+	def path(self):
+		if self.name is None:
+			return self.folder
+		return os.path.join(self.folder, self.name)
+
+	def __repr__(self):
+		return f"FolderEvent({self.path!r}, is_dir={self.is_dir})"
+
+
+class InotifyWatcher:
+	"""watch folders (not recursively) with the linux inotify API
+
+	o_watcher = InotifyWatcher()
+	o_watcher.add_folder(folder)
+	list_events = o_watcher.wait(timeout=10)   # [] if nothing happened during 10s
+
+	inotify only sees the changes made by the local machine, use PollingWatcher for folders written by
+	another machine over a network file system.
+	"""
+
+	def __init__(self):
+		_libc_name = ctypes.util.find_library("c")
+		self._libc = ctypes.CDLL(_libc_name, use_errno=True)
+		if not hasattr(self._libc, "inotify_init1"):
+			raise OSError(errno.ENOSYS, "inotify is not available")
+
+		self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self._fd < 0:
+			_errno = ctypes.get_errno()
+			raise OSError(_errno, os.strerror(_errno))
+
+		self._folder_of_wd = {}
+		self._wd_of_folder = {}
+
+	def add_folder(self, folder):
+		if folder in self._wd_of_folder:
+			return
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+		if wd < 0:
+			_errno = ctypes.get_errno()
+			raise OSError(_errno, os.strerror(_errno), folder)
+		self._folder_of_wd[wd] = folder
+		self._wd_of_folder[folder] = wd
+
+	def remove_folder(self, folder):
+		wd = self._wd_of_folder.pop(folder, None)
+		if wd is None:
+			return
+		self._folder_of_wd.pop(wd, None)
+		self._libc.inotify_rm_watch(self._fd, wd)
+
+	def list_folders(self):
+		return list(self._wd_of_folder.keys())
+
+	def wait(self, timeout=None):
+		"""list of FolderEvent, waiting at most timeout seconds for the first one"""
+		readable, _, _ = select.select([self._fd], [], [], timeout)
+		if not readable:
+			return []
+
+		list_events = []
+		while True:
+			try:
+				buffer = os.read(self._fd, EVENT_BUFFER_SIZE)
+			except BlockingIOError:
+				break
+			list_events += self._parse(buffer)
+		return list_events
+
+	def _parse(self, buffer):
+		list_events = []
+		offset = 0
+		while offset < len(buffer):
+			wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+			offset += EVENT_HEADER.size
+			name = buffer[offset: offset + length].rstrip(b'\0')
+			offset += length
+
+			if mask & IN_Q_OVERFLOW:
+				# events were lost, all the folders must be scanned again
+				list_events += [FolderEvent(_folder) for _folder in self._wd_of_folder.keys()]
+				continue
+
+			folder = self._folder_of_wd.get(wd)
+			if folder is None:
+				continue
+
+			if mask & IN_IGNORED:
+				# folder removed (or unmounted), the watch does not exist anymore
+				self._folder_of_wd.pop(wd, None)
+				self._wd_of_folder.pop(folder, None)
+				continue
+
+			if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+				list_events.append(FolderEvent(folder))
+			else:
+				list_events.append(FolderEvent(folder,
+											   name=os.fsdecode(name),
+											   is_dir=bool(mask & IN_ISDIR)))
+		return list_events
+
+	def close(self):
+		if self._fd >= 0:
+			os.close(self._fd)
+			self._fd = -1
+		self._folder_of_wd = {}
+		self._wd_of_folder = {}
+
+
+class PollingWatcher:
+	"""same interface as InotifyWatcher, but compares the content (name, size and modification time of
+	each entry) of the folders every poll_interval seconds"""
+
+	def __init__(self, poll_interval=10):
+		self.poll_interval = poll_interval
+		self._snapshot_of_folder = {}
+
+	@staticmethod
+	def _snapshot(folder):
+		snapshot = {}
+		try:
+			with os.scandir(folder) as it:
+				for _entry in it:
+					try:
+						_stat = _entry.stat()
+					except OSError:
+						continue
+					snapshot[_entry.name] = (_stat.st_mtime_ns, _stat.st_size, _entry.is_dir())
+		except OSError:
+			return None
+		return snapshot
+
+	def add_folder(self, folder):
+		if folder in self._snapshot_of_folder:
+			return
+		snapshot = self._snapshot(folder)
+		if snapshot is None:
+			raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), folder)
+		self._snapshot_of_folder[folder] = snapshot
+
+	def remove_folder(self, folder):
+		self._snapshot_of_folder.pop(folder, None)
+
+	def list_folders(self):
+		return list(self._snapshot_of_folder.keys())
+
+	def wait(self, timeout=None):
+		_timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+		time.sleep(max(_timeout, 0))
+
+		list_events = []
+		for _folder, _previous_snapshot in list(self._snapshot_of_folder.items()):
+			_snapshot = self._snapshot(_folder)
+			if _snapshot is None:
+				self._snapshot_of_folder.pop(_folder)
+				list_events.append(FolderEvent(_folder))
+				continue
+			self._snapshot_of_folder[_folder] = _snapshot
+
+			for _name, _infos in _snapshot.items():
+				if _previous_snapshot.get(_name) != _infos:
+					list_events.append(FolderEvent(_folder, name=_name, is_dir=_infos[2]))
+			for _name, _infos in _previous_snapshot.items():
+				if _name not in _snapshot:
+					list_events.append(FolderEvent(_folder, name=_name, is_dir=_infos[2]))
+		return list_events
+
+	def close(self):
+		self._snapshot_of_folder = {}
+
+
+def get_folder_watcher(use_polling=False, poll_interval=10):
+	"""InotifyWatcher when available, PollingWatcher otherwise (or if use_polling)"""
+	if not use_polling:
+		try:
+			return InotifyWatcher()
+		except (OSError, AttributeError, TypeError) as error:
+			logging.info(f"inotify is not available ({error}), polling the folders every {poll_interval}s")
+	return PollingWatcher(poll_interval=poll_interval)
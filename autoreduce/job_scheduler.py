@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from worker_client import WORKER_UNAVAILABLE_RETURNCODE
+
+# status of the jobs
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# resources needed by one reconstruction, used to compute how many can run at the same time
+DEFAULT_CORES_PER_JOB = 8
+DEFAULT_MEMORY_PER_JOB_GB = 32
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_DELAY = 300
+# progressive reconstructions spend most of their time waiting for the projections of the scan, they run in
+# their own slots, not counted in max_jobs
+DEFAULT_MAX_PROGRESSIVE_JOBS = 2
+# each job runs on its own cores_per_job cores (when enough of them are free)
+DEFAULT_PIN_CORES = False
+
+# number of finished jobs kept in the queue file
+MAX_NUMBER_OF_FINISHED_JOBS = 500
+
+
+def get_available_memory_gb():
+	"""memory (GB) that can be used by new processes without swapping"""
+	try:
+		with open("/proc/meminfo") as f:
+			for _line in f:
+				if _line.startswith("MemAvailable:"):
+					return int(_line.split()[1]) / 1024 ** 2
+	except (OSError, ValueError, IndexError):
+		pass
+	return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 3
+
+
+def get_total_memory_gb():
+	return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 3
+
+
+def get_default_max_jobs(cores_per_job=DEFAULT_CORES_PER_JOB, memory_per_job_gb=DEFAULT_MEMORY_PER_JOB_GB):
+	"""number of jobs the node can run at the same time (at least 1)"""
+	max_jobs_cores = (os.cpu_count() or 1) // max(cores_per_job, 1)
+	max_jobs_memory = int(get_total_memory_gb() // max(memory_per_job_gb, 1))
+	return max(1, min(max_jobs_cores, max_jobs_memory))
+
+
+def _is_process_alive(pid):
+	if not pid:
+		return False
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
+
+class JobScheduler:
+	"""runs the reconstructions at the same time, as many as the node can take
+
+	o_scheduler = JobScheduler(queue_file=...)
+	o_scheduler.submit(folder, cmd)
+	o_scheduler.update()   # to call regularly: starts the pending jobs, collects the finished ones
+
+	The queue (pending, running and finished jobs) is a json file, shared by all the schedulers of the node
+	(a daemon and the cron job for example) through a file lock, so the limit is on all the jobs of the node
+	and the pending jobs survive a restart. The jobs of a scheduler that stopped are collected by the next
+	one. A failed job is started again, max_retries times, after retry_delay seconds.
+
+	A job is started when less than max_jobs jobs are running and the node has memory_per_job_gb available
+	(the first job is always started). The progressive jobs (running during the acquisition of their scan)
+	have their own limit, max_progressive_jobs, so they do not hold back the reconstructions of the scans
+	already complete. With pin_cores, each job is restricted to cores_per_job cores no other
+	running job uses (the reconstruction sizes its threads on them).
+
+	on_status_change(folder, status, job) is called each time a job starts (running), ends (done or failed)
+	or waits to be tried again (pending).
+	"""
+
+	def __init__(self, queue_file, max_jobs=None, cores_per_job=DEFAULT_CORES_PER_JOB,
+				 memory_per_job_gb=DEFAULT_MEMORY_PER_JOB_GB, max_retries=DEFAULT_MAX_RETRIES,
+				 retry_delay=DEFAULT_RETRY_DELAY, pin_cores=DEFAULT_PIN_CORES,
+				 max_progressive_jobs=DEFAULT_MAX_PROGRESSIVE_JOBS, on_status_change=None):
+		self.queue_file = queue_file
+		self.lock_file = queue_file + ".lock"
+		self.on_status_change = on_status_change
+
+		# processes started by this scheduler, by folder
+		self._processes = {}
+
+		self.configure(max_jobs=max_jobs, cores_per_job=cores_per_job, memory_per_job_gb=memory_per_job_gb,
+					   max_retries=max_retries, retry_delay=retry_delay, pin_cores=pin_cores,
+					   max_progressive_jobs=max_progressive_jobs)
+
+	def configure(self, max_jobs=None, cores_per_job=DEFAULT_CORES_PER_JOB,
+				  memory_per_job_gb=DEFAULT_MEMORY_PER_JOB_GB, max_retries=DEFAULT_MAX_RETRIES,
+				  retry_delay=DEFAULT_RETRY_DELAY, pin_cores=DEFAULT_PIN_CORES,
+				  max_progressive_jobs=DEFAULT_MAX_PROGRESSIVE_JOBS):
+		self.max_jobs = max_jobs if max_jobs else get_default_max_jobs(cores_per_job=cores_per_job,
+																		 memory_per_job_gb=memory_per_job_gb)
+		self.cores_per_job = cores_per_job
+		self.memory_per_job_gb = memory_per_job_gb
+		self.pin_cores = pin_cores
+		self.max_progressive_jobs = max_progressive_jobs
+		self.max_retries = max_retries
+		self.retry_delay = retry_delay
+		logging.info(f"job scheduler: {self.max_jobs} job(s) at the same time, queue file {self.queue_file}")
+
+	def configure_from_config(self, yml_file):
+		"""use the (optional) 'job_scheduler' section of the autoreduce config file"""
+		config = yml_file.get('job_scheduler') or {}
+		self.configure(max_jobs=config.get('max_jobs'),
+					   cores_per_job=config.get('cores_per_job', DEFAULT_CORES_PER_JOB),
+					   memory_per_job_gb=config.get('memory_per_job_gb', DEFAULT_MEMORY_PER_JOB_GB),
+					   max_retries=config.get('max_retries', DEFAULT_MAX_RETRIES),
+					   retry_delay=config.get('retry_delay', DEFAULT_RETRY_DELAY),
+					   pin_cores=config.get('pin_cores', DEFAULT_PIN_CORES),
+					   max_progressive_jobs=config.get('max_progressive_jobs', DEFAULT_MAX_PROGRESSIVE_JOBS))
+
+	@contextmanager
+	def _locked_queue(self):
+		"""list of jobs of the queue file, saved back when leaving the context"""
+		with open(self.lock_file, 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				list_jobs = self._load()
+				yield list_jobs
+				self._save(list_jobs)
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def _load(self):
+		if not os.path.exists(self.queue_file):
+			return []
+		try:
+			with open(self.queue_file) as f:
+				return json.load(f)['jobs']
+		except (OSError, ValueError, KeyError) as error:
+			logging.info(f"-> unable to read the job queue {self.queue_file} ({error}), starting a new one!")
+			return []
+
+	def _save(self, list_jobs):
+		list_finished = [_job for _job in list_jobs if _job['status'] in (DONE, FAILED)]
+		if len(list_finished) > MAX_NUMBER_OF_FINISHED_JOBS:
+			ids_too_old = {id(_job) for _job in list_finished[:len(list_finished) - MAX_NUMBER_OF_FINISHED_JOBS]}
+			list_jobs[:] = [_job for _job in list_jobs if id(_job) not in ids_too_old]
+
+		_fd, _tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.queue_file)), suffix=".tmp")
+		try:
+			with os.fdopen(_fd, 'w') as f:
+				json.dump({'jobs': list_jobs}, f, indent=2)
+			os.replace(_tmp_file, self.queue_file)
+		except BaseException:
+			if os.path.exists(_tmp_file):
+				os.remove(_tmp_file)
+			raise
+
+	def submit(self, folder, cmd, progressive=False):
+		"""add the reconstruction of the folder to the queue (unless it is already pending or running)
+
+		progressive: the reconstruction starts during the acquisition of the scan (see max_progressive_jobs)
+		"""
+		with self._locked_queue() as list_jobs:
+			for _job in list_jobs:
+				if (_job['folder'] == folder) and (_job['status'] in (PENDING, RUNNING)):
+					logging.info(f"-> {folder} is already {_job['status']}!")
+					return
+			list_jobs.append({'folder': folder,
+							  'cmd': cmd,
+							  'progressive': progressive,
+							  'status': PENDING,
+							  'attempts': 0,
+							  'submitted_time': time.time(),
+							  'next_start_time': 0,
+							  'start_time': None,
+							  'end_time': None,
+							  'returncode': None,
+							  'pid': None,
+							  'cores': None,
+							  'owner_pid': None})
+		logging.info(f"> {folder} added to the job queue")
+
+	def update(self):
+		"""collect the finished jobs and start the pending ones the node can take"""
+		with self._locked_queue() as list_jobs:
+			for _job in list_jobs:
+				if _job['status'] == RUNNING:
+					self._update_running_job(_job)
+
+			list_running_jobs = [_job for _job in list_jobs if _job['status'] == RUNNING]
+			number_of_running_jobs = len([_job for _job in list_running_jobs if not _job.get('progressive')])
+			number_of_running_progressive_jobs = len(list_running_jobs) - number_of_running_jobs
+			now = time.time()
+			for _job in list_jobs:
+				if (_job['status'] != PENDING) or (_job['next_start_time'] > now):
+					continue
+				if _job.get('progressive'):
+					if number_of_running_progressive_jobs >= self.max_progressive_jobs:
+						continue
+				elif number_of_running_jobs >= self.max_jobs:
+					continue
+				if (number_of_running_jobs + number_of_running_progressive_jobs > 0) and \
+						(get_available_memory_gb() < self.memory_per_job_gb):
+					logging.info(f"-> not enough memory available to start another reconstruction yet")
+					break
+				self._start_job(_job, cores=self._get_free_cores(list_jobs) if self.pin_cores else None)
+				if _job.get('progressive'):
+					number_of_running_progressive_jobs += 1
+				else:
+					number_of_running_jobs += 1
+
+	def _get_free_cores(self, list_jobs):
+		"""cores_per_job cores not used by the running jobs, None if there are not enough of them"""
+		list_used = set()
+		for _job in list_jobs:
+			if (_job['status'] == RUNNING) and _job.get('cores'):
+				list_used.update(_job['cores'])
+		list_free = [_core for _core in sorted(os.sched_getaffinity(0)) if _core not in list_used]
+		if len(list_free) < self.cores_per_job:
+			logging.info(f"-> only {len(list_free)} cores free, the next reconstruction is not pinned!")
+			return None
+		return list_free[:self.cores_per_job]
+
+	def _start_job(self, job, cores=None):
+		job['attempts'] += 1
+		logging.info(f"> running (attempt {job['attempts']}) {job['cmd']}")
+		if cores:
+			logging.info(f"-> on the cores {cores}")
+		# the affinity is inherited by all the processes the job starts
+		preexec_fn = (lambda: os.sched_setaffinity(0, cores)) if cores else None
+		proc = subprocess.Popen(job['cmd'], shell=True, stdin=subprocess.DEVNULL, universal_newlines=True,
+								preexec_fn=preexec_fn)
+		self._processes[job['folder']] = proc
+		job.update(status=RUNNING, start_time=time.time(), end_time=None, returncode=None,
+				   pid=proc.pid, owner_pid=os.getpid(), cores=cores)
+		self._notify(job)
+
+	def _notify(self, job):
+		if self.on_status_change is None:
+			return
+		try:
+			self.on_status_change(job['folder'], job['status'], job)
+		except Exception as error:
+			logging.info(f"-> unable to record the {job['status']} status of {job['folder']}: {error}")
+
+	def _update_running_job(self, job):
+		if job['owner_pid'] == os.getpid():
+			proc = self._processes.get(job['folder'])
+			if proc is None:
+				# pid recycled from a previous scheduler, the job is lost
+				returncode = -1
+			else:
+				returncode = proc.poll()
+				if returncode is None:
+					return
+				del self._processes[job['folder']]
+		elif _is_process_alive(job['owner_pid']):
+			# job of another scheduler
+			return
+		elif _is_process_alive(job['pid']):
+			# the scheduler that started the job stopped, but the reconstruction is still running
+			return
+		else:
+			# the scheduler that started the job stopped before the end of the job, the result is unknown so
+			# the job is considered failed
+			returncode = -1
+
+		job['end_time'] = time.time()
+		job['returncode'] = returncode
+		if returncode == 0:
+			job['status'] = DONE
+			logging.info(f"> reconstruction of {job['folder']} done")
+		elif returncode == WORKER_UNAVAILABLE_RETURNCODE:
+			# the reconstruction worker could not be reached, the reconstruction did not run
+			job['attempts'] -= 1
+			job['status'] = PENDING
+			job['next_start_time'] = time.time() + self.retry_delay
+			logging.info(f"> reconstruction worker not available for {job['folder']}, trying again in "
+						 f"{self.retry_delay}s")
+		elif job['attempts'] <= self.max_retries:
+			job['status'] = PENDING
+			job['next_start_time'] = time.time() + self.retry_delay
+			logging.info(f"> reconstruction of {job['folder']} failed (return code {returncode}), "
+						 f"trying again in {self.retry_delay}s")
+		else:
+			job['status'] = FAILED
+			logging.info(f"> reconstruction of {job['folder']} failed (return code {returncode}), giving up "
+						 f"after {job['attempts']} attempts!")
+		self._notify(job)
+
+	def has_unfinished_jobs(self, list_folders=None):
+		"""True if one of the folders (all the folders by default) is still pending or running"""
+		with self._locked_queue() as list_jobs:
+			for _job in list_jobs:
+				if (list_folders is not None) and (_job['folder'] not in list_folders):
+					continue
+				if _job['status'] in (PENDING, RUNNING):
+					return True
+		return False
+
+	def wait(self, list_folders=None, poll_interval=5):
+		"""run the jobs until all the folders are done or failed"""
+		while True:
+			self.update()
+			if not self.has_unfinished_jobs(list_folders=list_folders):
+				return
+			time.sleep(poll_interval)
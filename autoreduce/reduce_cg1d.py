@@ -1,11 +1,15 @@
 import os
+import sys
 import yaml
 import logging
 import glob
-import json
-import subprocess
 import time
-from PIL import Image
+import shlex
+import argparse
+
+from folder_watcher import get_folder_watcher
+from job_scheduler import JobScheduler
+from state_store import StateStore, SEEN, INCOMPLETE, DONE, LIST_STATUS_HANDLED
 
 DEBUG = False
 LOG_FILE_MAX_LINES_NUMBER = 1000
@@ -25,11 +29,33 @@ if DEBUG:
 else:
 	CMD_FOLDER = "/SNS/users/j35/git/rockit/rockit/"
 
+# the end of the scans is found by rockit/scan_progress.py, shared with the progressive reconstruction
+if CMD_FOLDER not in sys.path:
+	sys.path.append(CMD_FOLDER)
+from scan_progress import ScanProgress, DEFAULT_ANGULAR_RANGE
+
 CONFIG_FILE = os.path.join(HOME_FOLDER, "autoreduce_cg1d_config.yaml")
 JSON_BASENAME = "ct_scans_folder_processed.json"
 LOG_FILE = os.path.join(HOME_FOLDER, "reduce_cg1d.log")
+# reconstructions pending, running and done on this node
+JOB_QUEUE_FILE = os.path.join(HOME_FOLDER, "autoreduce_job_queue.json")
+# status of each scan folder (seen, incomplete, queued, running, done, failed)
+STATE_FILE = os.path.join(HOME_FOLDER, "autoreduce_state.sqlite")
+
+# daemon mode: the incomplete scan folders are checked every CHECK_INTERVAL seconds (and polled that often
+# without inotify), and the whole ct_scans folder is listed again every RESCAN_INTERVAL seconds in case an
+# event was missed (ex: files written by another machine on a network file system)
+CHECK_INTERVAL = 10
+RESCAN_INTERVAL = 300
 
 CMD = "source /opt/anaconda/etc/profile.d/conda.sh; conda activate /SNS/users/j35/.conda/envs/imars3d_jean; python " + os.path.join(CMD_FOLDER, "rockit_imars3d_cli.py")
+# daemon mode with progressive_reconstruction on: started as soon as the first projection of the scan is there
+PROGRESSIVE_CMD = "source /opt/anaconda/etc/profile.d/conda.sh; conda activate /SNS/users/j35/.conda/envs/imars3d_jean; python " + os.path.join(CMD_FOLDER, "rockit_cli.py") + " --progressive"
+# reconstruction_worker socket set in the config: the reconstructions are sent to the reconstruction worker
+# (rockit/reconstruction_worker.py, started beforehand in the imars3d environment) which already has the
+# scientific python stack imported. Whether the worker is up is checked when the job starts (the reconstruction
+# is started as before, with -fallback, when it is not)
+WORKER_CLIENT_CMD = "python " + os.path.join(HOME_FOLDER, "worker_client.py")
 
 
 def main():
@@ -48,10 +74,70 @@ def main():
 	logging.info(f"IPTS_FOLDER: {IPTS_FOLDER}")
 	logging.info(f"CMD_FOLDER: {CMD_FOLDER}")
 
+	yml_file = load_config()
+	if yml_file is None:
+		return False
+
+	folders = get_ct_scans_folder(yml_file)
+	if folders is None:
+		return False
+	ipts, ipts_folder, ct_scans_folder = folders
+
+	# check the input_folder and list all the folders there
+	list_dir = get_list_dir(ct_scans_folder)
+	for _dir in list_dir:
+		logging.info(f"--> {os.path.basename(_dir)}")
+
+	o_store = StateStore(STATE_FILE)
+	# folders recorded by the previous versions
+	o_store.import_json(get_json_file(ipts_folder), ipts)
+
+	if len(list_dir) == 0:
+		logging.info(f"-> 0 folder found. exit now!")
+		logging.info(f"... Exiting auto-reconstruction!")
+		return
+
+	# retrieving the list of new folders
+	list_new_folders = []
+	acquisition_time_coefficient = yml_file['acquisition_time_coefficient']
+	for _folder in list_dir:
+		_folder = os.path.normpath(_folder)
+		_status = o_store.get_status(_folder)
+		if (_status == DONE) and o_store.reopen_if_changed(_folder):
+			logging.info(f"{_folder} changed since its reconstruction")
+			_status = SEEN
+		if _status in LIST_STATUS_HANDLED:
+			continue
+		if _status is None:
+			logging.info(f"{_folder} is a new folder")
+			o_store.mark_seen(_folder, ipts)
+		if is_folder_incomplete(_folder, acquisition_time_coefficient=acquisition_time_coefficient,
+								angular_range=yml_file.get('scan_angular_range', DEFAULT_ANGULAR_RANGE)):
+			logging.info(f"-> {_folder} is not complete!")
+			o_store.set_status(_folder, INCOMPLETE)
+			continue
+		if o_store.claim(_folder):
+			list_new_folders.append(_folder)
+
+	# # retrieve the list of tiff files in the new folders and for each, launch a reconstruction
+	if len(list_new_folders) == 0:
+		logging.info(f"-> no new complete folder, exit now!")
+		logging.info(f"... Exiting auto-reconstruction!")
+		return
+
+	o_scheduler = JobScheduler(JOB_QUEUE_FILE, on_status_change=o_store.update_from_job)
+	o_scheduler.configure_from_config(yml_file)
+	for _folder in list_new_folders:
+		o_scheduler.submit(_folder, get_reconstruction_command(yml_file, ipts, _folder))
+	o_scheduler.wait(list_folders=list_new_folders)
+
+
+def load_config():
+	"""content of the config file, None if it does not exist or if the autoreduction is off"""
 	if not os.path.exists(CONFIG_FILE):
 		logging.info(f"config file {CONFIG_FILE} does not exist!")
 		logging.info(f"... Exiting auto-reconstruction!")
-		return False
+		return None
 
 	with open(CONFIG_FILE, 'r') as stream:
 		yml_file = yaml.safe_load(stream)
@@ -60,8 +146,13 @@ def main():
 	if autoreduce_flag is False:
 		logging.info(f"autoreduction is off!")
 		logging.info(f"... Exiting auto-reconstruction!")
-		return False
+		return None
 
+	return yml_file
+
+
+def get_ct_scans_folder(yml_file):
+	"""(ipts, ipts_folder, ct_scans_folder), None if one of the folders does not exist"""
 	ipts = yml_file['DataPath']['ipts']
 	logging.info(f"> IPTS: {ipts}")
 
@@ -70,7 +161,7 @@ def main():
 	if not os.path.exists(ipts_folder):
 		logging.info(f"-> IPTS folder does not exist!")
 		logging.info(f"... Exiting auto-reconstruction!")
-		return False
+		return None
 
 	logging.info(f"-> IPTS folder has been located!")
 
@@ -78,9 +169,12 @@ def main():
 	if not os.path.exists(ct_scans_folder):
 		logging.info(f"-> ct_scans folder does not exist!")
 		logging.info(f"... Exiting auto-reconstruction!")
-		return False
+		return None
 
-	# check the input_folder and list all the folders there
+	return ipts, ipts_folder, ct_scans_folder
+
+
+def get_list_dir(ct_scans_folder):
 	logging.info(f"> Retrieving the list of folders within {ct_scans_folder}!")
 	list_file_dir = glob.glob(os.path.join(ct_scans_folder, "*"))
 	list_dir = []
@@ -88,55 +182,16 @@ def main():
 	for _file_dir in list_file_dir:
 		if os.path.isdir(_file_dir):
 			list_dir.append(_file_dir)
-	for _dir in list_dir:
-		logging.info(f"--> {os.path.basename(_dir)}")
-
-	json_file = ipts_folder + "/shared/autoreduce/" + JSON_BASENAME
-	logging.info(f"json_file: {json_file}")
-
-	if len(list_dir) == 0:
-		logging.info(f"-> 0 folder found. clearing json_file. exit now!")
-		if os.path.exists(json_file):
-			os.remove(json_file)
-		logging.info(f"... Exiting auto-reconstruction!")
-		return
+	return list_dir
 
-	if not os.path.exists(json_file):
-		# if first time retrieving folders
-		logging.info(f"> First time retrieving folders!")
-		list_folders_previously_loaded = []
-	else:
-		# loading list of folders previously recorded
-		with open(json_file) as f:
-			config = json.load(f)
-
-		# checking that if we have the same number of folders, we are done here
-		list_folders_previously_loaded = config['list_folders']
-		if len(list_folders_previously_loaded) == len(list_dir):
-			logging.info(f"-> We still have the same number of folders, exit now!")
-			logging.info(f"... Exiting auto-reconstruction!")
-			return
-
-	# we have at least 1 new folder at this point
-	logging.info(f"> We have at least 1 new folder in the output dir!")
 
-	# retrieving the list of new folders
-	list_new_folders = []
-	acquisition_time_coefficient = yml_file['acquisition_time_coefficient']
-	for _folder in list_dir:
-		if not (_folder in list_folders_previously_loaded):
-			logging.info(f"{_folder} is a new folder")
-			if is_folder_incomplete(_folder, acquisition_time_coefficient=acquisition_time_coefficient):
-				logging.info(f"-> this folder is not complete! Exit now!")
-				logging.info(f"... Exiting auto-reconstruction!")
-				continue
-			list_new_folders.append(_folder)
+def get_json_file(ipts_folder):
+	"""list of the folders processed, kept by the previous versions (see StateStore.import_json)"""
+	return ipts_folder + "/shared/autoreduce/" + JSON_BASENAME
 
-	# update tmp file with new list of folders
-	config = {'list_folders': list_dir}
-	with open(json_file, 'w') as f:
-		json.dump(config, f)
 
+def get_command_options(yml_file):
+	"""(cmd_ob, cmd_roi) options of the command line"""
 	logging.info("Building the command line:")
 
 	# roi
@@ -182,55 +237,232 @@ def main():
 			cmd_ob = f"-maximum_time_difference_between_sample_and_ob_acquisition {ob_minutes}"
 	logging.info(f" {cmd_ob =}")
 
-	# # retrieve the list of tiff files in the new folders and for each, launch a reconstruction
-	for _folder in list_new_folders:
-		cmd = f"{CMD} {cmd_ob} {cmd_roi} {ipts} {_folder}"
-		logging.info(f"> running {cmd}")
-		proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, universal_newlines=True)
-		proc.communicate()
+	return cmd_ob, cmd_roi
 
 
-def is_folder_incomplete(folder, acquisition_time_coefficient=5):
-	"""this is where we are checking that
-	current_time_stamp > last_image_time_stamp + coeff * images_acquisition_time
+def get_reconstruction_command(yml_file, ipts, folder, progressive=False):
+	cmd_ob, cmd_roi = get_command_options(yml_file)
+
+	worker_socket = (yml_file.get('reconstruction_worker') or {}).get('socket')
+
+	if progressive:
+		cmd_progressive = f"-acquisition_time_coefficient {yml_file['acquisition_time_coefficient']}"
+		if yml_file.get('scan_angular_range'):
+			cmd_progressive += f" -scan_angular_range {yml_file['scan_angular_range']}"
+		cmd = f"{PROGRESSIVE_CMD} {cmd_progressive} {cmd_ob} {cmd_roi} {ipts} {folder}"
+		if worker_socket:
+			return f"{WORKER_CLIENT_CMD} -socket {worker_socket} -fallback {shlex.quote(cmd)} rockit_cli --progressive {cmd_progressive} {cmd_ob} {cmd_roi} {ipts} {folder}"
+		return cmd
+	cmd = f"{CMD} {cmd_ob} {cmd_roi} {ipts} {folder}"
+	if worker_socket:
+		return f"{WORKER_CLIENT_CMD} -socket {worker_socket} -fallback {shlex.quote(cmd)} rockit_imars3d_cli {cmd_ob} {cmd_roi} {ipts} {folder}"
+	return cmd
+
+
+class AutoreduceDaemon:
+	"""long running replacement of the cron job: the ct_scans folder of the IPTS (and each of its scan
+	folders not reconstructed yet) is watched, and the reconstruction of a scan is launched as soon as its
+	folder is complete (see is_folder_incomplete).
+
+	The config file is read again only when it changes, and the status of the folders is kept in the same
+	state store as the cron job, so the two can be swapped (or run together).
 	"""
 
-	# list all tiff from this folder
-	list_tiff = glob.glob(os.path.join(folder, "*.tif*"))
-	if len(list_tiff) == 0:
-		return True
+	def __init__(self, use_polling=False, check_interval=CHECK_INTERVAL, rescan_interval=RESCAN_INTERVAL):
+		self.check_interval = check_interval
+		self.rescan_interval = rescan_interval
+		self.o_watcher = get_folder_watcher(use_polling=use_polling, poll_interval=check_interval)
+
+		self.config_mtime = None
+		self.yml_file = None
+		self.ipts = None
+		self.ct_scans_folder = None
+
+		# scan folder: time of its next completeness check
+		self.pending_folders = {}
+		# scan folder: its ScanProgress, so each check only looks at the new files
+		self.scan_progress = {}
+		self.o_store = StateStore(STATE_FILE)
+		self.o_scheduler = JobScheduler(JOB_QUEUE_FILE, on_status_change=self.o_store.update_from_job)
+		self.last_rescan_time = 0
+
+	def run(self):
+		logging.info(f"*** Starting the autoreduce daemon ({type(self.o_watcher).__name__})")
+		try:
+			while True:
+				self.reload_config_if_modified()
+				if (self.ct_scans_folder is None) or (time.time() - self.last_rescan_time > self.rescan_interval):
+					self.rescan()
+				self.check_pending_folders()
+				self.o_scheduler.update()
+				for _event in self.o_watcher.wait(timeout=self.get_timeout()):
+					self.handle_event(_event)
+		finally:
+			self.o_watcher.close()
+
+	def reload_config_if_modified(self):
+		try:
+			config_mtime = os.path.getmtime(CONFIG_FILE)
+		except OSError:
+			config_mtime = None
+		if config_mtime == self.config_mtime:
+			return
+
+		logging.info(f"> loading the config file {CONFIG_FILE}")
+		self.config_mtime = config_mtime
+		self.yml_file = load_config() if config_mtime is not None else None
+		if self.yml_file is not None:
+			self.o_scheduler.configure_from_config(self.yml_file)
+		self.stop_watching()
+
+	def stop_watching(self):
+		for _folder in self.o_watcher.list_folders():
+			self.o_watcher.remove_folder(_folder)
+		self.ipts = None
+		self.ct_scans_folder = None
+		self.pending_folders = {}
+		self.scan_progress = {}
+
+	def rescan(self):
+		"""(re)start watching the ct_scans folder and its new scan folders"""
+		self.last_rescan_time = time.time()
+		if self.yml_file is None:
+			return
+
+		if self.ct_scans_folder is None:
+			folders = get_ct_scans_folder(self.yml_file)
+			if folders is None:
+				return
+			self.ipts, _ipts_folder, self.ct_scans_folder = folders
+			# folders recorded by the previous versions
+			self.o_store.import_json(get_json_file(_ipts_folder), self.ipts)
+
+		try:
+			self.o_watcher.add_folder(self.ct_scans_folder)
+		except OSError as error:
+			logging.info(f"-> unable to watch {self.ct_scans_folder}: {error}")
+			self.stop_watching()
+			return
 
-	# sort by name and use the last one
-	list_tiff.sort()
-	last_image = list_tiff[-1]
+		for _folder in get_list_dir(self.ct_scans_folder):
+			self.add_pending_folder(_folder)
 
-	# get time_stamp
-	last_image_time_stamp = os.path.getatime(last_image)
+	def add_pending_folder(self, folder):
+		folder = os.path.normpath(folder)
+		if folder in self.pending_folders:
+			return
+		status = self.o_store.get_status(folder)
+		if (status == DONE) and self.o_store.reopen_if_changed(folder):
+			logging.info(f"{folder} changed since its reconstruction")
+			status = SEEN
+		if status in LIST_STATUS_HANDLED:
+			return
+		if status is None:
+			logging.info(f"{folder} is a new folder")
+			self.o_store.mark_seen(folder, self.ipts)
+		try:
+			self.o_watcher.add_folder(folder)
+		except OSError as error:
+			logging.info(f"-> unable to watch {folder}: {error}")
+		self.pending_folders[folder] = time.time()
+
+	def handle_event(self, event):
+		if os.path.normpath(event.folder) == os.path.normpath(self.ct_scans_folder or ""):
+			if event.name is None:
+				# ct_scans folder removed or events lost
+				self.last_rescan_time = 0
+			elif event.is_dir and os.path.isdir(event.path):
+				self.add_pending_folder(event.path)
+			return
 
-	# find out acquisition time for that file
+		folder = os.path.normpath(event.folder)
+		if folder not in self.pending_folders:
+			return
+		if (event.name is None) and not os.path.isdir(folder):
+			logging.info(f"-> {folder} has been removed!")
+			self.o_watcher.remove_folder(event.folder)
+			del self.pending_folders[folder]
+			self.scan_progress.pop(folder, None)
+			return
+		# a new projection, the folder may be complete now
+		self.pending_folders[folder] = min(self.pending_folders[folder], time.time())
 
-	o_image = Image.open(last_image)
-	o_dict = dict(o_image.tag_v2)
-	acquisition_metadata = o_dict[65027]
-	name, value = acquisition_metadata.split(":")
-	acquisition_time = float(value)
+	def check_pending_folders(self):
+		"""submit the reconstruction of the folders complete (or, in progressive mode, of the folders that got
+		their first projection, the reconstruction itself waits for the next ones)"""
+		if not self.pending_folders:
+			return
+		acquisition_time_coefficient = self.yml_file['acquisition_time_coefficient']
+		angular_range = self.yml_file.get('scan_angular_range', DEFAULT_ANGULAR_RANGE)
+		progressive = bool(self.yml_file.get('progressive_reconstruction', False))
+		now = time.time()
+		for _folder, _check_time in list(self.pending_folders.items()):
+			if _check_time > now:
+				continue
+			_progress = self.scan_progress.setdefault(_folder, ScanProgress(_folder, angular_range=angular_range))
+			if progressive:
+				_progress.update()
+				_is_incomplete = _progress.number_of_projections == 0
+			else:
+				try:
+					_is_incomplete = is_folder_incomplete(_folder, acquisition_time_coefficient=acquisition_time_coefficient,
+														  o_progress=_progress)
+				except (OSError, KeyError, ValueError) as error:
+					logging.info(f"-> unable to check {_folder}: {error}")
+					_is_incomplete = True
+			if _is_incomplete:
+				if self.o_store.get_status(_folder) != INCOMPLETE:
+					self.o_store.set_status(_folder, INCOMPLETE)
+				self.pending_folders[_folder] = now + self.check_interval
+				continue
 
-	# get current time_stamp
-	current_time_stamp = time.time()
+			if progressive:
+				logging.info(f"-> {_folder} got its first projection, starting the progressive reconstruction!")
+			else:
+				logging.info(f"-> {_folder} is complete!")
+			self.o_watcher.remove_folder(_folder)
+			del self.pending_folders[_folder]
+			del self.scan_progress[_folder]
+			if not self.o_store.claim(_folder):
+				logging.info(f"-> {_folder} is already handled by another process!")
+				continue
+			self.o_scheduler.submit(_folder, get_reconstruction_command(self.yml_file, self.ipts, _folder,
+																	   progressive=progressive),
+									progressive=progressive)
 
-	# if (current_time_stamp > last_image_time_stamp + acquisition_time_coefficient * image_acquisition_time)
-	#     return False
-	# else:
-	#     return True
-	if current_time_stamp > (last_image_time_stamp + acquisition_time_coefficient * acquisition_time):
-		return False
-	else:
-		logging.info(f"-> current_time_stamp: {current_time_stamp}")
-		logging.info(f"-> last_image_time_stamp: {last_image_time_stamp}")
-		logging.info(f"-> image_acquisition_time: {acquisition_time}")
-		logging.info(f"-> acquisition_time_coefficient: {acquisition_time_coefficient}")
+	def get_timeout(self):
+		timeout = self.check_interval
+		if self.pending_folders:
+			timeout = min(timeout, min(self.pending_folders.values()) - time.time())
+		return max(timeout, 0)
+
+
+def is_folder_incomplete(folder, acquisition_time_coefficient=5, angular_range=DEFAULT_ANGULAR_RANGE, o_progress=None):
+	"""this is where we are checking that the projection at the last angle of the scan has been written
+	(see ScanProgress), or, when the file names can not tell, that
+	current_time_stamp > last_image_time_stamp + coeff * images_acquisition_time
+
+	o_progress: ScanProgress of the folder kept from the previous checks, so only the new files are looked at
+	"""
+	if o_progress is None:
+		o_progress = ScanProgress(folder, angular_range=angular_range)
+	o_progress.update()
+	if o_progress.number_of_projections == 0:
 		return True
 
+	if o_progress.is_complete(acquisition_time_coefficient=acquisition_time_coefficient):
+		return False
+
+	if o_progress.is_idle(acquisition_time_coefficient=acquisition_time_coefficient):
+		logging.info(f"-> no new image for {acquisition_time_coefficient} x {o_progress.get_exposure_time()}s, "
+					 f"the scan is considered complete with {o_progress.number_of_projections} images "
+					 f"({o_progress.get_expected_number_of_projections()} expected)")
+		return False
+
+	logging.info(f"-> {o_progress.number_of_projections} images "
+				 f"({o_progress.get_expected_number_of_projections()} expected)")
+	return True
+
 
 def read_ascii(file_name):
 	with open(file_name, 'r') as f:
@@ -243,8 +475,24 @@ if __name__ == "__main__":
 						filemode='a',  # 'w'
 						format="[%(levelname)s] - %(asctime)s - %(message)s",
 						level=logging.INFO)
-	logging.info("*** Starting checking for new files - version 1.0")
-	main()
+	parser = argparse.ArgumentParser(description="Launch the reconstruction of the new CT scans of the IPTS")
+	parser.add_argument('--daemon',
+						action='store_true',
+						help="Keep running and watch the ct_scans folder instead of checking it once (cron job)")
+	parser.add_argument('--polling',
+						action='store_true',
+						help="Daemon mode: poll the folders instead of using inotify")
+	parser.add_argument('-check_interval',
+						type=float,
+						default=CHECK_INTERVAL,
+						help="Daemon mode: seconds between two checks of an incomplete scan folder")
+	args = parser.parse_args()
+
+	if args.daemon:
+		AutoreduceDaemon(use_polling=args.polling, check_interval=args.check_interval).run()
+	else:
+		logging.info("*** Starting checking for new files - version 1.0")
+		main()
 
 
 # python rockit/rockit_cli.py 23788 /Users/j35/IPTS/HFIR/CG1D/IPTS-23788/raw/ct_scans/Aug24_2020
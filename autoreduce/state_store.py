@@ -0,0 +1,217 @@
+import os
+import glob
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+
+# status of a scan folder
+SEEN = "seen"
+INCOMPLETE = "incomplete"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# the folders in one of those status are not looked at anymore by the autoreduction
+LIST_STATUS_HANDLED = [QUEUED, RUNNING, DONE, FAILED]
+
+# seconds a process waits for another one to release the database
+BUSY_TIMEOUT = 30
+
+COLUMNS = ['folder', 'ipts', 'status', 'first_seen_time', 'status_time', 'queued_time', 'start_time', 'end_time',
+		   'duration', 'number_of_files', 'fingerprint', 'attempts', 'returncode', 'worker', 'message']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+	folder TEXT PRIMARY KEY,
+	ipts TEXT,
+	status TEXT NOT NULL,
+	first_seen_time REAL,
+	status_time REAL,
+	queued_time REAL,
+	start_time REAL,
+	end_time REAL,
+	duration REAL,
+	number_of_files INTEGER,
+	fingerprint TEXT,
+	attempts INTEGER DEFAULT 0,
+	returncode INTEGER,
+	worker TEXT,
+	message TEXT
+);
+CREATE INDEX IF NOT EXISTS folders_ipts_status ON folders (ipts, status);
+"""
+
+
+def get_worker_name():
+	return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_folder_fingerprint(folder):
+	"""(number of tiff files, sha1 of their names, sizes and modification times)"""
+	sha1 = hashlib.sha1()
+	list_files = sorted(glob.glob(os.path.join(folder, "*.tif*")))
+	for _file in list_files:
+		try:
+			_stat = os.stat(_file)
+		except OSError:
+			continue
+		sha1.update(f"{os.path.basename(_file)}:{_stat.st_size}:{_stat.st_mtime_ns}\n".encode())
+	return len(list_files), sha1.hexdigest()
+
+
+class StateStore:
+	"""status of each scan folder of the autoreduction (seen, incomplete, queued, running, done, failed), with
+	its timestamps, fingerprint (files when it was queued) and reconstruction duration, in a sqlite database
+
+	o_store = StateStore(db_file)
+	if o_store.get_status(folder) is None:
+		o_store.mark_seen(folder, ipts)
+	if o_store.claim(folder):      # only one of the processes sharing the database gets True
+		...submit the reconstruction
+
+	Each change is its own transaction, so several processes (the daemon, the cron job, the job scheduler)
+	can read and write it at the same time. The write ahead log (wal) lets readers work while a process
+	writes, but needs all the processes on the same machine: use wal=False when the database is on a network
+	file system shared by several machines.
+	"""
+
+	def __init__(self, db_file, wal=True):
+		self.db_file = db_file
+		# the connection is only used by one thread at a time (the one running the daemon or the cron job)
+		self._connection = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, isolation_level=None,
+										   check_same_thread=False)
+		self._connection.row_factory = sqlite3.Row
+		self._connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+		if wal:
+			self._connection.execute("PRAGMA journal_mode = WAL")
+		self._connection.executescript(SCHEMA)
+
+	def close(self):
+		self._connection.close()
+
+	def _write(self, query, parameters=()):
+		"""run the query in its own (immediate) transaction, returns the number of rows changed"""
+		cursor = self._connection.cursor()
+		cursor.execute("BEGIN IMMEDIATE")
+		try:
+			cursor.execute(query, parameters)
+			rowcount = cursor.rowcount
+			cursor.execute("COMMIT")
+		except BaseException:
+			cursor.execute("ROLLBACK")
+			raise
+		return rowcount
+
+	def get_folder(self, folder):
+		"""dict of the columns of the folder, None if it was never seen"""
+		row = self._connection.execute("SELECT * FROM folders WHERE folder = ?", (folder,)).fetchone()
+		return dict(row) if row is not None else None
+
+	def get_status(self, folder):
+		row = self._connection.execute("SELECT status FROM folders WHERE folder = ?", (folder,)).fetchone()
+		return row['status'] if row is not None else None
+
+	def list_folders(self, ipts=None, status=None):
+		query = "SELECT * FROM folders"
+		list_conditions = []
+		parameters = []
+		if ipts is not None:
+			list_conditions.append("ipts = ?")
+			parameters.append(str(ipts))
+		if status is not None:
+			list_conditions.append("status = ?")
+			parameters.append(status)
+		if list_conditions:
+			query += " WHERE " + " AND ".join(list_conditions)
+		return [dict(_row) for _row in self._connection.execute(query + " ORDER BY first_seen_time", parameters)]
+
+	def mark_seen(self, folder, ipts):
+		"""record a new folder (nothing happens if it is already known)"""
+		now = time.time()
+		self._write("INSERT OR IGNORE INTO folders (folder, ipts, status, first_seen_time, status_time) "
+					"VALUES (?, ?, ?, ?, ?)", (folder, str(ipts), SEEN, now, now))
+
+	def set_status(self, folder, status, **kwargs):
+		"""change the status of the folder, and any other column given (ex: message="...")"""
+		list_unknown = [_key for _key in kwargs.keys() if _key not in COLUMNS]
+		if list_unknown:
+			raise KeyError(f"unknown columns {list_unknown}")
+		kwargs['status'] = status
+		kwargs['status_time'] = time.time()
+		assignments = ", ".join([f"{_key} = ?" for _key in kwargs.keys()])
+		self._write(f"UPDATE folders SET {assignments} WHERE folder = ?", (*kwargs.values(), folder))
+
+	def claim(self, folder, worker=None):
+		"""mark the folder as queued, if no other process did it yet. Returns True if this process got it"""
+		number_of_files, fingerprint = get_folder_fingerprint(folder)
+		now = time.time()
+		placeholders = ", ".join(["?"] * len(LIST_STATUS_HANDLED))
+		rowcount = self._write(f"UPDATE folders SET status = ?, status_time = ?, queued_time = ?, "
+							   f"number_of_files = ?, fingerprint = ?, worker = ? "
+							   f"WHERE folder = ? AND status NOT IN ({placeholders})",
+							   (QUEUED, now, now, number_of_files, fingerprint,
+								worker if worker else get_worker_name(), folder, *LIST_STATUS_HANDLED))
+		return rowcount == 1
+
+	def reopen_if_changed(self, folder):
+		"""a done folder whose files changed since it was queued (ex: a scan queued while it paused at an end it
+		could have, then went on) goes back to seen, to be checked and reconstructed again. Returns True if it
+		did"""
+		row = self.get_folder(folder)
+		if (row is None) or (row['status'] != DONE) or not row['fingerprint']:
+			# the folders imported from the json files have no fingerprint
+			return False
+		number_of_files, fingerprint = get_folder_fingerprint(folder)
+		if fingerprint == row['fingerprint']:
+			return False
+		rowcount = self._write("UPDATE folders SET status = ?, status_time = ?, message = ? "
+							   "WHERE folder = ? AND status = ? AND fingerprint = ?",
+							   (SEEN, time.time(), f"{number_of_files} files instead of {row['number_of_files']} "
+												   f"when it was reconstructed", folder, DONE, row['fingerprint']))
+		return rowcount == 1
+
+	def update_from_job(self, folder, status, job):
+		"""follow the job of the folder (see job_scheduler.JobScheduler on_status_change)"""
+		if status == RUNNING:
+			self.set_status(folder, RUNNING, start_time=job['start_time'], end_time=None, duration=None,
+							attempts=job['attempts'], returncode=None)
+		elif status in (DONE, FAILED):
+			self.set_status(folder, status, end_time=job['end_time'],
+							duration=job['end_time'] - job['start_time'] if job['start_time'] else None,
+							attempts=job['attempts'], returncode=job['returncode'])
+		else:
+			# waiting to be tried again
+			self.set_status(folder, QUEUED, end_time=job['end_time'], attempts=job['attempts'],
+							returncode=job['returncode'])
+
+	def import_json(self, json_file, ipts):
+		"""record the folders of the json file of the previous versions (list of the folders already looked at)
+		as done, the first time the store is used for that IPTS"""
+		if not os.path.exists(json_file):
+			return
+		if self._connection.execute("SELECT 1 FROM folders WHERE ipts = ? LIMIT 1", (str(ipts),)).fetchone():
+			return
+		try:
+			with open(json_file) as f:
+				list_folders = json.load(f)['list_folders']
+		except (OSError, ValueError, KeyError) as error:
+			logging.info(f"-> unable to import {json_file}: {error}")
+			return
+
+		now = time.time()
+		cursor = self._connection.cursor()
+		cursor.execute("BEGIN IMMEDIATE")
+		try:
+			cursor.executemany("INSERT OR IGNORE INTO folders (folder, ipts, status, first_seen_time, status_time, "
+							   "message) VALUES (?, ?, ?, ?, ?, ?)",
+							   [(os.path.normpath(_folder), str(ipts), DONE, now, now, f"imported from {json_file}")
+								for _folder in list_folders])
+			cursor.execute("COMMIT")
+		except BaseException:
+			cursor.execute("ROLLBACK")
+			raise
+		logging.info(f"-> {len(list_folders)} folders imported from {json_file}")
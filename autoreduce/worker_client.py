@@ -0,0 +1,85 @@
+import os
+import json
+import socket
+import argparse
+import subprocess
+
+# seconds to wait for the answer to a ping
+PING_TIMEOUT = 5
+
+# returned when the worker can not be reached (and there is no fallback command), the job scheduler starts the
+# job again later without counting it as a failed attempt
+WORKER_UNAVAILABLE_RETURNCODE = 75
+
+
+class WorkerUnavailableError(ConnectionError):
+	"""the reconstruction worker does not listen on the socket (not started, stopped or restarting)"""
+
+
+def send_request(socket_file, request, timeout=None):
+	"""send the request (dict) to the reconstruction worker (rockit/reconstruction_worker.py) and wait for its
+	answer: {'status', 'returncode', 'duration', 'message'}"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		client.settimeout(timeout)
+		try:
+			client.connect(socket_file)
+		except OSError as error:
+			raise WorkerUnavailableError(f"unable to reach the reconstruction worker {socket_file}: {error}") \
+				from error
+		client.sendall((json.dumps(request) + "\n").encode())
+		with client.makefile('rb') as f:
+			answer = f.readline()
+	if not answer:
+		raise ConnectionError(f"no answer from the reconstruction worker {socket_file}")
+	return json.loads(answer)
+
+
+def is_worker_available(socket_file):
+	if not socket_file:
+		return False
+	try:
+		return send_request(socket_file, {'command': 'ping'}, timeout=PING_TIMEOUT)['returncode'] == 0
+	except (OSError, ValueError, KeyError):
+		return False
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run a reconstruction in the reconstruction worker and wait for it "
+												 "(the return code is the one of the reconstruction)")
+	parser.add_argument('-socket',
+						required=True,
+						help="Unix socket of the reconstruction worker")
+	parser.add_argument('-fallback',
+						default=None,
+						help="Command (shell) run instead when the worker can not be reached")
+	parser.add_argument('command',
+						choices=['rockit_cli', 'rockit_imars3d_cli', 'imars3d', 'ping'],
+						help="rockit_cli and rockit_imars3d_cli take the arguments of the command lines, imars3d "
+							 "the json config file")
+	parser.add_argument('args',
+						nargs=argparse.REMAINDER)
+	args = parser.parse_args()
+
+	if args.command == 'imars3d':
+		request = {'command': 'imars3d', 'config_file': args.args[0]}
+	else:
+		request = {'command': args.command, 'args': args.args}
+	# the job runs on the cores this client is pinned to (see job_scheduler pin_cores)
+	request['cores'] = sorted(os.sched_getaffinity(0))
+
+	try:
+		answer = send_request(args.socket, request)
+	except WorkerUnavailableError as error:
+		print(error)
+		if not args.fallback:
+			exit(WORKER_UNAVAILABLE_RETURNCODE)
+		# the worker stopped since the job was submitted, the reconstruction runs in a new process instead
+		print(f"running {args.fallback}")
+		exit(subprocess.call(args.fallback, shell=True, stdin=subprocess.DEVNULL))
+	except OSError as error:
+		# the worker took the request but did not answer (ex: the process of the reconstruction was killed)
+		print(f"no answer from the reconstruction worker {args.socket}: {error}")
+		exit(1)
+
+	print(f"{answer['status']} in {answer['duration']:.1f}s {answer['message']}")
+	exit(answer['returncode'])
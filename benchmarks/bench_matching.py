@@ -0,0 +1,252 @@
+"""scaling benchmark of the OB/DC matching against synthetic catalogs of tagged tiff files
+
+example:
+    python benchmarks/bench_matching.py -catalog_sizes 1000 10000 100000 -data_folder /tmp/rockit_catalogs
+
+For each catalog size, the directory walk, the header harvest (without and with the metadata index), the
+grouping of the sample files (create_master_sample_dict) and the matching (match_ob and match_dc) are timed
+separately. The configurations and matched lists are then checked against a naive implementation (every
+file compared to every configuration, as the matching was originally written), and the benchmark fails if
+they are not identical.
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import collections
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rockit"))
+
+from retrieve_matching_ob_dc.retrieve_matching_ob_dc import RetrieveMatchingOBDC, MetadataName, METADATA_KEYS
+from retrieve_matching_ob_dc.file_handler import get_list_of_all_files_in_subfolders
+from retrieve_matching_ob_dc.metadata_handler import MetadataHandler
+from retrieve_matching_ob_dc.metadata_index import MetadataIndex
+
+from synthetic_data import write_cg1d_tiff
+from benchmark_results import save_results, load_results, compare_results
+
+BENCHMARK_NAME = "matching"
+DEFAULT_CATALOG_SIZES = [1000, 10000]
+
+# the catalog files are tiny, only their headers matter
+CATALOG_IMAGE_SHAPE = (4, 4)
+NUMBER_OF_FILES_PER_FOLDER = 500
+DC_FRACTION = 0.3
+NUMBER_OF_SAMPLE_FILES = 200
+
+LIST_EXPOSURE_TIMES = [10.0, 20.0, 30.0, 60.0]
+LIST_MANUFACTURERS = ["Andor", "PerkinElmer"]
+# (HR, HL, VT, VB) of the aperture configurations used during the "experiment"
+LIST_APERTURES = [(10.0, 10.0, 20.0, 20.0),
+                  (15.0, 15.0, 25.0, 25.0),
+                  (10.0, 10.0, 30.0, 30.0),
+                  (5.0, 5.0, 5.0, 5.0)]
+# random offset added to the apertures, within the tolerance of the matching (1)
+APERTURE_JITTER = 0.4
+START_TIME_STAMP = 1.6e9
+
+
+def _random_metadata(rng):
+    apertures = np.array(LIST_APERTURES[rng.integers(len(LIST_APERTURES))])
+    apertures = apertures + rng.uniform(-APERTURE_JITTER, APERTURE_JITTER, 4)
+    return {'exposure_time': LIST_EXPOSURE_TIMES[rng.integers(len(LIST_EXPOSURE_TIMES))],
+            'manufacturer': LIST_MANUFACTURERS[rng.integers(len(LIST_MANUFACTURERS))],
+            'apertures': tuple(np.round(apertures, 3))}
+
+
+def create_catalog(ipts_folder, number_of_files, seed=0):
+    """<ipts>/raw/ob/folder_xxxx/ and <ipts>/raw/df/folder_xxxx/ with number_of_files tagged tiff in total,
+    and a <ipts>/raw/ct_scans/sample/ folder acquired with the first configuration"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros(CATALOG_IMAGE_SHAPE, dtype=np.uint16)
+
+    number_of_dc = int(number_of_files * DC_FRACTION)
+    for _data_type, _number_of_files in [('ob', number_of_files - number_of_dc), ('df', number_of_dc)]:
+        for _index in range(_number_of_files):
+            _folder = os.path.join(ipts_folder, "raw", _data_type, f"folder_{_index // NUMBER_OF_FILES_PER_FOLDER:04d}")
+            if _index % NUMBER_OF_FILES_PER_FOLDER == 0:
+                os.makedirs(_folder, exist_ok=True)
+            write_cg1d_tiff(os.path.join(_folder, f"{_data_type}_{_index:06d}.tiff"),
+                            image,
+                            START_TIME_STAMP + rng.uniform(0, 30 * 24 * 3600),
+                            **_random_metadata(rng))
+
+    sample_folder = os.path.join(ipts_folder, "raw", "ct_scans", "sample")
+    os.makedirs(sample_folder, exist_ok=True)
+    for _index in range(NUMBER_OF_SAMPLE_FILES):
+        write_cg1d_tiff(os.path.join(sample_folder, f"sample_{_index:03d}_000_{_index:04d}.tiff"),
+                        image,
+                        START_TIME_STAMP + 15 * 24 * 3600 + _index * 30,
+                        exposure_time=LIST_EXPOSURE_TIMES[0],
+                        manufacturer=LIST_MANUFACTURERS[0],
+                        apertures=LIST_APERTURES[0])
+    return sample_folder
+
+
+def naive_grouping(sample_metadata_dict):
+    """{acquisition time: {config name: {'metadata_infos': ..., 'list_sample': [file names]}}}, every file
+    being compared to every configuration already created for its acquisition time"""
+    master_dict = collections.OrderedDict()
+    for _sample in sample_metadata_dict.values():
+        _acquisition_time = _sample[MetadataName.EXPOSURE_TIME.value]['value']
+        _instrument_metadata = RetrieveMatchingOBDC.get_instrument_metadata_only(_sample)
+        _dict_of_acquisition_time = master_dict.setdefault(_acquisition_time, collections.OrderedDict())
+        _found_a_match = False
+        for _config in _dict_of_acquisition_time.values():
+            if RetrieveMatchingOBDC.all_metadata_match(metadata_1=_config['metadata_infos'],
+                                                       metadata_2=_instrument_metadata):
+                _config['list_sample'].append(_sample['filename'])
+                _found_a_match = True
+        if not _found_a_match:
+            _dict_of_acquisition_time[f"config{len(_dict_of_acquisition_time)}"] = {
+                'metadata_infos': _instrument_metadata,
+                'list_sample': [_sample['filename']]}
+    return master_dict
+
+
+def naive_matching(master_dict, metadata_dict, list_key_to_check=None):
+    """{acquisition time: {config name: [file names of metadata_dict matching the configuration]}}"""
+    matching = {}
+    for _acquisition_time, _dict_of_acquisition_time in master_dict.items():
+        matching[_acquisition_time] = {}
+        for _config_name, _config in _dict_of_acquisition_time.items():
+            matching[_acquisition_time][_config_name] = [
+                _entry['filename'] for _entry in metadata_dict.values()
+                if (_entry[MetadataName.EXPOSURE_TIME.value]['value'] == _acquisition_time) and
+                RetrieveMatchingOBDC.all_metadata_match(metadata_1=_config['metadata_infos'],
+                                                        metadata_2=_entry,
+                                                        list_key_to_check=list_key_to_check)]
+    return matching
+
+
+def _time(timings, name, function, *args, **kwargs):
+    _start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings[name] = time.perf_counter() - _start
+    return result
+
+
+def run_case(number_of_files, data_folder):
+    ipts_folder = os.path.join(data_folder, f"catalog_{number_of_files}", "IPTS-0")
+    raw_folder = os.path.join(ipts_folder, "raw")
+    sample_folder = os.path.join(raw_folder, "ct_scans", "sample")
+    if not os.path.exists(sample_folder):
+        print(f"{number_of_files}: creating the catalog ...")
+        create_catalog(ipts_folder, number_of_files)
+
+    timings = {}
+    print(f"{number_of_files}: directory walk ...")
+    list_ob = _time(timings, "walk ob", get_list_of_all_files_in_subfolders,
+                    folder=os.path.join(raw_folder, 'ob'), extensions=['tiff', 'tif'])
+    list_dc = _time(timings, "walk dc", get_list_of_all_files_in_subfolders,
+                    folder=[os.path.join(raw_folder, 'df'), os.path.join(raw_folder, 'dc')],
+                    extensions=['tiff', 'tif'])
+
+    print(f"{number_of_files}: header harvest ...")
+    list_sample = sorted(glob.glob(os.path.join(sample_folder, "*.tiff")))
+    sample_metadata_dict = _time(timings, "harvest sample", MetadataHandler.retrieve_metadata,
+                                 list_of_files=list_sample, label='sample', progress='none')
+    ob_metadata_dict = _time(timings, "harvest ob", MetadataHandler.retrieve_metadata,
+                             list_of_files=list_ob, label='ob', progress='none')
+    dc_metadata_dict = _time(timings, "harvest dc", MetadataHandler.retrieve_metadata,
+                             list_of_files=list_dc, label='dc', progress='none')
+
+    index_folder = tempfile.mkdtemp(prefix="rockit_metadata_index_")
+    try:
+        o_index = MetadataIndex(index_file=os.path.join(index_folder, "ob_metadata_index.json"))
+        _time(timings, "harvest ob (index, first run)", o_index.update, list_of_files=list_ob, progress='none')
+        o_index = MetadataIndex(index_file=os.path.join(index_folder, "ob_metadata_index.json"))
+        _time(timings, "harvest ob (index, next runs)", o_index.update, list_of_files=list_ob, progress='none')
+    finally:
+        shutil.rmtree(index_folder, ignore_errors=True)
+
+    print(f"{number_of_files}: grouping and matching ...")
+    o_match = RetrieveMatchingOBDC(list_sample_data=list_sample, IPTS_folder=raw_folder, use_metadata_index=False)
+    o_match.sample_metadata_dict = sample_metadata_dict
+    o_match.ob_metadata_dict = ob_metadata_dict
+    o_match.dc_metadata_dict = dc_metadata_dict
+    _time(timings, "grouping", o_match.create_master_sample_dict)
+    _time(timings, "match ob", o_match.match_ob)
+    _time(timings, "match dc", o_match.match_dc)
+
+    print(f"{number_of_files}: naive grouping and matching ...")
+    naive_master_dict = _time(timings, "naive grouping", naive_grouping, sample_metadata_dict)
+    naive_ob = _time(timings, "naive match ob", naive_matching, naive_master_dict, ob_metadata_dict,
+                     list_key_to_check=None)
+    naive_dc = _time(timings, "naive match dc", naive_matching, naive_master_dict, dc_metadata_dict,
+                     list_key_to_check=[MetadataName.DETECTOR_MANUFACTURER.value])
+
+    list_differences = []
+    final_full_master_dict = o_match.final_full_master_dict
+    if list(final_full_master_dict.keys()) != list(naive_master_dict.keys()):
+        list_differences.append("acquisition times")
+    for _acquisition_time, _dict_of_acquisition_time in naive_master_dict.items():
+        _configs = final_full_master_dict.get(_acquisition_time, {})
+        if list(_configs.keys()) != list(_dict_of_acquisition_time.keys()):
+            list_differences.append(f"configurations of {_acquisition_time}")
+            continue
+        for _config_name, _config in _dict_of_acquisition_time.items():
+            _found = _configs[_config_name]
+            if [_entry['filename'] for _entry in _found['list_sample']] != _config['list_sample']:
+                list_differences.append(f"{_acquisition_time}/{_config_name}: list_sample")
+            if [_entry['filename'] for _entry in _found['list_ob']] != naive_ob[_acquisition_time][_config_name]:
+                list_differences.append(f"{_acquisition_time}/{_config_name}: list_ob")
+            if [_entry['filename'] for _entry in _found['list_dc']] != naive_dc[_acquisition_time][_config_name]:
+                list_differences.append(f"{_acquisition_time}/{_config_name}: list_dc")
+
+    return {'name': f"{number_of_files} files",
+            'number_of_ob': len(list_ob),
+            'number_of_dc': len(list_dc),
+            'number_of_sample': len(list_sample),
+            'timings': timings,
+            'identical_to_naive': len(list_differences) == 0,
+            'differences': list_differences}
+
+
+def main(args):
+    data_folder = args.data_folder if args.data_folder else tempfile.mkdtemp(prefix="rockit_catalogs_")
+    try:
+        cases = [run_case(_size, data_folder) for _size in args.catalog_sizes]
+    finally:
+        if not args.data_folder:
+            shutil.rmtree(data_folder, ignore_errors=True)
+
+    output_file_name = save_results(BENCHMARK_NAME, cases, output_file_name=args.output)
+    print(f"results saved in {output_file_name}")
+
+    for _case in cases:
+        for _stage, _time_s in _case['timings'].items():
+            print(f"{_case['name']:<14} {_stage:<35} {_time_s:>10.3f}s")
+        print(f"{_case['name']:<14} identical to the naive matching: {_case['identical_to_naive']}")
+        for _difference in _case['differences']:
+            print(f"{_case['name']:<14} - different {_difference}")
+
+    if args.compare:
+        print()
+        for _line in compare_results(load_results(args.compare), load_results(output_file_name)):
+            print(_line)
+
+    if not all([_case['identical_to_naive'] for _case in cases]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-catalog_sizes',
+                        nargs='+',
+                        type=int,
+                        default=DEFAULT_CATALOG_SIZES,
+                        help="Number of OB and DC files of the catalogs")
+    parser.add_argument('-data_folder',
+                        help="Folder where the catalogs are created (and kept, so they can be reused). "
+                             "By default a temporary folder, removed at the end")
+    parser.add_argument('-output',
+                        help="Results file name (default: benchmarks/results/matching_<date>_<commit>.json)")
+    parser.add_argument('-compare',
+                        help="Results file of a previous run to compare with")
+    main(parser.parse_args())
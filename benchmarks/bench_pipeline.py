@@ -0,0 +1,157 @@
+"""benchmark of the OB/DC matching and of each stage of rockit_cli.main on synthetic data sets
+
+example:
+    python benchmarks/bench_pipeline.py -sizes small medium
+    python benchmarks/bench_pipeline.py -sizes small -rockit_args="--streaming -slab_size 32"
+    python benchmarks/bench_pipeline.py -sizes small -compare benchmarks/results/pipeline_xxx.json
+
+The results (time of each stage, plus the version of the code and the machine used) are saved in
+benchmarks/results/, so two versions of the code can be compared with -compare.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rockit"))
+
+import rockit_cli
+from retrieve_matching_ob_dc.retrieve_matching_ob_dc import RetrieveMatchingOBDC
+
+from synthetic_data import create_ct_data_set
+from benchmark_results import save_results, load_results, compare_results
+
+BENCHMARK_NAME = "pipeline"
+IPTS_NUMBER = "0"
+SCAN_NAME = "benchmark_scan"
+
+# name: (height, width, number of projections, number of OB, number of DC)
+SIZES = {'tiny': (64, 64, 37, 4, 2),
+         'small': (256, 256, 181, 10, 5),
+         'medium': (512, 512, 361, 20, 10),
+         'large': (1024, 1024, 721, 40, 10)}
+
+MATCHING_STEPS = ['retrieve_sample_metadata', 'retrieve_ob_metadata', 'retrieve_dc_metadata',
+                  'create_master_sample_dict', 'match_ob', 'match_dc', 'select_ob', 'select_dc']
+
+
+def time_matching(list_sample_data, raw_folder, use_metadata_index=False):
+    """time (s) of each step of RetrieveMatchingOBDC.run"""
+    o_match = RetrieveMatchingOBDC(list_sample_data=list_sample_data,
+                                   IPTS_folder=raw_folder,
+                                   use_metadata_index=use_metadata_index,
+                                   progress='none')
+    timings = {}
+    for _step in MATCHING_STEPS:
+        _start = time.perf_counter()
+        getattr(o_match, _step)()
+        timings[f"matching: {_step}"] = time.perf_counter() - _start
+    return timings, o_match
+
+
+def run_pipeline(ipts_folder, input_folder, rockit_args):
+    """run rockit_cli.main and return its stage records"""
+    reduction_log_folder = os.path.join(ipts_folder, "shared", "autoreduce", "reduction_log")
+    os.makedirs(reduction_log_folder, exist_ok=True)
+
+    # rockit_cli.main configures the logging to its own log file
+    for _handler in list(logging.root.handlers):
+        logging.root.removeHandler(_handler)
+
+    args = rockit_cli.get_argument_parser().parse_args([IPTS_NUMBER, input_folder] + rockit_args)
+    _start = time.perf_counter()
+    rockit_cli.main(args)
+    total_time = time.perf_counter() - _start
+
+    stages_file = os.path.join(reduction_log_folder, os.path.basename(input_folder) + rockit_cli.STAGES_JSON)
+    with open(stages_file, 'r') as f:
+        list_stages = json.load(f)['stages']
+    return list_stages, total_time
+
+
+def run_case(size_name, data_folder, rockit_args):
+    height, width, number_of_projections, number_of_ob, number_of_dc = SIZES[size_name]
+    top_folder = os.path.join(data_folder, size_name)
+    ipts_folder = os.path.join(top_folder, f"IPTS-{IPTS_NUMBER}")
+
+    print(f"{size_name}: creating {number_of_projections} projections of {height}x{width} ...")
+    input_folder = os.path.join(ipts_folder, "raw", "ct_scans", SCAN_NAME)
+    if not os.path.exists(input_folder):
+        create_ct_data_set(ipts_folder,
+                           height=height,
+                           width=width,
+                           number_of_projections=number_of_projections,
+                           number_of_ob=number_of_ob,
+                           number_of_dc=number_of_dc,
+                           scan_name=SCAN_NAME)
+
+    print(f"{size_name}: OB/DC matching ...")
+    list_sample_data = glob.glob(os.path.join(input_folder, "*.tif*"))
+    timings, o_match = time_matching(list_sample_data, os.path.join(ipts_folder, "raw"))
+    if (len(o_match.get_matching_ob()) != number_of_ob) or (len(o_match.get_matching_dc()) != number_of_dc):
+        raise RuntimeError(f"{size_name}: the synthetic OB and DC were not all matched!")
+
+    print(f"{size_name}: reconstruction ...")
+    rockit_cli.TOP_FOLDER = top_folder
+    list_stages, total_time = run_pipeline(ipts_folder, input_folder, rockit_args)
+    for _stage in list_stages:
+        timings[f"pipeline: {_stage['stage']}"] = _stage['wall_time_s']
+    timings["pipeline: total"] = total_time
+
+    return {'name': size_name,
+            'height': height,
+            'width': width,
+            'number_of_projections': number_of_projections,
+            'number_of_ob': number_of_ob,
+            'number_of_dc': number_of_dc,
+            'rockit_args': rockit_args,
+            'timings': timings,
+            'stages': list_stages}
+
+
+def main(args):
+    rockit_args = shlex.split(args.rockit_args) if args.rockit_args else []
+
+    data_folder = args.data_folder if args.data_folder else tempfile.mkdtemp(prefix="rockit_benchmark_")
+    try:
+        cases = [run_case(_size, data_folder, rockit_args) for _size in args.sizes]
+    finally:
+        if not args.data_folder:
+            shutil.rmtree(data_folder, ignore_errors=True)
+
+    output_file_name = save_results(BENCHMARK_NAME, cases, output_file_name=args.output)
+    print(f"results saved in {output_file_name}")
+
+    for _case in cases:
+        for _stage, _time in _case['timings'].items():
+            print(f"{_case['name']:<10} {_stage:<50} {_time:>10.3f}s")
+
+    if args.compare:
+        print()
+        for _line in compare_results(load_results(args.compare), load_results(output_file_name)):
+            print(_line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-sizes',
+                        nargs='+',
+                        choices=list(SIZES.keys()),
+                        default=['small'],
+                        help="Size(s) of the synthetic data sets")
+    parser.add_argument('-data_folder',
+                        help="Folder where the synthetic data are created (and kept, so they can be reused). "
+                             "By default a temporary folder, removed at the end")
+    parser.add_argument('-rockit_args',
+                        help="Extra arguments given to rockit_cli (ex: \"--streaming -slab_size 32\")")
+    parser.add_argument('-output',
+                        help="Results file name (default: benchmarks/results/pipeline_<date>_<commit>.json)")
+    parser.add_argument('-compare',
+                        help="Results file of a previous run to compare with")
+    main(parser.parse_args())
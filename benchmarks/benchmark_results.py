@@ -0,0 +1,83 @@
+"""save the benchmark results (with the version of the code that produced them) and compare two runs"""
+import os
+import json
+import socket
+import platform
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# a stage is reported as a regression (or an improvement) when its time changed by more than that fraction
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_environment():
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': get_git_commit(),
+            'hostname': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count()}
+
+
+def save_results(benchmark_name, cases, output_file_name=None):
+    """save {'benchmark', 'environment', 'cases'} in results/<benchmark>_<date>_<commit>.json (by default)
+
+    cases: [{'name': case name, 'timings': {stage: wall time (s)}, ...any other information}, ...]
+    """
+    environment = get_environment()
+    if output_file_name is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        _date = environment['date'].replace(':', '').replace('-', '')
+        output_file_name = os.path.join(RESULTS_FOLDER,
+                                        f"{benchmark_name}_{_date}_{environment['git_commit']}.json")
+
+    with open(output_file_name, 'w') as f:
+        json.dump({'benchmark': benchmark_name,
+                   'environment': environment,
+                   'cases': cases}, f, indent=2)
+    return output_file_name
+
+
+def load_results(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(reference, new, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """lines of a table comparing the time of each stage of each case of the two results"""
+    reference_cases = {_case['name']: _case for _case in reference['cases']}
+    lines = [f"reference: {reference['environment']['git_commit']} ({reference['environment']['date']})",
+             f"new      : {new['environment']['git_commit']} ({new['environment']['date']})",
+             f"{'case':<20} {'stage':<40} {'reference (s)':>14} {'new (s)':>10} {'ratio':>7}"]
+    for _case in new['cases']:
+        _reference_case = reference_cases.get(_case['name'])
+        if _reference_case is None:
+            continue
+        for _stage, _time in _case['timings'].items():
+            _reference_time = _reference_case['timings'].get(_stage)
+            if _reference_time is None:
+                continue
+            _ratio = _time / _reference_time if _reference_time > 0 else np.inf
+            if _ratio > 1 + threshold:
+                _flag = "  REGRESSION"
+            elif _ratio < 1 - threshold:
+                _flag = "  improvement"
+            else:
+                _flag = ""
+            lines.append(f"{_case['name']:<20} {_stage:<40} {_reference_time:>14.3f} {_time:>10.3f} "
+                         f"{_ratio:>7.2f}{_flag}")
+    return lines
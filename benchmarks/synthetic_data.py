@@ -0,0 +1,154 @@
+"""synthetic CG1D data sets (projections, OB and DC) used by the benchmarks
+
+The projections are the exact (analytic) projections of a 3D Shepp-Logan like phantom, the files are named
+like the CG1D ones (<prefix>_<angle integer part>_<angle decimal part>_<index>.tiff, as expected by
+utilites.get_ind_list) and carry the CG1D tags used to match the OB and DC (time stamp, exposure time,
+detector manufacturer and apertures).
+"""
+import os
+
+import numpy as np
+import tifffile
+
+# EPICS time stamps count the seconds since 1990-01-01
+EPICS_EPOCH_OFFSET = 631152000
+
+# (intensity, a, b, x0, y0, phi (degrees)) of the ellipses of the modified Shepp-Logan phantom
+SHEPP_LOGAN_ELLIPSES = [[1.0, .6900, .9200, 0.00, 0.0000, 0],
+                        [-.80, .6624, .8740, 0.00, -.0184, 0],
+                        [-.20, .1100, .3100, 0.22, 0.0000, -18],
+                        [-.20, .1600, .4100, -.22, 0.0000, 18],
+                        [0.10, .2100, .2500, 0.00, 0.3500, 0],
+                        [0.10, .0460, .0460, 0.00, 0.1000, 0],
+                        [0.10, .0460, .0460, 0.00, -.1000, 0],
+                        [0.10, .0460, .0230, -.08, -.6050, 0],
+                        [0.10, .0230, .0230, 0.00, -.6060, 0],
+                        [0.10, .0230, .0460, 0.06, -.6050, 0]]
+
+# counts of the open beam, of the dark current, and counts left behind the slits (fraction of the open beam)
+OPEN_BEAM_COUNTS = 20000
+DARK_CURRENT_COUNTS = 100
+SLITS_TRANSMISSION = 0.05
+
+# fraction of the detector, on each side, hidden by the slits
+SLITS_MARGIN = 0.05
+
+# attenuation (-log(transmission)) through the thickest part of the phantom
+MAXIMUM_ATTENUATION = 2.0
+
+DEFAULT_EXPOSURE_TIME = 30.0
+DEFAULT_MANUFACTURER = "Andor"
+DEFAULT_APERTURES = (10.0, 10.0, 20.0, 20.0)
+
+
+def get_cg1d_tags(time_stamp, exposure_time=DEFAULT_EXPOSURE_TIME, manufacturer=DEFAULT_MANUFACTURER,
+                  apertures=DEFAULT_APERTURES):
+    """extratags (tifffile format) of a CG1D image acquired at time_stamp (unix time, s)
+
+    apertures: (HR, HL, VT, VB)
+    """
+    epics_time_stamp = time_stamp - EPICS_EPOCH_OFFSET
+    aperture_hr, aperture_hl, aperture_vt, aperture_vb = apertures
+    return [(65000, 'd', 1, float(epics_time_stamp), False),
+            (65002, 'I', 1, int(epics_time_stamp), False),
+            (65003, 'I', 1, int((epics_time_stamp % 1) * 1e9), False),
+            (65026, 's', 0, f"Manufacturer:{manufacturer}", False),
+            (65027, 's', 0, f"ExposureTime:{exposure_time}", False),
+            (65064, 's', 0, f"MotSlitVB.RBV:{aperture_vb}", False),
+            (65066, 's', 0, f"MotSlitVT.RBV:{aperture_vt}", False),
+            (65068, 's', 0, f"MotSlitHR.RBV:{aperture_hr}", False),
+            (65070, 's', 0, f"MotSlitHL.RBV:{aperture_hl}", False)]
+
+
+def write_cg1d_tiff(file_name, image, time_stamp, **kwargs):
+    """write the image with the CG1D tags (see get_cg1d_tags for the kwargs)"""
+    tifffile.imwrite(file_name, image, extratags=get_cg1d_tags(time_stamp, **kwargs))
+
+
+def get_projection_file_name(prefix, angle, index):
+    """<prefix>_<angle integer part>_<angle decimal part (3 digits)>_<index>.tiff"""
+    angle_integer = int(angle)
+    angle_decimal = int(round((angle - angle_integer) * 1000))
+    return f"{prefix}_{angle_integer:03d}_{angle_decimal:03d}_{index:04d}.tiff"
+
+
+def shepp_logan_projection(angle_rad, height, width):
+    """line integrals (in units of the half width of the detector) of the 3D phantom at that angle
+
+    Each slice of the phantom is the Shepp-Logan phantom scaled by sqrt(1 - z**2), so the projection of
+    each slice is the analytic projection of the scaled ellipses.
+    """
+    t = np.linspace(-1, 1, width)[np.newaxis, :]
+    z = np.linspace(-1, 1, height)[:, np.newaxis] / 0.9
+    scale = np.sqrt(np.clip(1 - z ** 2, 0, None))
+    _scale = np.where(scale > 0, scale, 1)
+
+    projection = np.zeros((height, width))
+    for intensity, a, b, x0, y0, phi in SHEPP_LOGAN_ELLIPSES:
+        theta = angle_rad - np.deg2rad(phi)
+        r2 = (a * np.cos(theta)) ** 2 + (b * np.sin(theta)) ** 2
+        s = t / _scale - (x0 * np.cos(angle_rad) + y0 * np.sin(angle_rad))
+        projection += 2 * intensity * a * b * np.sqrt(np.clip(r2 - s ** 2, 0, None)) / r2
+    return np.where(scale > 0, projection * scale, 0)
+
+
+def get_slits_mask(height, width):
+    """1 inside the slits, SLITS_TRANSMISSION behind them"""
+    mask = np.full((height, width), SLITS_TRANSMISSION)
+    row_margin = int(height * SLITS_MARGIN)
+    column_margin = int(width * SLITS_MARGIN)
+    mask[row_margin: height - row_margin, column_margin: width - column_margin] = 1
+    return mask
+
+
+def _to_counts(image, rng):
+    noisy = image + rng.normal(0, 1, image.shape) * np.sqrt(image)
+    return np.clip(noisy, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def create_ct_data_set(ipts_folder, height=256, width=256, number_of_projections=181, number_of_ob=10,
+                       number_of_dc=5, scan_name="benchmark_scan", start_time_stamp=1.6e9, seed=0, **kwargs):
+    """create <ipts>/raw/ct_scans/<scan_name>, <ipts>/raw/ob/<scan_name> and <ipts>/raw/df/<scan_name>
+
+    The projections cover 0 to 360 degrees. The OB are acquired before the projections and the DC after.
+    kwargs are the metadata shared by all the files (see get_cg1d_tags).
+    Returns the folder of the projections.
+    """
+    rng = np.random.default_rng(seed)
+    ct_folder = os.path.join(ipts_folder, "raw", "ct_scans", scan_name)
+    ob_folder = os.path.join(ipts_folder, "raw", "ob", scan_name)
+    dc_folder = os.path.join(ipts_folder, "raw", "df", scan_name)
+    for _folder in [ct_folder, ob_folder, dc_folder]:
+        os.makedirs(_folder, exist_ok=True)
+
+    exposure_time = kwargs.get('exposure_time', DEFAULT_EXPOSURE_TIME)
+    open_beam = OPEN_BEAM_COUNTS * get_slits_mask(height, width)
+    dark_current = np.full((height, width), DARK_CURRENT_COUNTS, dtype=float)
+
+    time_stamp = start_time_stamp
+    for _index in range(number_of_ob):
+        write_cg1d_tiff(os.path.join(ob_folder, f"ob_{scan_name}_{_index:04d}.tiff"),
+                        _to_counts(open_beam + dark_current, rng),
+                        time_stamp,
+                        **kwargs)
+        time_stamp += exposure_time
+
+    attenuation_factor = MAXIMUM_ATTENUATION / np.max(shepp_logan_projection(0, height, width))
+    list_angles = np.linspace(0, 360, number_of_projections)
+    for _index, _angle in enumerate(list_angles):
+        _attenuation = shepp_logan_projection(np.deg2rad(_angle), height, width) * attenuation_factor
+        _image = open_beam * np.exp(-_attenuation) + dark_current
+        write_cg1d_tiff(os.path.join(ct_folder, get_projection_file_name(scan_name, _angle, _index)),
+                        _to_counts(_image, rng),
+                        time_stamp,
+                        **kwargs)
+        time_stamp += exposure_time
+
+    for _index in range(number_of_dc):
+        write_cg1d_tiff(os.path.join(dc_folder, f"dc_{scan_name}_{_index:04d}.tiff"),
+                        _to_counts(dark_current, rng),
+                        time_stamp,
+                        **kwargs)
+        time_stamp += exposure_time
+
+    return ct_folder
@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from utilites import lazy_import
+
+logger = logging.getLogger("rockit")
+
+# number of slices (rows of the projections) reconstructed by one chunk
+DEFAULT_CHUNK_SIZE = 64
+
+# ratio of the circular mask applied to the reconstructed slices
+CIRC_MASK_RATIO = 0.95
+
+
+def remove_rings(proj):
+    bm3d_rmv = lazy_import("bm3d_streak_removal")
+    proj_bm3d_norm = bm3d_rmv.extreme_streak_attenuation(proj)
+    return bm3d_rmv.multiscale_streak_removal(proj_bm3d_norm)
+
+
+def get_available_cores():
+    """cores the process is allowed to run on (all of them when the affinity is not supported)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_core_list(cores):
+    """'0-7,16,18-19' -> [0, 1, 2, 3, 4, 5, 6, 7, 16, 18, 19] (same syntax as taskset -c)"""
+    list_cores = set()
+    for _item in str(cores).split(','):
+        _item = _item.strip()
+        if not _item:
+            continue
+        if '-' in _item:
+            _first, _last = _item.split('-')
+            list_cores.update(range(int(_first), int(_last) + 1))
+        else:
+            list_cores.add(int(_item))
+    if not list_cores:
+        raise ValueError(f"no core in '{cores}'")
+    return sorted(list_cores)
+
+
+def pin_to_cores(list_cores):
+    """restrict the process (and the threads and processes it starts from now on) to the cores"""
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warning(f"- the cores can not be selected on this system, running on all of them")
+        return get_available_cores()
+    os.sched_setaffinity(0, list_cores)
+    list_cores = get_available_cores()
+    logger.info(f"- running on the cores {list_cores}")
+    return list_cores
+
+
+class ChunkedGridrec:
+    """gridrec reconstruction of a stack of projections, chunk_size slices at a time
+
+    o_engine = ChunkedGridrec(chunk_size=64, number_of_workers=2, ncore=8)
+    o_engine.reconstruct(stack, theta, rot_center, output_folder)
+
+    Each chunk (rows of the projections) is copied out of the stack, ring cleaned (optional), reconstructed,
+    masked and written to output_folder (reconstruction_<index of the slice>.tiff) as soon as it is done, so
+    only number_of_workers chunks are in memory at once. number_of_workers chunks run at the same time, in
+    threads (tomopy and the tiff writing release the GIL), each tomopy call using ncore threads.
+
+    By default the cores the process can run on (see pin_to_cores) are shared by the workers. ncore is always
+    given to tomopy, which otherwise starts one thread per core of the node, even when the process is pinned
+    to a few of them.
+
+    The timing of each chunk (read, ring removal, reconstruction, write) is logged, kept in self.list_timings
+    and added to the stage record when one is given.
+    """
+
+    def __init__(self, chunk_size=None, number_of_workers=None, ncore=None):
+        self.chunk_size = chunk_size if chunk_size else DEFAULT_CHUNK_SIZE
+        self.number_of_workers = number_of_workers if number_of_workers else 1
+        number_of_cores = len(get_available_cores())
+        self.ncore = ncore if ncore else max(1, number_of_cores // self.number_of_workers)
+        if self.number_of_workers * self.ncore > number_of_cores:
+            logger.warning(f"- {self.number_of_workers} workers x {self.ncore} threads for {number_of_cores} cores!")
+        self.list_timings = []
+
+    def reconstruct(self, stack, theta, rot_center, output_folder, order=None, ring_removal=False, stage=None):
+        """reconstruct all the slices of the stack (projections, rows, columns) into output_folder
+
+        order: order of the projections (matching theta) when it is not the order of the stack
+        stage: StageRecord the timings are added to
+        """
+        number_of_rows = stack.shape[1]
+        list_chunks = [(_start, min(_start + self.chunk_size, number_of_rows))
+                       for _start in range(0, number_of_rows, self.chunk_size)]
+        logger.info(f"- {number_of_rows} slices, {self.chunk_size} at a time, {self.number_of_workers} chunk(s) "
+                    f"at once using {self.ncore} thread(s) each")
+        order = slice(None) if order is None else np.asarray(order)
+
+        self.list_timings = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.number_of_workers) as executor:
+            list_futures = [executor.submit(self._reconstruct_chunk, stack, theta, rot_center, output_folder,
+                                            _start, _end, order, ring_removal)
+                            for _start, _end in list_chunks]
+            try:
+                for _future in as_completed(list_futures):
+                    _timing = _future.result()
+                    self.list_timings.append(_timing)
+                    logger.info(f"- slices {_timing['start']}-{_timing['end']} ({len(self.list_timings)}/"
+                                f"{len(list_chunks)}) in {_timing['wall_time_s']:.2f}s (read "
+                                f"{_timing['read_s']:.2f}s, ring removal {_timing['ring_removal_s']:.2f}s, "
+                                f"gridrec {_timing['recon_s']:.2f}s, write {_timing['write_s']:.2f}s)")
+            except BaseException:
+                for _future in list_futures:
+                    _future.cancel()
+                raise
+
+        self.list_timings.sort(key=lambda _timing: _timing['start'])
+        wall_time_s = time.perf_counter() - start
+        busy_time_s = sum([_timing['wall_time_s'] for _timing in self.list_timings])
+        logger.info(f"- {len(list_chunks)} chunks in {wall_time_s:.2f}s ({busy_time_s:.2f}s of chunk time)")
+        if stage is not None:
+            stage.chunks = self.list_timings
+        return self.list_timings
+
+    def _reconstruct_chunk(self, stack, theta, rot_center, output_folder, start, end, order, ring_removal):
+        tomopy = lazy_import("tomopy")
+        dxchange = lazy_import("dxchange")
+
+        timing = {'start': start, 'end': end, 'read_s': 0., 'ring_removal_s': 0., 'recon_s': 0., 'write_s': 0.}
+        chunk_start = time.perf_counter()
+
+        _time = time.perf_counter()
+        chunk = np.array(stack[order, start: end, :])
+        timing['read_s'] = time.perf_counter() - _time
+
+        if ring_removal:
+            _time = time.perf_counter()
+            chunk = remove_rings(chunk)
+            timing['ring_removal_s'] = time.perf_counter() - _time
+
+        _time = time.perf_counter()
+        recon = tomopy.recon(chunk, theta, center=rot_center, algorithm='gridrec', sinogram_order=False,
+                             ncore=self.ncore)
+        del chunk
+        recon = tomopy.circ_mask(recon, axis=0, ratio=CIRC_MASK_RATIO, ncore=self.ncore)
+        timing['recon_s'] = time.perf_counter() - _time
+
+        _time = time.perf_counter()
+        dxchange.write_tiff_stack(recon, fname=os.path.join(output_folder, 'reconstruction'), start=start,
+                                  overwrite=True)
+        timing['write_s'] = time.perf_counter() - _time
+
+        timing['wall_time_s'] = time.perf_counter() - chunk_start
+        return timing
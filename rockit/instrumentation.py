@@ -0,0 +1,142 @@
+import os
+import csv
+import json
+import time
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+
+from utilites import get_memory_usage
+
+logger = logging.getLogger("rockit")
+
+CSV_COLUMNS = ['stage', 'status', 'start_time', 'wall_time_s', 'cpu_time_s', 'rss_mb', 'peak_rss_mb', 'arrays']
+
+
+def _reset_peak_rss():
+    """reset the peak resident memory of the process (linux >= 4.0), so the peak of each stage can be read.
+    Returns False if the peak can not be reset, in which case the peak is the one since the process started"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _get_peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for _line in f:
+                if _line.startswith("VmHWM:"):
+                    return int(_line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return get_memory_usage()[1]
+
+
+def _get_cpu_time():
+    """cpu time (s) used by the process, all threads and finished child processes included"""
+    _times = os.times()
+    return _times.user + _times.system + _times.children_user + _times.children_system
+
+
+class StageRecord:
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 'running'
+        self.start_time = time.time()
+        self.wall_time_s = np.NaN
+        self.cpu_time_s = np.NaN
+        self.rss_mb = np.NaN
+        self.peak_rss_mb = np.NaN
+        self.arrays = {}
+        # timing of each chunk of the stages working by chunks (json only)
+        self.chunks = []
+
+    def add_array(self, name, array):
+        """record the shape and dtype of an array produced (or used) by the stage"""
+        if array is None:
+            return
+        self.arrays[name] = {'shape': list(np.shape(array)),
+                             'dtype': str(getattr(array, 'dtype', type(array).__name__))}
+
+    def to_dict(self):
+        return {'stage': self.name,
+                'status': self.status,
+                'start_time': self.start_time,
+                'wall_time_s': self.wall_time_s,
+                'cpu_time_s': self.cpu_time_s,
+                'rss_mb': self.rss_mb,
+                'peak_rss_mb': self.peak_rss_mb,
+                'arrays': self.arrays,
+                'chunks': self.chunks}
+
+
+class StageRecorder:
+    """records the wall time, cpu time, memory and arrays of each stage of a reconstruction
+
+    o_recorder = StageRecorder(json_file_name=..., csv_file_name=...)
+    with o_recorder.stage("normalization") as _stage:
+        proj_norm = normalize(proj, ob, dc)
+        _stage.add_array("proj_norm", proj_norm)
+
+    The start and the end (with its duration) of each stage are logged, and the json and csv files are
+    rewritten at the end of each stage (even if it failed), so they are complete up to the last stage run.
+    """
+
+    def __init__(self, json_file_name=None, csv_file_name=None, metadata=None):
+        self.json_file_name = json_file_name
+        self.csv_file_name = csv_file_name
+        self.metadata = metadata if metadata else {}
+        self.list_records = []
+
+    @contextmanager
+    def stage(self, name):
+        record = StageRecord(name)
+        self.list_records.append(record)
+        logger.info(f"{name} ...")
+
+        is_peak_reset = _reset_peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = _get_cpu_time()
+        try:
+            yield record
+            record.status = 'ok'
+        except BaseException:
+            record.status = 'failed'
+            raise
+        finally:
+            record.wall_time_s = time.perf_counter() - wall_start
+            record.cpu_time_s = _get_cpu_time() - cpu_start
+            record.rss_mb = get_memory_usage()[0]
+            record.peak_rss_mb = _get_peak_rss_mb() if is_peak_reset else get_memory_usage()[1]
+            _outcome = "Done in" if record.status == 'ok' else "FAILED after"
+            logger.info(f"{name} ... {_outcome} {timedelta(seconds=record.wall_time_s)}! "
+                        f"(cpu: {record.cpu_time_s:.1f}s, memory: {record.rss_mb:.0f} MB, "
+                        f"peak: {record.peak_rss_mb:.0f} MB)")
+            self.save()
+
+    def save(self):
+        if self.json_file_name:
+            try:
+                with open(self.json_file_name, 'w') as f:
+                    json.dump({'metadata': self.metadata,
+                               'stages': [_record.to_dict() for _record in self.list_records]}, f, indent=2)
+            except OSError as error:
+                logger.warning(f"unable to save {self.json_file_name}: {error}")
+
+        if self.csv_file_name:
+            try:
+                with open(self.csv_file_name, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+                    writer.writeheader()
+                    for _record in self.list_records:
+                        _row = _record.to_dict()
+                        _row['arrays'] = json.dumps(_row['arrays'])
+                        writer.writerow(_row)
+            except OSError as error:
+                logger.warning(f"unable to save {self.csv_file_name}: {error}")
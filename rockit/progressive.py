@@ -0,0 +1,302 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+from utilites import lazy_import, get_ind_list, find_proj180_ind, read_tiff_from_full_name_list
+from instrumentation import StageRecorder
+from streaming import preprocess_projections, reconstruct_by_slabs, DEFAULT_PROJECTION_CHUNK_SIZE
+from scan_progress import ScanProgress
+
+logger = logging.getLogger("rockit")
+
+# a file modified less than that many seconds ago may still be being written
+MINIMUM_FILE_AGE = 2
+
+# seconds between two looks at the input folder when no new projection arrived
+DEFAULT_POLL_INTERVAL = 5
+
+# when the angles of the projections can not tell the end of the scan, it is complete when no new projection
+# arrived for that many exposure times (as for the autoreduction)
+DEFAULT_ACQUISITION_TIME_COEFFICIENT = 5
+
+# a file that can not be read that many times is skipped
+MAXIMUM_READ_ATTEMPTS = 3
+
+
+def get_angle(file_name):
+    """angle (degrees) of a projection, from its file name"""
+    return get_ind_list([os.path.basename(file_name)])[1][0]
+
+
+class ProgressiveReconstruction:
+    """reconstruct a scan while it is being acquired
+
+    o_progressive = ProgressiveReconstruction(input_folder, ob, dc, scratch_folder, crop_box=crop_box)
+    o_progressive.run(output_folder, exposure_time=exposure_time)
+
+    Each projection is preprocessed (see streaming.preprocess_projections) as soon as its file is in the
+    input folder, and appended to a store (file of the scratch folder). The tilt is calculated as soon as the
+    0 and 180 degrees projections are in the store: the projections already stored are corrected then, the
+    next ones before being stored. Once the scan is complete (projection at its last angle written, see
+    ScanProgress, or, when the angles can not tell, no new projection for acquisition_time_coefficient x
+    exposure time) only the center of rotation and the reconstruction by slabs (see
+    streaming.reconstruct_by_slabs) remain.
+
+    The store is kept (with the list of its projections, in a json file next to it) when the reconstruction
+    fails, so the next attempt with the same scan, OB, DC and crop box goes on from the projections already
+    preprocessed instead of starting again from the first one.
+
+    angular_range: range of the scan (degrees), found from the angles of the projections if None
+    """
+
+    def __init__(self, input_folder, ob, dc, scratch_folder, crop_box=None, projection_chunk_size=None,
+                 max_workers=None, recorder=None, angular_range=None):
+        self.input_folder = input_folder
+        self.scan_progress = ScanProgress(input_folder, angular_range=angular_range)
+        self.crop_box = crop_box
+        self.projection_chunk_size = projection_chunk_size if projection_chunk_size else \
+            DEFAULT_PROJECTION_CHUNK_SIZE
+        self.max_workers = max_workers
+        self.recorder = recorder if recorder else StageRecorder()
+
+        # tomopy.normalize averages the ob and dc stacks every time it is called, do it once here
+        self.ob = np.mean(ob, axis=0, keepdims=True, dtype=np.float32)
+        self.dc = np.mean(dc, axis=0, keepdims=True, dtype=np.float32)
+
+        # files of the store, in the order they were stored, and their angles (degrees)
+        self.list_files = []
+        self.list_angles = []
+        self.image_shape = None
+        self.tilt_angle = None
+
+        # time of the last modification of a projection of the input folder
+        self.last_file_time = None
+        self._read_attempts = {}
+        self._skipped_files = set()
+
+        os.makedirs(scratch_folder, exist_ok=True)
+        _store_name = f"rockit_progressive_{os.path.basename(os.path.normpath(input_folder))}_{self._get_key()}"
+        self.store_file_name = os.path.join(scratch_folder, _store_name + ".dat")
+        self.state_file_name = os.path.join(scratch_folder, _store_name + ".json")
+        if self._resume():
+            self._store = open(self.store_file_name, 'ab')
+        else:
+            self._store = open(self.store_file_name, 'wb')
+
+    def _get_key(self):
+        """what the preprocessed projections depend on: the scan, the ob, the dc and the crop box"""
+        sha1 = hashlib.sha1()
+        sha1.update(f"{os.path.abspath(self.input_folder)}:{self.crop_box}".encode())
+        sha1.update(self.ob.tobytes())
+        sha1.update(self.dc.tobytes())
+        return sha1.hexdigest()[:16]
+
+    def _resume(self):
+        """reload the projections stored by a previous attempt, returns False if there is none"""
+        if not (os.path.exists(self.state_file_name) and os.path.exists(self.store_file_name)):
+            return False
+        try:
+            with open(self.state_file_name) as f:
+                state = json.load(f)
+            list_files, list_angles = state['list_files'], state['list_angles']
+            image_shape = tuple(state['image_shape']) if state['image_shape'] else None
+            tilt_angle = state['tilt_angle']
+            if state.get('correcting_tilt'):
+                raise ValueError("the previous attempt stopped while correcting the tilt of the projections")
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.info(f"- unable to resume from {self.state_file_name} ({error}), starting again")
+            return False
+
+        # the projections appended after the last state saved are dropped
+        frame_size = int(np.prod(image_shape)) * np.dtype(np.float32).itemsize if image_shape else 0
+        store_size = len(list_files) * frame_size
+        if os.path.getsize(self.store_file_name) < store_size:
+            logger.info(f"- {self.store_file_name} is shorter than expected, starting again")
+            return False
+        os.truncate(self.store_file_name, store_size)
+
+        self.list_files, self.list_angles = list_files, list_angles
+        self.image_shape, self.tilt_angle = image_shape, tilt_angle
+        logger.info(f"- resuming with the {len(self.list_files)} projections preprocessed by a previous attempt")
+        return True
+
+    def _save_state(self, correcting_tilt=False):
+        """save the list of the projections of the store (atomically, the store being flushed first)
+
+        correcting_tilt: the projections of the store are about to be modified, the store can not be used by
+        the next attempt until the state is saved again
+        """
+        state = {'list_files': self.list_files,
+                 'list_angles': self.list_angles,
+                 'image_shape': list(self.image_shape) if self.image_shape else None,
+                 'tilt_angle': self.tilt_angle,
+                 'correcting_tilt': correcting_tilt}
+        _fd, _tmp_file = tempfile.mkstemp(dir=os.path.dirname(self.state_file_name), suffix=".tmp")
+        with os.fdopen(_fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(_tmp_file, self.state_file_name)
+
+    def get_new_files(self):
+        """projections of the input folder not stored yet (and not being written), in acquisition order"""
+        list_stored = set(self.list_files) | self._skipped_files
+        now = time.time()
+        list_new_files = []
+        for _file in glob.glob(os.path.join(self.input_folder, "*.tif*")):
+            try:
+                _mtime = os.path.getmtime(_file)
+            except OSError:
+                continue
+            if (self.last_file_time is None) or (_mtime > self.last_file_time):
+                self.last_file_time = _mtime
+            if (_file not in list_stored) and (now - _mtime >= MINIMUM_FILE_AGE):
+                list_new_files.append(_file)
+
+        list_names, _, _, _ = get_ind_list([os.path.basename(_file) for _file in list_new_files])
+        return [os.path.join(self.input_folder, _name) for _name in list_names]
+
+    def ingest(self, list_files):
+        """preprocess and store the projections"""
+        for _start in range(0, len(list_files), self.projection_chunk_size):
+            _list_chunk = list_files[_start: _start + self.projection_chunk_size]
+            try:
+                _proj = read_tiff_from_full_name_list(_list_chunk, crop_box=self.crop_box,
+                                                      max_workers=self.max_workers)
+            except (OSError, ValueError) as error:
+                logger.info(f"- unable to read the projections at once ({error}), reading them one by one")
+                _list_chunk, _proj = self._read_one_by_one(_list_chunk)
+                if len(_list_chunk) == 0:
+                    continue
+            self._store_projections(_list_chunk, _proj)
+            self._update_tilt()
+            self._save_state()
+
+    def _read_one_by_one(self, list_files):
+        list_read = []
+        list_proj = []
+        for _file in list_files:
+            try:
+                list_proj.append(read_tiff_from_full_name_list([_file], crop_box=self.crop_box, max_workers=1))
+            except (OSError, ValueError) as error:
+                self._read_attempts[_file] = self._read_attempts.get(_file, 0) + 1
+                if self._read_attempts[_file] >= MAXIMUM_READ_ATTEMPTS:
+                    logger.info(f"- WARNING: {_file} can not be read ({error}), it is skipped!")
+                    self._skipped_files.add(_file)
+                continue
+            list_read.append(_file)
+        if len(list_read) == 0:
+            return [], None
+        return list_read, np.concatenate(list_proj)
+
+    def _store_projections(self, list_files, proj):
+        tilt = lazy_import("imars3d.backend.diagnostics.tilt")
+
+        proj = preprocess_projections(proj, self.ob, self.dc)
+        if self.tilt_angle is not None:
+            proj = tilt.apply_tilt_correction(proj, self.tilt_angle)
+        if self.image_shape is None:
+            self.image_shape = proj.shape[1:]
+
+        self._store.write(np.ascontiguousarray(proj, dtype=np.float32).tobytes())
+        self._store.flush()
+        self.list_files += list_files
+        self.list_angles += [get_angle(_file) for _file in list_files]
+        logger.info(f"- {len(self.list_files)} projections preprocessed")
+
+    def get_stack(self, mode='r'):
+        """(memory mapped) stack of the projections stored"""
+        return np.memmap(self.store_file_name, dtype=np.float32, mode=mode,
+                         shape=(len(self.list_files), *self.image_shape))
+
+    def _update_tilt(self, force=False):
+        """calculate the tilt and correct the projections already stored, as soon as the 0 and 180 degrees
+        projections are stored (or now if force)"""
+        tilt = lazy_import("imars3d.backend.diagnostics.tilt")
+
+        if (self.tilt_angle is not None) or (len(self.list_files) == 0):
+            return
+        if (max(self.list_angles) < 180) and not force:
+            return
+
+        index_0 = int(np.argmin(self.list_angles))
+        index_180 = find_proj180_ind(self.list_angles)[0]
+        stack = self.get_stack(mode='r+')
+        tilt_ang = tilt.calculate_tilt(image0=np.array(stack[index_0]), image180=np.array(stack[index_180]))
+        logger.info(f"- tilt angle: {tilt_ang.x} (from the projections at {self.list_angles[index_0]} "
+                    f"and {self.list_angles[index_180]} degrees)")
+
+        self._save_state(correcting_tilt=True)
+        self.tilt_angle = tilt_ang.x
+        for _start in range(0, len(stack), self.projection_chunk_size):
+            _end = min(_start + self.projection_chunk_size, len(stack))
+            stack[_start: _end] = tilt.apply_tilt_correction(np.array(stack[_start: _end]), self.tilt_angle)
+        stack.flush()
+        del stack
+        self._save_state()
+
+    def is_scan_complete(self, exposure_time, acquisition_time_coefficient=DEFAULT_ACQUISITION_TIME_COEFFICIENT):
+        """True once all the projections of the complete scan are stored"""
+        if self.last_file_time is None:
+            return False
+        self.scan_progress.update()
+        if len(self.list_files) + len(self._skipped_files) < self.scan_progress.number_of_projections:
+            # projections not stored yet
+            return False
+        if self.scan_progress.is_complete(acquisition_time_coefficient=acquisition_time_coefficient,
+                                          exposure_time=exposure_time):
+            return True
+        if time.time() > self.last_file_time + acquisition_time_coefficient * exposure_time:
+            logger.info(f"- no new projection for {acquisition_time_coefficient} x {exposure_time}s")
+            return True
+        return False
+
+    def run(self, output_folder, exposure_time, acquisition_time_coefficient=DEFAULT_ACQUISITION_TIME_COEFFICIENT,
+            ring_removal=True, slab_size=None, poll_interval=DEFAULT_POLL_INTERVAL, engine=None):
+        """store the projections as they arrive, then reconstruct the scan once it is complete (with the
+        ChunkedGridrec engine if given)"""
+        try:
+            with self.recorder.stage("progressive preprocessing") as _stage:
+                logger.info(f"- waiting for the projections of {self.input_folder}")
+                while True:
+                    _list_new_files = self.get_new_files()
+                    if _list_new_files:
+                        self.ingest(_list_new_files)
+                    elif self.is_scan_complete(exposure_time, acquisition_time_coefficient):
+                        break
+                    else:
+                        time.sleep(poll_interval)
+                logger.info(f"- scan complete, {len(self.list_files)} projections")
+                if len(self.list_files) == 0:
+                    raise ValueError(f"no projection could be read in {self.input_folder}!")
+                self._update_tilt(force=True)
+                _stage.add_array("stack", self.get_stack())
+
+            # the projections sorted by index, as the streaming and full memory modes do
+            list_names, ang_deg, theta, _ = get_ind_list([os.path.basename(_file) for _file in self.list_files])
+            proj180_ind = find_proj180_ind(ang_deg)[0]
+            position = {os.path.basename(_file): _index for _index, _file in enumerate(self.list_files)}
+            order = [position[_name] for _name in list_names]
+            if order == list(range(len(order))):
+                order = None
+
+            reconstruct_by_slabs(self.get_stack(), theta, proj180_ind, output_folder, ring_removal=ring_removal,
+                                 slab_size=slab_size, order=order, recorder=self.recorder, engine=engine)
+        except BaseException:
+            # kept for the next attempt
+            self.close(keep_store=True)
+            raise
+        self.close()
+
+    def close(self, keep_store=False):
+        if not self._store.closed:
+            self._store.close()
+        if keep_store:
+            return
+        for _file in (self.store_file_name, self.state_file_name):
+            if os.path.exists(_file):
+                os.remove(_file)
@@ -0,0 +1,171 @@
+"""long running reconstruction worker, keeping the scientific stack imported
+
+    > python rockit/reconstruction_worker.py -socket /tmp/rockit_reconstruction_worker.sock
+
+The worker imports tomopy, dxchange, bm3d_streak_removal and imars3d once, then listens on a local unix
+socket. Each request (one json line) is run in a child process forked from the worker, so the job starts with
+everything already imported, and its memory (and logging configuration) goes away with it:
+
+    {"command": "rockit_cli", "args": ["27158", "/HFIR/CG1D/IPTS-27158/raw/ct_scans/scan", ...]}
+    {"command": "rockit_imars3d_cli", "args": [...]}     # same arguments as the command lines
+    {"command": "imars3d", "config_file": "..._imars3d_config.json"}
+    {"command": "ping"}
+
+with, optionally, the cores the job is restricted to ("cores": [0, 1, ...]),
+and the answer (one json line) is {"status": "ok" or "failed", "returncode": ..., "duration": ..., "message": ...}.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import traceback
+import socketserver
+
+from utilites import lazy_import, get_import_time_report
+
+DEFAULT_SOCKET_FILE = "/tmp/rockit_reconstruction_worker.sock"
+
+# modules imported when the worker starts
+WARM_MODULES = ["numpy",
+                "tifffile",
+                "dxchange",
+                "tomopy",
+                "tomopy.misc.corr",
+                "tomopy.prep.normalize",
+                "tomopy.prep.alignment",
+                "bm3d_streak_removal",
+                "imars3d.backend.diagnostics.tilt",
+                "imars3d.backend.workflow.engine",
+                "rockit_cli",
+                "rockit_imars3d_cli"]
+
+logger = logging.getLogger("rockit.worker")
+
+
+def warm_up(list_modules=None):
+    """import the modules (the ones not installed are skipped)"""
+    for _module in (list_modules if list_modules else WARM_MODULES):
+        try:
+            lazy_import(_module)
+        except ImportError as error:
+            logger.info(f"- {_module} not imported: {error}")
+    for _line in get_import_time_report():
+        logger.info(f"- {_line}")
+
+
+def _reset_logging():
+    """the command lines configure the logging to their own log file (logging.basicConfig), which only works
+    if the root logger has no handler yet"""
+    for _handler in list(logging.root.handlers):
+        logging.root.removeHandler(_handler)
+        _handler.close()
+
+
+def run_request(request):
+    """run the job of the request in this process, returns its return code"""
+    command = request.get('command')
+    if request.get('cores'):
+        os.sched_setaffinity(0, request['cores'])
+
+    if command == 'ping':
+        return 0
+
+    if command == 'rockit_cli':
+        rockit_cli = lazy_import("rockit_cli")
+        args = rockit_cli.get_argument_parser().parse_args(request['args'])
+        _reset_logging()
+        rockit_cli.main(args)
+        return 0
+
+    if command == 'rockit_imars3d_cli':
+        rockit_imars3d_cli = lazy_import("rockit_imars3d_cli")
+        args = rockit_imars3d_cli.get_argument_parser().parse_args(request['args'])
+        _reset_logging()
+        json_config_file_name, log_file_name = rockit_imars3d_cli.prepare_imars3d_config(args)
+        if json_config_file_name is None:
+            return 0
+        logging.getLogger("rockit").info(f"Running the imars3d workflow of {json_config_file_name} in the worker")
+        rockit_imars3d_cli.run_imars3d_workflow(json_config_file_name)
+        with open(log_file_name, 'a') as f:
+            f.write("Done!\n")
+        return 0
+
+    if command == 'imars3d':
+        rockit_imars3d_cli = lazy_import("rockit_imars3d_cli")
+        rockit_imars3d_cli.run_imars3d_workflow(request['config_file'])
+        return 0
+
+    raise ValueError(f"unknown command {command}")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            logger.info(f"job {request}")
+            returncode = run_request(request)
+            message = ""
+        except SystemExit as error:
+            # the command lines exit(0) when there is nothing to reconstruct
+            returncode = error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+            message = f"exit({error.code})"
+        except Exception as error:
+            returncode = 1
+            message = f"{type(error).__name__}: {error}"
+            logger.info(traceback.format_exc())
+
+        duration = time.perf_counter() - start
+        logger.info(f"job done in {duration:.1f}s (return code {returncode})")
+        answer = {'status': 'ok' if returncode == 0 else 'failed',
+                  'returncode': returncode,
+                  'duration': duration,
+                  'message': message}
+        try:
+            self.wfile.write((json.dumps(answer) + "\n").encode())
+        except OSError:
+            # the client is gone
+            pass
+
+
+class ReconstructionWorker(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """unix socket server running each request in a forked child process"""
+
+    def __init__(self, socket_file=DEFAULT_SOCKET_FILE):
+        if os.path.exists(socket_file):
+            # left by a worker that did not stop cleanly
+            os.remove(socket_file)
+        super().__init__(socket_file, RequestHandler)
+        self.socket_file = socket_file
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_file):
+            os.remove(self.socket_file)
+
+
+def main(args):
+    logging.basicConfig(filename=args.log_file,
+                        format='[%(levelname)s] - %(asctime)s - %(process)d - %(message)s',
+                        level=logging.INFO)
+    logger.info(f"*** Starting the reconstruction worker on {args.socket}")
+    warm_up()
+
+    with ReconstructionWorker(socket_file=args.socket) as worker:
+        logger.info(f"ready")
+        try:
+            worker.serve_forever()
+        except KeyboardInterrupt:
+            logger.info(f"stopping the reconstruction worker")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-socket',
+                        default=DEFAULT_SOCKET_FILE,
+                        help=f"Unix socket the worker listens on (default {DEFAULT_SOCKET_FILE})")
+    parser.add_argument('-log_file',
+                        help="Log file of the worker (default: standard error)")
+    main(parser.parse_args())
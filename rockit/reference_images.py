@@ -0,0 +1,235 @@
+import os
+import glob
+import json
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from utilites import read_tiff_from_full_name_list, read_tiff_roi, get_crop_box, lazy_import, \
+    DEFAULT_LOADING_WORKERS
+
+logger = logging.getLogger("rockit")
+
+REFERENCE_METHODS = ['mean', 'median', 'robust_mean']
+
+# size (MB) above which the least recently used references of the disk cache are removed
+DEFAULT_CACHE_SIZE_MB = 2048
+CACHE_FILE_EXTENSION = ".npy"
+
+# memory (MB) used by the block of rows of all the files loaded at once by the median and robust mean
+MAXIMUM_BLOCK_SIZE_MB = 256
+
+# values further than that number of (normalized) median absolute deviations from the median are
+# left out of the robust mean
+ROBUST_MEAN_NUMBER_OF_MAD = 3
+
+# reference images kept in memory, {(tuple(list_files), method, crop_box): image}
+MAXIMUM_NUMBER_OF_CACHED_REFERENCES = 8
+_reference_cache = OrderedDict()
+
+
+def get_default_reference_cache_folder(ipts_folder):
+    """references of an IPTS are kept in /HFIR/CG1D/IPTS-1234/shared/autoreduce/reference_cache/"""
+    return os.path.join(ipts_folder, "shared", "autoreduce", "reference_cache")
+
+
+def get_reference_key(list_files, method='mean', crop_box=None):
+    """hash of everything the reference image depends on: the files (sorted, with their mtime and size),
+    the method and the crop box. A file replaced or modified gives a new key"""
+    list_file_stat = []
+    for _file in sorted(list_files):
+        _stat = os.stat(_file)
+        list_file_stat.append([_file, _stat.st_mtime_ns, _stat.st_size])
+    description = {'files': list_file_stat,
+                   'method': method,
+                   'crop_box': [int(_value) for _value in crop_box] if crop_box else None}
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+class ReferenceCache:
+    """reference images saved as <key>.npy in the cache folder
+
+    The files are used (their mtime is updated each time they are read) in least recently used order, and
+    the oldest ones are removed when the cache is over maximum_size_mb.
+    """
+
+    def __init__(self, cache_folder, maximum_size_mb=None):
+        self.cache_folder = cache_folder
+        self.maximum_size_mb = maximum_size_mb if maximum_size_mb else DEFAULT_CACHE_SIZE_MB
+
+    def _get_file_name(self, key):
+        return os.path.join(self.cache_folder, key + CACHE_FILE_EXTENSION)
+
+    def load(self, key):
+        """the image saved with that key, or None"""
+        file_name = self._get_file_name(key)
+        try:
+            image = np.load(file_name)
+            os.utime(file_name)
+        except (OSError, ValueError):
+            return None
+        return image
+
+    def save(self, key, image):
+        try:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            # write next to the final file, then swap, so a concurrent reader never sees a partial image
+            file_descriptor, tmp_file_name = tempfile.mkstemp(dir=self.cache_folder, suffix=".tmp")
+            with os.fdopen(file_descriptor, 'wb') as f:
+                np.save(f, image)
+            os.replace(tmp_file_name, self._get_file_name(key))
+        except OSError as error:
+            logger.warning(f"unable to save reference image in {self.cache_folder}: {error}")
+            return
+        self.evict(keep_key=key)
+
+    def evict(self, keep_key=None):
+        """remove the least recently used references until the cache fits in maximum_size_mb (the reference
+        keep_key, just saved, is never removed even if it is bigger than the cache on its own)"""
+        keep_file_name = self._get_file_name(keep_key) if keep_key else None
+        list_cache_files = []
+        for _file in glob.glob(os.path.join(self.cache_folder, "*" + CACHE_FILE_EXTENSION)):
+            if _file == keep_file_name:
+                continue
+            try:
+                _stat = os.stat(_file)
+            except OSError:
+                continue
+            list_cache_files.append((_stat.st_mtime, _stat.st_size, _file))
+
+        total_size = sum([_size for _, _size, _ in list_cache_files])
+        if keep_file_name and os.path.exists(keep_file_name):
+            total_size += os.path.getsize(keep_file_name)
+        maximum_size = self.maximum_size_mb * 1024 ** 2
+        for _, _size, _file in sorted(list_cache_files):
+            if total_size <= maximum_size:
+                break
+            try:
+                os.remove(_file)
+            except OSError:
+                continue
+            total_size -= _size
+
+
+def get_ob_crop_box(ob_file, automatic_edge_cropping=True, cache_folder=None, cache_size_mb=None):
+    """[ymin, ymax, xmin, xmax] of the area left by the slits on the OB (the whole image without automatic
+    edge cropping). The box is saved in the disk cache next to the reference images, keyed on the OB file
+    (name, mtime and size), so the next scans using that OB do not read it again"""
+    method = 'slits' if automatic_edge_cropping else 'full_image'
+    disk_cache = ReferenceCache(cache_folder, cache_size_mb) if cache_folder else None
+    if disk_cache is not None:
+        disk_key = get_reference_key([ob_file], method=method)
+        crop_box = disk_cache.load(disk_key)
+        if crop_box is not None:
+            logger.info(f"- crop box of {ob_file} found in {cache_folder}")
+            return [int(_value) for _value in crop_box]
+
+    first_ob = read_tiff_roi(ob_file)
+    height, width = np.shape(first_ob)
+    crop_box = [0, height, 0, width]
+    if automatic_edge_cropping:
+        find_slits_corners_aps_1id = lazy_import("tomopy.prep.alignment").find_slits_corners_aps_1id
+        slit_box_corners = find_slits_corners_aps_1id(img=first_ob, method='simple')
+        logger.info(f"-> slit_box_corners: {slit_box_corners}")
+        crop_box = get_crop_box(slit_box_corners)
+    crop_box = [int(_value) for _value in crop_box]
+
+    if disk_cache is not None:
+        disk_cache.save(disk_key, np.array(crop_box, dtype=np.int64))
+    return crop_box
+
+
+def _mean_image(list_files, crop_box=None, max_workers=None):
+    """running sum of the images, only max_workers images are in memory at once"""
+    chunk_size = max_workers if max_workers else DEFAULT_LOADING_WORKERS
+    total = None
+    for _start in range(0, len(list_files), chunk_size):
+        _images = read_tiff_from_full_name_list(list_files[_start: _start + chunk_size],
+                                                crop_box=crop_box,
+                                                max_workers=max_workers)
+        _sum = np.sum(_images, axis=0, dtype=np.float64)
+        total = _sum if total is None else total + _sum
+    return (total / len(list_files)).astype(np.float32)
+
+
+def _robust_mean(stack):
+    median = np.median(stack, axis=0)
+    mad = np.median(np.abs(stack - median), axis=0) * 1.4826
+    is_kept = np.abs(stack - median) <= ROBUST_MEAN_NUMBER_OF_MAD * mad
+    # the median is always kept, so there is at least one value per pixel
+    return np.sum(np.where(is_kept, stack, 0), axis=0) / np.sum(is_kept, axis=0)
+
+
+def _image_by_blocks_of_rows(list_files, function, crop_box=None, max_workers=None):
+    """apply function (stack -> image) block of rows by block of rows, reading only those rows of the files"""
+    first_image = read_tiff_roi(list_files[0], crop_box)
+    height, width = first_image.shape
+    ymin, xmin = (crop_box[0], crop_box[2]) if crop_box else (0, 0)
+
+    number_of_rows_per_block = int(MAXIMUM_BLOCK_SIZE_MB * 1024 ** 2 / (len(list_files) * width * 4))
+    number_of_rows_per_block = max(1, min(height, number_of_rows_per_block))
+
+    image = np.empty((height, width), dtype=np.float32)
+    for _row in range(0, height, number_of_rows_per_block):
+        _last_row = min(height, _row + number_of_rows_per_block)
+        _stack = read_tiff_from_full_name_list(list_files,
+                                               crop_box=[ymin + _row, ymin + _last_row, xmin, xmin + width],
+                                               max_workers=max_workers)
+        image[_row: _last_row] = function(_stack.astype(np.float32))
+    return image
+
+
+def compute_reference_image(list_files, method='mean', crop_box=None, max_workers=None, use_cache=True,
+                            cache_folder=None, cache_size_mb=None):
+    """reduce a list of OB (or DC) files to a single reference image (float32), without loading them all
+
+    method: 'mean' (running sum), 'median' or 'robust_mean' (mean of the values within
+        ROBUST_MEAN_NUMBER_OF_MAD of the median). The median and robust mean are computed block of rows
+        by block of rows
+    crop_box: [ymin, ymax, xmin, xmax] of the files to use
+    use_cache: reuse the image computed earlier (in this process) from the same list of files
+    cache_folder: also look for (and save) the image in this disk cache, shared by all the processes
+        (see ReferenceCache), cache_size_mb being the maximum size of that cache
+    """
+    if method not in REFERENCE_METHODS:
+        raise ValueError(f"method must be one of {REFERENCE_METHODS}, not {method}")
+
+    key = (tuple(list_files), method, tuple(crop_box) if crop_box else None)
+    if use_cache and key in _reference_cache:
+        _reference_cache.move_to_end(key)
+        return _reference_cache[key]
+
+    disk_cache = ReferenceCache(cache_folder, cache_size_mb) if cache_folder else None
+    if disk_cache is not None:
+        disk_key = get_reference_key(list_files, method=method, crop_box=crop_box)
+        image = disk_cache.load(disk_key)
+        if image is not None:
+            logger.info(f"- reference image {disk_key} found in {cache_folder}")
+            if use_cache:
+                _reference_cache[key] = image
+            return image
+
+    if method == 'mean':
+        image = _mean_image(list_files, crop_box=crop_box, max_workers=max_workers)
+    elif method == 'median':
+        image = _image_by_blocks_of_rows(list_files,
+                                         lambda _stack: np.median(_stack, axis=0),
+                                         crop_box=crop_box,
+                                         max_workers=max_workers)
+    else:
+        image = _image_by_blocks_of_rows(list_files,
+                                         _robust_mean,
+                                         crop_box=crop_box,
+                                         max_workers=max_workers)
+
+    if disk_cache is not None:
+        disk_cache.save(disk_key, image)
+
+    if use_cache:
+        _reference_cache[key] = image
+        while len(_reference_cache) > MAXIMUM_NUMBER_OF_CACHED_REFERENCES:
+            _reference_cache.popitem(last=False)
+    return image
@@ -1,7 +1,5 @@
 import os
 from pathlib import Path
-import pandas as pd
-from astropy.io import fits
 import numpy as np
 import pickle
 import shutil
@@ -12,10 +10,9 @@ import re
 import datetime
 import logging
 
-from ipywidgets import widgets
-from IPython.core.display import display, HTML
-
 from retrieve_matching_ob_dc.master_metadata_handler import MetadataHandler
+from retrieve_matching_ob_dc.parallel import map_in_threads
+from retrieve_matching_ob_dc.progress import get_progress_reporter
 
 
 def force_file_extension(filename, ext='.txt'):
@@ -148,6 +145,7 @@ def make_tiff(data=[], filename='', metadata=None):
 
 
 def make_fits(data=[], filename=''):
+    from astropy.io import fits
     fits.writeto(filename, data, clobber=True)
 
 
@@ -343,11 +341,21 @@ def _convert_epics_timestamp_to_rfc3339_timestamp(epics_timestamp):
     return unix_epoch_timestamp
 
 
-def retrieve_time_stamp(list_images, label=""):
+def retrieve_time_stamp(list_images, label="", list_metadata=None, max_workers=None, chunk_size=None,
+                        progress=None):
+    """retrieve the time stamp of all the images
+
+    if list_metadata (list of MetadataName) is provided, those metadata are read at the same time
+    so each file is only opened once, and returned under the 'list_metadata' key
+
+    max_workers and chunk_size define how the headers are read in parallel (see parallel.map_in_threads)
+    progress: how to report the progress ('none', 'logging', 'notebook', see progress.get_progress_reporter)
+    """
     if not list_images:
         return {'list_images': None,
                 'list_time_stamp': None,
-                'list_time_stamp_user_format': None}
+                'list_time_stamp_user_format': None,
+                'list_metadata': None}
 
     [_, ext] = os.path.splitext(list_images[0])
     if ext.lower() in ['.tiff', '.tif']:
@@ -358,32 +366,42 @@ def retrieve_time_stamp(list_images, label=""):
         raise ValueError
 
     message = "Retrieving time stamp of {}".format(label) if label else "Retrieving time stamp"
-    box = widgets.HBox([widgets.Label(message,
-                                      layout=widgets.Layout(width='20%')),
-                        widgets.IntProgress(min=0,
-                                            max=len(list_images),
-                                            value=0,
-                                            layout=widgets.Layout(width='50%'))
-                        ])
-    progress_bar = box.children[1]
-    display(box)
+    o_progress = get_progress_reporter(progress)
+    o_progress.start(message=message, maximum=len(list_images))
+
+    def _read_header(_file):
+        if list_metadata is None:
+            return {'time_stamp': MetadataHandler.get_time_stamp(file_name=_file, ext=ext),
+                    'metadata': None}
+        return MetadataHandler.get_time_stamp_and_metadata(file_name=_file,
+                                                           ext=ext,
+                                                           list_metadata=list_metadata)
+
+    list_header = map_in_threads(_read_header,
+                                 list_images,
+                                 max_workers=max_workers,
+                                 chunk_size=chunk_size,
+                                 progress_callback=o_progress.update)
 
     list_time_stamp = []
     list_time_stamp_user_format = []
-    for _index, _file in enumerate(list_images):
-        _time_stamp = MetadataHandler.get_time_stamp(file_name=_file, ext=ext)
-        _time_stamp = _convert_epics_timestamp_to_rfc3339_timestamp(_time_stamp)
+    list_file_metadata = [] if list_metadata is not None else None
+    for _header in list_header:
+        _time_stamp = _convert_epics_timestamp_to_rfc3339_timestamp(_header['time_stamp'])
         list_time_stamp.append(_time_stamp)
 
         _user_format = convert_to_human_readable_format(_time_stamp)
         list_time_stamp_user_format.append(_user_format)
-        progress_bar.value = _index + 1
 
-    box.close()
+        if list_metadata is not None:
+            list_file_metadata.append(_header['metadata'])
+
+    o_progress.close()
 
     return {'list_images': list_images,
             'list_time_stamp': list_time_stamp,
-            'list_time_stamp_user_format': list_time_stamp_user_format}
+            'list_time_stamp_user_format': list_time_stamp_user_format,
+            'list_metadata': list_file_metadata}
 
 
 def get_list_of_files(folder="", extension='tiff'):
@@ -588,6 +606,7 @@ def read_bragg_edge_fitting_ascii_format(full_file_name):
         metadata['march-dollase history table'] = march_history_table
         metadata['march-dollase history init'] = march_history_init
 
+    import pandas as pd
     pd_data = pd.read_csv(full_file_name, skiprows=line_number, header=0, names=col_label)
     return {'data': pd_data, 'metadata': metadata}
 
@@ -650,6 +669,9 @@ class ListMostDominantExtension(object):
 
         else:
 
+            from ipywidgets import widgets
+            from IPython.display import display
+
             list_of_maj_ext = [_ext for _ext in self.counter_extension.keys() if
                                self.counter_extension[_ext] == self.dominant_number]
 
@@ -1,9 +1,13 @@
-from PIL import Image
 import datetime
 import os
 from collections import OrderedDict
-from ipywidgets import widgets
-from IPython.core.display import display
+
+from retrieve_matching_ob_dc.tiff_header import get_tiff_tags
+from retrieve_matching_ob_dc.parallel import map_in_threads
+from retrieve_matching_ob_dc.progress import get_progress_reporter
+
+# tags used to define the time stamp (seconds, nano seconds, and full time stamp used as fallback)
+TIME_STAMP_TAGS = [65002, 65003, 65000]
 
 
 class MetadataHandler:
@@ -13,19 +17,10 @@ class MetadataHandler:
 
         if ext == 'tif':
             try:
-                o_image = Image.open(file_name)
-                o_dict = dict(o_image.tag_v2)
-                try:
-                    time_stamp_s = o_dict[65002]
-                    time_stamp_ns = o_dict[65003]
-                    time_stamp = time_stamp_s + time_stamp_ns * 1e-9
-                except:
-                    time_stamp = o_dict[65000]
-
-                time_stamp = MetadataHandler._convert_epics_timestamp_to_rfc3339_timestamp(time_stamp)
-
-            except:
-                time_stamp = os.path.getmtime(file_name)
+                o_dict = get_tiff_tags(file_name, list_tags=TIME_STAMP_TAGS)
+            except Exception:
+                o_dict = {}
+            time_stamp = MetadataHandler.get_time_stamp_from_tags(o_dict, file_name=file_name)
         elif ext == 'fits':
             time_stamp = os.path.getmtime(file_name)
         elif ext == 'jpg':
@@ -38,6 +33,41 @@ class MetadataHandler:
 
         return time_stamp
 
+    @staticmethod
+    def get_time_stamp_from_tags(tags, file_name=''):
+        """time stamp from the tags already read from the file, using the file mtime if
+        the time stamp tags are not there"""
+        try:
+            try:
+                time_stamp_s = tags[65002]
+                time_stamp_ns = tags[65003]
+                time_stamp = time_stamp_s + time_stamp_ns * 1e-9
+            except:
+                time_stamp = tags[65000]
+
+            time_stamp = MetadataHandler._convert_epics_timestamp_to_rfc3339_timestamp(time_stamp)
+
+        except:
+            time_stamp = os.path.getmtime(file_name)
+
+        return time_stamp
+
+    @staticmethod
+    def get_time_stamp_and_metadata(file_name='', ext='tif', list_metadata=[]):
+        """retrieve the time stamp and the list_metadata (MetadataName objects) opening the file only once"""
+        if ext != 'tif':
+            return {'time_stamp': MetadataHandler.get_time_stamp(file_name=file_name, ext=ext),
+                    'metadata': {_meta: None for _meta in list_metadata}}
+
+        list_tags = TIME_STAMP_TAGS + [_meta.value for _meta in list_metadata]
+        try:
+            tags = get_tiff_tags(file_name, list_tags=list_tags)
+        except Exception:
+            tags = {}
+
+        return {'time_stamp': MetadataHandler.get_time_stamp_from_tags(tags, file_name=file_name),
+                'metadata': {_meta: tags.get(_meta.value) for _meta in list_metadata}}
+
     @staticmethod
     def convert_to_human_readable_format(timestamp):
         """Convert the unix time stamp into a human readable time format
@@ -69,13 +99,10 @@ class MetadataHandler:
         if filename == "":
             return {}
 
-        image = Image.open(filename)
-        metadata = image.tag_v2
+        metadata = get_tiff_tags(filename, list_tags=list_metadata)
         result = {}
         for _meta in list_metadata:
             result[_meta] = metadata.get(_meta)
-
-        image.close()
         return result
 
     @staticmethod
@@ -83,73 +110,66 @@ class MetadataHandler:
         if filename == "":
             return {}
 
-        image = Image.open(filename)
-        metadata = image.tag_v2
-        result = {}
         if list_metadata == []:
-            for _key in metadata.keys():
-                result[_key] = metadata.get(_key)
-            return result
+            return get_tiff_tags(filename)
 
+        metadata = get_tiff_tags(filename, list_tags=[_meta.value for _meta in list_metadata])
+        result = {}
         for _meta in list_metadata:
             result[_meta] = metadata.get(_meta.value)
-
-        image.close()
         return result
 
     @staticmethod
-    def retrieve_metadata(list_files=[], list_metadata=[], using_enum_object=False):
+    def retrieve_metadata(list_files=[], list_metadata=[], using_enum_object=False, max_workers=None,
+                          chunk_size=None):
         if list_files == []:
             return {}
 
-        _dict = OrderedDict()
-        for _file in list_files:
-            _meta = MetadataHandler.get_metadata(filename=_file,
-                                                 list_metadata=list_metadata,
-                                                 using_enum_object=using_enum_object)
-            _dict[_file] = _meta
+        def _get_metadata(_file):
+            return MetadataHandler.get_metadata(filename=_file,
+                                                list_metadata=list_metadata,
+                                                using_enum_object=using_enum_object)
 
-        return _dict
+        list_meta = map_in_threads(_get_metadata,
+                                   list_files,
+                                   max_workers=max_workers,
+                                   chunk_size=chunk_size)
+        return OrderedDict(zip(list_files, list_meta))
 
     @staticmethod
     def get_value_of_metadata_key(filename='', list_key=None):
         if filename == "":
             return {}
 
-        image = Image.open(filename)
-        metadata = image.tag_v2
-        result = {}
         if list_key == []:
-            for _key in metadata.keys():
-                result[_key] = metadata.get(_key)
-            return result
+            return get_tiff_tags(filename)
 
+        metadata = get_tiff_tags(filename, list_tags=list_key)
+        result = {}
         for _meta in list_key:
             result[_meta] = metadata.get(_meta)
-
-        image.close()
         return result
 
     @staticmethod
-    def retrieve_value_of_metadata_key(list_files=[], list_key=[], is_from_notebook=False):
+    def retrieve_value_of_metadata_key(list_files=[], list_key=[], is_from_notebook=False, max_workers=None,
+                                       chunk_size=None, progress=None):
+        """progress: None (same as 'logging'), 'none', 'logging', 'notebook' or a ProgressReporter.
+        is_from_notebook=True is the same as progress='notebook'"""
         if list_files == []:
             return {}
 
-        if is_from_notebook:
-            progress_bar = widgets.IntProgress(min=0,
-                                               max=len(list_files)-1,
-                                               value=0)
-            display(progress_bar)
+        o_progress = get_progress_reporter('notebook' if is_from_notebook else progress)
+        o_progress.start(maximum=len(list_files))
 
-        _dict = OrderedDict()
-        for _index, _file in enumerate(list_files):
-            _meta = MetadataHandler.get_value_of_metadata_key(filename=_file,
-                                                              list_key=list_key)
-            _dict[_file] = _meta
-            if is_from_notebook:
-                progress_bar.value = _index
+        def _get_value_of_metadata_key(_file):
+            return MetadataHandler.get_value_of_metadata_key(filename=_file,
+                                                             list_key=list_key)
 
-        if is_from_notebook:
-            progress_bar.close()
+        list_meta = map_in_threads(_get_value_of_metadata_key,
+                                   list_files,
+                                   max_workers=max_workers,
+                                   chunk_size=chunk_size,
+                                   progress_callback=o_progress.update)
+        o_progress.close()
 
-        return _dict
\ No newline at end of file
+        return OrderedDict(zip(list_files, list_meta))
@@ -0,0 +1,184 @@
+import numpy as np
+
+EXPOSURE_TIME_KEY = 65027
+
+# small margin added to the search window, the exact tolerance is checked afterwards on the selected candidates
+SEARCH_MARGIN = 1e-9
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+class _Bucket:
+
+    def __init__(self):
+        self.list_index = []
+        self.list_values = []
+
+    def freeze(self):
+        """sort the candidates by the first numerical metadata, so the candidates close to a given value
+        can be found with a binary search"""
+        index = np.array(self.list_index, dtype=int)
+        values = np.array(self.list_values, dtype=float).reshape(len(self.list_index), -1)
+        if values.shape[1] > 0:
+            order = np.argsort(values[:, 0], kind='stable')
+            index = index[order]
+            values = values[order]
+        self.index = index
+        self.values = values
+        del self.list_index, self.list_values
+
+
+class MatchingIndex:
+    """index of OB (or DC) candidates used to find the ones matching a sample configuration
+
+    The candidates are grouped by exposure time and by all their non numerical metadata (detector
+    manufacturer), then, within a group, they are sorted by the first numerical metadata (aperture). A
+    match is a candidate of the same group with all its numerical metadata within metadata_error_allowed
+    of the sample values, which is the same rule as RetrieveMatchingOBDC.all_metadata_match.
+
+    metadata_dict: {index: {'filename': file, 65027: {'value': value, 'name': name}, ...}, ...}
+    list_key_to_check: list of tags (other than the exposure time) that must match
+    """
+
+    def __init__(self, metadata_dict=None, list_key_to_check=None, metadata_error_allowed=1):
+        self.metadata_dict = metadata_dict if metadata_dict else {}
+        self.list_key_to_check = [_key for _key in list_key_to_check if _key != EXPOSURE_TIME_KEY]
+        self.metadata_error_allowed = metadata_error_allowed
+
+        self.list_entries = list(self.metadata_dict.values())
+        self.buckets = {}
+        for _index, _entry in enumerate(self.list_entries):
+            _signature = self._get_signature(_entry)
+            if _signature is None:
+                continue
+            _bucket_key, _numerical_values = _signature
+            self.buckets.setdefault(_bucket_key, _Bucket())
+            self.buckets[_bucket_key].list_index.append(_index)
+            self.buckets[_bucket_key].list_values.append(_numerical_values)
+
+        for _bucket in self.buckets.values():
+            _bucket.freeze()
+
+    def _get_signature(self, metadata):
+        """return the key of the bucket and the list of numerical values of the metadata, or None if
+        one of the metadata is missing"""
+        try:
+            exposure_time = metadata[EXPOSURE_TIME_KEY]['value']
+            list_values = [metadata[_key]['value'] for _key in self.list_key_to_check]
+        except (KeyError, TypeError):
+            return None
+
+        categorical = []
+        numerical_values = []
+        for _key, _value in zip(self.list_key_to_check, list_values):
+            _float_value = _to_float(_value)
+            if _float_value is None:
+                categorical.append((_key, _value))
+            else:
+                categorical.append((_key, None))
+                numerical_values.append(_float_value)
+
+        return (exposure_time, tuple(categorical)), numerical_values
+
+    def get_matching(self, sample_metadata):
+        """return the list of candidates (in their original order) matching the sample metadata"""
+        _signature = self._get_signature(sample_metadata)
+        if _signature is None:
+            return []
+
+        _bucket_key, _numerical_values = _signature
+        _bucket = self.buckets.get(_bucket_key)
+        if _bucket is None:
+            return []
+
+        if len(_numerical_values) == 0:
+            list_index = _bucket.index
+        else:
+            _values = np.array(_numerical_values, dtype=float)
+            _sorted_first_values = _bucket.values[:, 0]
+            _window = self.metadata_error_allowed + SEARCH_MARGIN
+            _left = np.searchsorted(_sorted_first_values, _values[0] - _window, side='left')
+            _right = np.searchsorted(_sorted_first_values, _values[0] + _window, side='right')
+            _candidates = _bucket.values[_left: _right]
+            _is_matching = ~np.any(np.abs(_candidates - _values) > self.metadata_error_allowed, axis=1)
+            list_index = _bucket.index[_left: _right][_is_matching]
+
+        return [self.list_entries[_index] for _index in np.sort(list_index)]
+
+
+class TimeSortedIndex:
+    """list of OB (or DC) files sorted by time stamp, used to select the files acquired close to the sample
+
+    list_entries: [{'filename': file, 'time_stamp': value, ...}, ...]
+    """
+
+    def __init__(self, list_entries=None):
+        self.list_entries = list_entries if list_entries else []
+        time_stamp = np.array([_entry['time_stamp'] for _entry in self.list_entries], dtype=float)
+        self.order = np.argsort(time_stamp, kind='stable')
+        self.time_stamp = time_stamp[self.order]
+
+    def select_in_time_window(self, start_time_stamp, end_time_stamp):
+        """positions (in the sorted list) of the files acquired between start and end time stamps"""
+        left = np.searchsorted(self.time_stamp, start_time_stamp, side='left')
+        right = np.searchsorted(self.time_stamp, end_time_stamp, side='right')
+        return np.arange(left, right)
+
+    def select_nearest(self, first_time_stamp, last_time_stamp, number_of_files, positions=None):
+        """positions (in the sorted list) of the number_of_files files acquired the closest to the
+        [first_time_stamp, last_time_stamp] interval. Files acquired during that interval come first
+
+        positions: only look at those (consecutive) positions, by default all the files
+        """
+        if positions is None:
+            positions = np.arange(len(self.time_stamp))
+        if len(positions) <= number_of_files:
+            return positions
+
+        time_stamp = self.time_stamp[positions]
+        inside_left = np.searchsorted(time_stamp, first_time_stamp, side='left')
+        inside_right = np.searchsorted(time_stamp, last_time_stamp, side='right')
+
+        selection = list(range(inside_left, inside_right))[:number_of_files]
+        before = inside_left - 1
+        after = inside_right
+        while len(selection) < number_of_files:
+            distance_before = first_time_stamp - time_stamp[before] if before >= 0 else np.inf
+            distance_after = time_stamp[after] - last_time_stamp if after < len(time_stamp) else np.inf
+            if distance_before <= distance_after:
+                selection.append(before)
+                before -= 1
+            else:
+                selection.append(after)
+                after += 1
+
+        return positions[np.sort(selection)]
+
+    def get_entries(self, positions=None):
+        """entries at those positions, in their original order"""
+        if positions is None:
+            positions = np.arange(len(self.time_stamp))
+        return [self.list_entries[_index] for _index in np.sort(self.order[positions])]
+
+    def get_time_range(self, first_time_stamp, last_time_stamp, positions=None):
+        """how long (s) before the first sample image the first file was acquired,
+        and how long after the last sample image the last file was acquired"""
+        if positions is None:
+            positions = np.arange(len(self.time_stamp))
+        if len(positions) == 0:
+            return {'before': np.NaN,
+                    'after': np.NaN}
+        return {'before': first_time_stamp - self.time_stamp[positions[0]],
+                'after': self.time_stamp[positions[-1]] - last_time_stamp}
+
+    def get_first_and_last_entries(self, positions=None):
+        if positions is None:
+            positions = np.arange(len(self.time_stamp))
+        if len(positions) == 0:
+            return {}, {}
+        return self.list_entries[self.order[positions[0]]], self.list_entries[self.order[positions[-1]]]
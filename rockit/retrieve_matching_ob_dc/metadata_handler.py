@@ -1,17 +1,15 @@
-from IPython.core.display import display, HTML
 import collections
 import numpy as np
 import os
 import logging
 from enum import Enum
 from PIL import Image
-from ipywidgets import widgets
 import datetime
 from collections import OrderedDict
 
-from .retrieve_matching_ob_dc import file_handler
-from .retrieve_matching_ob_dc.code.dictionary import combine_dictionaries
-from .retrieve_matching_ob_dc.master_metadata_handler import MetadataHandler as MasterMetadataHandler
+from retrieve_matching_ob_dc import file_handler
+from retrieve_matching_ob_dc.dictionary import combine_dictionaries
+from retrieve_matching_ob_dc.master_metadata_handler import MetadataHandler as MasterMetadataHandler
 
 
 class MetadataName(Enum):
@@ -45,7 +43,8 @@ METADATA_KEYS = {'ob' : [MetadataName.EXPOSURE_TIME,
 class MetadataHandler:
 
     @staticmethod
-    def retrieve_metadata(list_of_files=None, display_infos=False, label=""):
+    def retrieve_metadata(list_of_files=None, display_infos=False, label="", max_workers=None, chunk_size=None,
+                          progress=None):
         """
         dict = {'file1': {'metadata1_key': {'value': value, 'name': name},
                           'metadata2_key': {'value': value, 'name': name},
@@ -58,14 +57,24 @@ class MetadataHandler:
         if not list_of_files:
             return {}
 
-        _dict = file_handler.retrieve_time_stamp(list_of_files, label=label)
+        # time stamp and beamline metadata are read together, so each file is opened only once
+        list_metadata = METADATA_KEYS['all']
+        _dict = file_handler.retrieve_time_stamp(list_of_files,
+                                                 label=label,
+                                                 list_metadata=list_metadata,
+                                                 max_workers=max_workers,
+                                                 chunk_size=chunk_size,
+                                                 progress=progress)
         _time_metadata_dict = MetadataHandler._reformat_dict(dictionary=_dict)
 
-        _beamline_metadata_dict = MetadataHandler.retrieve_beamline_metadata(list_of_files)
+        _raw_beamline_metadata_dict = OrderedDict(zip(list_of_files, _dict['list_metadata']))
+        _beamline_metadata_dict = MetadataHandler._format_beamline_metadata(_raw_beamline_metadata_dict,
+                                                                            list_metadata=list_metadata)
         _metadata_dict = combine_dictionaries(master_dictionary=_time_metadata_dict,
                                               servant_dictionary=_beamline_metadata_dict)
 
         if display_infos:
+            from IPython.display import display, HTML
             display(HTML('<span style="font-size: 20px; color:blue">Nbr of images: ' + str(len(_metadata_dict)) +
                          '</span'))
             display(HTML('<span style="font-size: 20px; color:blue">First image was taken at : ' + \
@@ -77,7 +86,7 @@ class MetadataHandler:
         return _metadata_dict
 
     @staticmethod
-    def retrieve_beamline_metadata(list_files):
+    def retrieve_beamline_metadata(list_files, max_workers=None, chunk_size=None):
         """list of metadata to retrieve is:000
             - acquisition time -> 65027
             - detector type -> 65026 (Manufacturer)
@@ -86,9 +95,21 @@ class MetadataHandler:
         """
         list_metadata = METADATA_KEYS['all']
         _dict = MasterMetadataHandler.retrieve_metadata(list_files=list_files,
-                                                                   list_metadata=list_metadata,
-                                                                   using_enum_object=True)
+                                                        list_metadata=list_metadata,
+                                                        using_enum_object=True,
+                                                        max_workers=max_workers,
+                                                        chunk_size=chunk_size)
+        return MetadataHandler._format_beamline_metadata(_dict, list_metadata=list_metadata)
 
+    @staticmethod
+    def _format_beamline_metadata(dictionary, list_metadata=None):
+        """
+        to go from
+            {'file1': {MetadataName: 'name:value', ...}, ...}
+        to
+            {'file1': {metadata_key: {'value': value, 'name': name}, ...}, ...}
+        """
+        _dict = dictionary
         for _file_key in _dict.keys():
             _file_dict = {}
             for _pv in list_metadata:
@@ -0,0 +1,147 @@
+import os
+import json
+import logging
+import tempfile
+from collections import OrderedDict
+
+from retrieve_matching_ob_dc.metadata_handler import MetadataHandler
+
+INDEX_VERSION = 1
+INDEX_FILE_EXTENSION = "_metadata_index.json"
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_metadata_index_folder(IPTS_folder):
+    """returns the folder where the OB/DC metadata index of this IPTS is kept
+
+    IPTS_folder is the raw folder of the IPTS (ex: /HFIR/CG1D/IPTS-1234/raw)
+    and the index is saved in /HFIR/CG1D/IPTS-1234/shared/autoreduce/metadata_index/
+    """
+    ipts_folder = os.path.dirname(os.path.abspath(IPTS_folder))
+    return os.path.join(ipts_folder, "shared", "autoreduce", "metadata_index")
+
+
+def get_metadata_index_file_name(index_folder, data_type='ob'):
+    if type(data_type) is list:
+        data_type = "_".join(data_type)
+    return os.path.join(index_folder, data_type + INDEX_FILE_EXTENSION)
+
+
+class MetadataIndex:
+    """persistent index of the metadata of the OB or DC files of an IPTS
+
+    Each entry is keyed by the full file name and records the mtime and size of the file at the time
+    its header was parsed, so only new or modified files have to be opened again.
+
+    index = {'version': 1,
+             'files': {'/path/file1.tiff': {'mtime_ns': value,
+                                            'size': value,
+                                            'metadata': {'filename': '/path/file1.tiff',
+                                                         'time_stamp': value,
+                                                         'time_stamp_user_format': value,
+                                                         65027: {'value': value, 'name': name},
+                                                         ...
+                                                         },
+                                            },
+                       ...
+                       }
+             }
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+        self.files = {}
+        self.load()
+
+    def load(self):
+        self.files = {}
+        if (self.index_file is None) or (not os.path.exists(self.index_file)):
+            return
+
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"metadata index {self.index_file} can not be read, it will be rebuilt!")
+            return
+
+        if index.get('version') != INDEX_VERSION:
+            logger.info(f"metadata index {self.index_file} has an old format, it will be rebuilt!")
+            return
+
+        for _file, _entry in index['files'].items():
+            _entry['metadata'] = MetadataIndex._restore_tag_keys(_entry['metadata'])
+            self.files[_file] = _entry
+
+    def save(self):
+        if self.index_file is None:
+            return
+
+        index_folder = os.path.dirname(self.index_file)
+        try:
+            os.makedirs(index_folder, exist_ok=True)
+            # write next to the final file, then swap, so a concurrent reader never sees a partial index
+            file_descriptor, tmp_file_name = tempfile.mkstemp(dir=index_folder, suffix=".tmp")
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self.files}, f)
+            os.replace(tmp_file_name, self.index_file)
+        except OSError as error:
+            logger.warning(f"unable to save metadata index {self.index_file}: {error}")
+
+    def update(self, list_of_files=None, label="", max_workers=None, chunk_size=None, progress=None):
+        """return the metadata of all the files, only parsing the headers of the files that are new or
+        have been modified since the last update
+
+        The returned dictionary has the same format as MetadataHandler.retrieve_metadata
+        """
+        if not list_of_files:
+            return {}
+
+        list_file_stat = {}
+        list_files_to_parse = []
+        for _file in list_of_files:
+            _stat = os.stat(_file)
+            list_file_stat[_file] = {'mtime_ns': _stat.st_mtime_ns, 'size': _stat.st_size}
+            _entry = self.files.get(_file)
+            if (_entry is None) or \
+                    (_entry['mtime_ns'] != _stat.st_mtime_ns) or \
+                    (_entry['size'] != _stat.st_size):
+                list_files_to_parse.append(_file)
+
+        logger.info(f"metadata index ({label}): {len(list_of_files) - len(list_files_to_parse)} files "
+                    f"up to date, {len(list_files_to_parse)} files to parse")
+
+        if list_files_to_parse:
+            _new_metadata_dict = MetadataHandler.retrieve_metadata(list_of_files=list_files_to_parse,
+                                                                   label=label,
+                                                                   max_workers=max_workers,
+                                                                   chunk_size=chunk_size,
+                                                                   progress=progress)
+            for _metadata in _new_metadata_dict.values():
+                _file = _metadata['filename']
+                self.files[_file] = {**list_file_stat[_file],
+                                     'metadata': _metadata}
+
+        # forget about the files that have been removed from the folders
+        list_removed_files = set(self.files.keys()) - set(list_file_stat.keys())
+        for _file in list_removed_files:
+            del self.files[_file]
+
+        if list_files_to_parse or list_removed_files:
+            self.save()
+
+        metadata_dict = OrderedDict()
+        for _index, _file in enumerate(list_of_files):
+            metadata_dict[_index] = self.files[_file]['metadata']
+        return metadata_dict
+
+    @staticmethod
+    def _restore_tag_keys(metadata):
+        """json saves the integer TIFF tags as strings, this brings them back to integers"""
+        restored_metadata = {}
+        for _key, _value in metadata.items():
+            if _key.isdigit():
+                _key = int(_key)
+            restored_metadata[_key] = _value
+        return restored_metadata
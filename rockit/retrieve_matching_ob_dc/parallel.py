@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# headers are read over GPFS/NFS, where each open costs milliseconds, so the threads mostly wait on I/O
+DEFAULT_MAX_WORKERS = 8
+
+# below that number of files, starting the threads costs more than it saves
+MINIMUM_NUMBER_OF_FILES_FOR_THREADS = 32
+
+
+def _run_chunk(function, list_items):
+    return [function(_item) for _item in list_items]
+
+
+def map_in_threads(function, list_items, max_workers=None, chunk_size=None, progress_callback=None):
+    """return [function(item) for item in list_items], running the calls in a pool of threads
+
+    The order of the returned list is the order of list_items.
+
+    max_workers: number of threads (DEFAULT_MAX_WORKERS if None). 1 forces the serial mode
+    chunk_size: number of items given to a thread at once. By default the list is split so that each
+        worker gets about 4 chunks
+    progress_callback: function called with the number of items done so far, from the calling thread
+    """
+    list_items = list(list_items)
+    number_of_items = len(list_items)
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+
+    if (max_workers <= 1) or (number_of_items < MINIMUM_NUMBER_OF_FILES_FOR_THREADS):
+        result = []
+        for _index, _item in enumerate(list_items):
+            result.append(function(_item))
+            if progress_callback:
+                progress_callback(_index + 1)
+        return result
+
+    if chunk_size is None:
+        chunk_size = max(1, number_of_items // (max_workers * 4))
+
+    list_chunks = [list_items[_start: _start + chunk_size] for _start in range(0, number_of_items, chunk_size)]
+
+    result = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list_futures = [executor.submit(_run_chunk, function, _chunk) for _chunk in list_chunks]
+        for _future in list_futures:
+            result.extend(_future.result())
+            if progress_callback:
+                progress_callback(len(result))
+
+    return result
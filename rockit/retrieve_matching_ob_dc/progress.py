@@ -0,0 +1,88 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the logging reporter writes a line every time that fraction of the files has been processed
+LOGGING_STEP_FRACTION = 0.1
+
+
+class ProgressReporter:
+    """progress reporter that does nothing, base class of all the reporters
+
+    o_progress.start(message, maximum)
+    o_progress.update(value)   # value goes from 1 to maximum
+    o_progress.close()
+    """
+
+    def start(self, message="", maximum=0):
+        pass
+
+    def update(self, value):
+        pass
+
+    def close(self):
+        pass
+
+
+class LoggingProgress(ProgressReporter):
+    """report the progress in the log file, for the command line and the autoreduction"""
+
+    def start(self, message="", maximum=0):
+        self.message = message
+        self.maximum = maximum
+        self.step = max(1, int(maximum * LOGGING_STEP_FRACTION))
+        self.next_value_to_report = self.step
+        logger.info(f"{message} ({maximum} files) ...")
+
+    def update(self, value):
+        if value >= self.next_value_to_report:
+            logger.info(f"{self.message}: {value}/{self.maximum}")
+            while self.next_value_to_report <= value:
+                self.next_value_to_report += self.step
+
+    def close(self):
+        logger.info(f"{self.message} ... Done!")
+
+
+class NotebookProgress(ProgressReporter):
+    """progress bar displayed in the notebook. ipywidgets and IPython are only imported when
+    this reporter is used"""
+
+    def start(self, message="", maximum=0):
+        from ipywidgets import widgets
+        from IPython.display import display
+
+        self.box = widgets.HBox([widgets.Label(message,
+                                               layout=widgets.Layout(width='20%')),
+                                 widgets.IntProgress(min=0,
+                                                     max=maximum,
+                                                     value=0,
+                                                     layout=widgets.Layout(width='50%'))
+                                 ])
+        self.progress_bar = self.box.children[1]
+        display(self.box)
+
+    def update(self, value):
+        self.progress_bar.value = value
+
+    def close(self):
+        self.box.close()
+
+
+PROGRESS_REPORTERS = {'none': ProgressReporter,
+                      'logging': LoggingProgress,
+                      'notebook': NotebookProgress}
+
+
+def get_progress_reporter(progress=None):
+    """return a progress reporter
+
+    progress: None (same as 'logging'), 'none', 'logging', 'notebook' or a ProgressReporter object
+    """
+    if isinstance(progress, ProgressReporter):
+        return progress
+    if progress is None:
+        progress = 'logging'
+    if progress not in PROGRESS_REPORTERS:
+        raise ValueError(f"progress must be one of {list(PROGRESS_REPORTERS.keys())}, not {progress}")
+    return PROGRESS_REPORTERS[progress]()
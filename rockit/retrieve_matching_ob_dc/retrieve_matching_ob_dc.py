@@ -1,6 +1,9 @@
 import os
 from retrieve_matching_ob_dc.file_handler import get_list_of_all_files_in_subfolders
 from retrieve_matching_ob_dc.metadata_handler import MetadataHandler
+from retrieve_matching_ob_dc.matching_index import MatchingIndex, TimeSortedIndex
+from retrieve_matching_ob_dc.metadata_index import MetadataIndex, get_default_metadata_index_folder, \
+    get_metadata_index_file_name
 from enum import Enum
 import numpy as np
 import collections
@@ -39,9 +42,31 @@ METADATA_KEYS = {'ob' : [MetadataName.EXPOSURE_TIME,
 
 class RetrieveMatchingOBDC:
 
-    def __init__(self, list_sample_data=None, IPTS_folder=None):
+    def __init__(self, list_sample_data=None, IPTS_folder=None, maximum_number_of_files_to_use=None,
+                 maximum_time_offset_mn=None, use_metadata_index=True, metadata_index_folder=None,
+                 max_workers=None, chunk_size=None, progress=None):
+        """
+        maximum_number_of_files_to_use: only keep the N OB acquired the closest to the sample
+        maximum_time_offset_mn: only keep the OB acquired within that many minutes of the first
+            and last sample images
+        use_metadata_index: if True, the metadata of the OB and DC files are kept in a persistent index
+            so only the new or modified files have their header parsed
+        metadata_index_folder: where to keep the index. Default is <IPTS>/shared/autoreduce/metadata_index
+        max_workers: number of threads used to read the headers (1 to read them one after the other)
+        chunk_size: number of files given to a thread at once
+        progress: how to report the progress of the header reads ('none', 'logging' (default) or 'notebook')
+        """
         self.list_sample_data = list_sample_data
         self.IPTS_folder = IPTS_folder
+        self.maximum_number_of_files_to_use = maximum_number_of_files_to_use
+        self.maximum_time_offset_mn = maximum_time_offset_mn
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+        if use_metadata_index and (metadata_index_folder is None):
+            metadata_index_folder = get_default_metadata_index_folder(IPTS_folder)
+        self.metadata_index_folder = metadata_index_folder if use_metadata_index else None
 
     def run(self):
         self.retrieve_sample_metadata()
@@ -50,6 +75,8 @@ class RetrieveMatchingOBDC:
         self.create_master_sample_dict()
         self.match_ob()
         self.match_dc()
+        self.select_ob()
+        self.select_dc()
 
     def get_matching_ob(self):
         return self.get_matching_data_file(data_type='ob')
@@ -60,25 +87,58 @@ class RetrieveMatchingOBDC:
     def retrieve_sample_metadata(self):
         self.sample_metadata_dict = MetadataHandler.retrieve_metadata(list_of_files=self.list_sample_data,
                                                                       display_infos=False,
-                                                                      label='sample')
+                                                                      label='sample',
+                                                                      max_workers=self.max_workers,
+                                                                      chunk_size=self.chunk_size,
+                                                                      progress=self.progress)
 
     def retrieve_ob_metadata(self):
-        self.ob_metadata_dict = RetrieveMatchingOBDC.auto_retrieve_metadata(self.IPTS_folder,
-                                                                            data_type='ob')
+        self.ob_metadata_dict = RetrieveMatchingOBDC.auto_retrieve_metadata(
+                self.IPTS_folder,
+                data_type='ob',
+                metadata_index_folder=self.metadata_index_folder,
+                max_workers=self.max_workers,
+                chunk_size=self.chunk_size,
+                progress=self.progress)
 
     def retrieve_dc_metadata(self):
-        self.dc_metadata_dict = RetrieveMatchingOBDC.auto_retrieve_metadata(self.IPTS_folder,
-                                                                            data_type=['df', 'dc'])
+        self.dc_metadata_dict = RetrieveMatchingOBDC.auto_retrieve_metadata(
+                self.IPTS_folder,
+                data_type=['df', 'dc'],
+                metadata_index_folder=self.metadata_index_folder,
+                max_workers=self.max_workers,
+                chunk_size=self.chunk_size,
+                progress=self.progress)
+
+    @staticmethod
+    def auto_retrieve_metadata(working_dir, data_type='ob', metadata_index_folder=None, max_workers=None,
+                               chunk_size=None, progress=None):
+        """retrieve the metadata of all the files of the data_type folder(s)
 
-    def auto_retrieve_metadata(working_dir, data_type='ob'):
+        if metadata_index_folder is provided, the persistent index found there is used, and updated with only
+        the files that are new or have been modified since the last run
+        """
         if type(data_type) is list:
             folder = [os.path.join(working_dir, _data_type) for _data_type in data_type]
         else:
             folder = os.path.join(working_dir, data_type)
         list_of_ob_files = get_list_of_all_files_in_subfolders(folder=folder,
                                                                extensions=['tiff', 'tif'])
-        metadata_dict = MetadataHandler.retrieve_metadata(list_of_files=list_of_ob_files,
-                                                          label=data_type)
+
+        if metadata_index_folder is None:
+            metadata_dict = MetadataHandler.retrieve_metadata(list_of_files=list_of_ob_files,
+                                                              label=data_type,
+                                                              max_workers=max_workers,
+                                                              chunk_size=chunk_size,
+                                                              progress=progress)
+        else:
+            o_index = MetadataIndex(index_file=get_metadata_index_file_name(metadata_index_folder,
+                                                                            data_type=data_type))
+            metadata_dict = o_index.update(list_of_files=list_of_ob_files,
+                                           label=data_type,
+                                           max_workers=max_workers,
+                                           chunk_size=chunk_size,
+                                           progress=progress)
         return metadata_dict
 
     def match_ob(self):
@@ -87,22 +147,10 @@ class RetrieveMatchingOBDC:
         - detector type
         - aperture
         """
-        list_ob_dict = self.ob_metadata_dict
-        final_full_master_dict = self.final_full_master_dict
-        list_of_sample_acquisition = final_full_master_dict.keys()
-
-        for _index_ob in list_ob_dict.keys():
-            _all_ob_instrument_metadata = RetrieveMatchingOBDC.get_instrument_metadata_only(list_ob_dict[_index_ob])
-            _ob_instrument_metadata = RetrieveMatchingOBDC.isolate_instrument_metadata(
-                    _all_ob_instrument_metadata)
-            _acquisition_time = _all_ob_instrument_metadata[MetadataName.EXPOSURE_TIME.value]['value']
-            if _acquisition_time in list_of_sample_acquisition:
-                for _config_id in final_full_master_dict[_acquisition_time].keys():
-                    _sample_metadata_infos = final_full_master_dict[_acquisition_time][_config_id]['metadata_infos']
-                    if RetrieveMatchingOBDC.all_metadata_match(_sample_metadata_infos, _ob_instrument_metadata):
-                        final_full_master_dict[_acquisition_time][_config_id]['list_ob'].append(list_ob_dict[_index_ob])
-
-        self.final_full_master_dict = final_full_master_dict
+        o_index = MatchingIndex(metadata_dict=self.ob_metadata_dict,
+                                list_key_to_check=[_key.value for _key in METADATA_KEYS['ob']],
+                                metadata_error_allowed=METADATA_ERROR_ALLOWED)
+        self._add_matching_files(o_index, data_type='ob')
 
     def match_dc(self):
         """
@@ -111,25 +159,68 @@ class RetrieveMatchingOBDC:
         - detector type used
         - acquisition time
         """
-        list_dc_dict = self.dc_metadata_dict
+        o_index = MatchingIndex(metadata_dict=self.dc_metadata_dict,
+                                list_key_to_check=[_key.value for _key in METADATA_KEYS['dc']],
+                                metadata_error_allowed=METADATA_ERROR_ALLOWED)
+        self._add_matching_files(o_index, data_type='dc')
+
+    def _add_matching_files(self, o_index, data_type='ob'):
+        """add, to each configuration of the master dictionary, the list of files of the index
+        matching its metadata"""
         final_full_master_dict = self.final_full_master_dict
-        list_of_sample_acquisition = final_full_master_dict.keys()
+        for _acquisition_time in final_full_master_dict.keys():
+            for _config_id in final_full_master_dict[_acquisition_time].keys():
+                _config = final_full_master_dict[_acquisition_time][_config_id]
+                _config[f'list_{data_type}'].extend(o_index.get_matching(_config['metadata_infos']))
+
+        self.final_full_master_dict = final_full_master_dict
 
-        for _index_dc in list_dc_dict.keys():
-            _all_dc_instrument_metadata = RetrieveMatchingOBDC.get_instrument_metadata_only(list_dc_dict[_index_dc])
-            _dc_instrument_metadata = RetrieveMatchingOBDC.isolate_instrument_metadata(
-                    _all_dc_instrument_metadata)
-            _acquisition_time = _all_dc_instrument_metadata[MetadataName.EXPOSURE_TIME.value]['value']
+    def select_ob(self):
+        """keep, for each configuration, only the OB acquired close enough to the sample, using
+        maximum_time_offset_mn and/or maximum_number_of_files_to_use, and record the time range
+        covered by all the matching OB (time_range_s) and by the OB selected (time_range_s_selected)
+        """
+        final_full_master_dict = self.final_full_master_dict
+        for _acquisition_time in final_full_master_dict.keys():
+            for _config_id in final_full_master_dict[_acquisition_time].keys():
+                _config = final_full_master_dict[_acquisition_time][_config_id]
+                _first_time_stamp = _config['first_images']['sample']['time_stamp']
+                _last_time_stamp = _config['last_images']['sample']['time_stamp']
+
+                o_time_index = TimeSortedIndex(_config['list_ob'])
+                _config['time_range_s'] = o_time_index.get_time_range(_first_time_stamp, _last_time_stamp)
+
+                _positions = None
+                if self.maximum_time_offset_mn is not None:
+                    _offset_s = self.maximum_time_offset_mn * 60
+                    _positions = o_time_index.select_in_time_window(_first_time_stamp - _offset_s,
+                                                                    _last_time_stamp + _offset_s)
+                if self.maximum_number_of_files_to_use is not None:
+                    _positions = o_time_index.select_nearest(_first_time_stamp,
+                                                             _last_time_stamp,
+                                                             self.maximum_number_of_files_to_use,
+                                                             positions=_positions)
+
+                _config['time_range_s_selected'] = o_time_index.get_time_range(_first_time_stamp,
+                                                                               _last_time_stamp,
+                                                                               positions=_positions)
+                _first_ob, _last_ob = o_time_index.get_first_and_last_entries(positions=_positions)
+                _config['first_images']['ob'] = _first_ob
+                _config['last_images']['ob'] = _last_ob
+                _config['list_ob'] = o_time_index.get_entries(positions=_positions)
 
-            if _acquisition_time in list_of_sample_acquisition:
-                for _config_id in final_full_master_dict[_acquisition_time].keys():
-                    _sample_metadata_infos = final_full_master_dict[_acquisition_time][_config_id]['metadata_infos']
+        self.final_full_master_dict = final_full_master_dict
 
-                    if RetrieveMatchingOBDC.all_metadata_match(_sample_metadata_infos, _dc_instrument_metadata,
-                                                               list_key_to_check=[METADATA_KEYS['dc'][
-                                                                           1].value]):
-                        final_full_master_dict[_acquisition_time][_config_id]['list_dc'].append(list_dc_dict[
-                                                                                                    _index_dc])
+    def select_dc(self):
+        """all the matching DC are kept, only record the first and last DC acquired"""
+        final_full_master_dict = self.final_full_master_dict
+        for _acquisition_time in final_full_master_dict.keys():
+            for _config_id in final_full_master_dict[_acquisition_time].keys():
+                _config = final_full_master_dict[_acquisition_time][_config_id]
+                o_time_index = TimeSortedIndex(_config['list_dc'])
+                _first_dc, _last_dc = o_time_index.get_first_and_last_entries()
+                _config['first_images']['dc'] = _first_dc
+                _config['last_images']['dc'] = _last_dc
 
         self.final_full_master_dict = final_full_master_dict
 
@@ -157,8 +248,8 @@ class RetrieveMatchingOBDC:
 
         for _key in list_key:
             try:
-                if np.abs(np.float(
-                        metadata_1[_key]['value']) - np.float(metadata_2[_key]['value'])) > METADATA_ERROR_ALLOWED:
+                if np.abs(float(
+                        metadata_1[_key]['value']) - float(metadata_2[_key]['value'])) > METADATA_ERROR_ALLOWED:
                     return False
             except ValueError:
                 if metadata_1[_key]['value'] != metadata_2[_key]['value']:
@@ -166,118 +257,110 @@ class RetrieveMatchingOBDC:
         return True
 
     def create_master_sample_dict(self):
+        """group the sample files by acquisition time, then by configuration (detector and apertures)
+
+        final_full_master_dict = {acquisition_time: {'config0': {'list_sample': [...],
+                                                                 'first_images': {'sample': ..., 'ob': {}, 'dc': {}},
+                                                                 'last_images': {'sample': ..., 'ob': {}, 'dc': {}},
+                                                                 'list_ob': [],
+                                                                 'list_dc': [],
+                                                                 'time_range_s_selected': {...},
+                                                                 'time_range_s': {...},
+                                                                 'metadata_infos': {...}},
+                                                     'config1': {...},
+                                                     },
+                                  ...
+                                  }
+
+        The metadata are first loaded in a columnar table where each file is reduced to the code of its
+        unique set of instrument metadata, so the matching between configurations is only done on the
+        (few) unique sets, and the per-file work is done with numpy.
+        """
         final_full_master_dict = collections.OrderedDict()
-        sample_metadata_dict = self.sample_metadata_dict
-
-        # we need to keep record of which image was the first one taken and which image was the last one taken
-        first_sample_image = sample_metadata_dict[0]
-        last_sample_image = sample_metadata_dict[0]
-
-        for _file_index in sample_metadata_dict.keys():
-
-            _dict_file_index = sample_metadata_dict[_file_index]
-            _sample_file = _dict_file_index['filename']
-
-            _acquisition_time = _dict_file_index[MetadataName.EXPOSURE_TIME.value]['value']
-            _instrument_metadata = RetrieveMatchingOBDC.isolate_instrument_metadata(_dict_file_index)
-            _sample_time_stamp = _dict_file_index['time_stamp']
-
-            # find which image was first and which image was last
-            if _sample_time_stamp < first_sample_image['time_stamp']:
-                first_sample_image = _dict_file_index
-            elif _sample_time_stamp > last_sample_image['time_stamp']:
-                last_sample_image = _dict_file_index
-
-            # first entry or first time seeing that acquisition time
-            if (len(final_full_master_dict) == 0) or not (_acquisition_time in final_full_master_dict.keys()):
-                _first_images_dict = {'sample': first_sample_image,
-                                      'ob'    : {},
-                                      'dc'    : {}}
-                _last_images_dict = {'sample': last_sample_image,
-                                     'ob'    : {},
-                                     'dc'    : {}}
-                _temp_dict = {'list_sample'          : [_dict_file_index],
-                              'first_images'         : _first_images_dict,
-                              'last_images'          : _last_images_dict,
-                              'list_ob'              : [],
-                              'list_dc'              : [],
-                              'time_range_s_selected': {'before': np.NaN,
-                                                        'after' : np.NaN},
-                              'time_range_s'         : {'before': np.NaN,
-                                                        'after' : np.NaN},
-                              'metadata_infos'       : RetrieveMatchingOBDC.get_instrument_metadata_only(
-                                      _instrument_metadata)}
+        list_sample = list(self.sample_metadata_dict.values())
+        if len(list_sample) == 0:
+            self.final_full_master_dict = final_full_master_dict
+            return
+
+        # columnar table of the samples
+        time_stamp = np.array([_sample['time_stamp'] for _sample in list_sample], dtype=float)
+        unique_row_code = collections.OrderedDict()
+        row_code = np.empty(len(list_sample), dtype=int)
+        for _position, _sample in enumerate(list_sample):
+            _row = RetrieveMatchingOBDC._get_instrument_metadata_row(_sample)
+            row_code[_position] = unique_row_code.setdefault(_row, len(unique_row_code))
+        position = np.arange(len(list_sample))
+        first_position_of_code = np.array([np.argmax(row_code == _code) for _code in range(len(unique_row_code))])
+
+        # image taken first (and last) among all the files up to a given position
+        running_min = np.minimum.accumulate(time_stamp)
+        running_max = np.maximum.accumulate(time_stamp)
+        is_new_first = np.r_[True, time_stamp[1:] < running_min[:-1]]
+        is_new_last = np.r_[True, time_stamp[1:] > running_max[:-1]]
+        first_image_up_to = np.maximum.accumulate(np.where(is_new_first, position, 0))
+        last_image_up_to = np.maximum.accumulate(np.where(is_new_last, position, 0))
+
+        # a configuration is created by the first file that does not match any configuration already created
+        # for its acquisition time. Files are then added to every configuration they match that exists
+        # at the time they are seen
+        list_config = []
+        for _code in range(len(unique_row_code)):
+            _creator = list_sample[first_position_of_code[_code]]
+            _acquisition_time = _creator[MetadataName.EXPOSURE_TIME.value]['value']
+            _metadata_infos = RetrieveMatchingOBDC.get_instrument_metadata_only(
+                    RetrieveMatchingOBDC.isolate_instrument_metadata(_creator))
+            _list_config_of_acquisition_time = [_config for _config in list_config
+                                                if _config['acquisition_time'] == _acquisition_time]
+            _found_a_match = any(RetrieveMatchingOBDC.all_metadata_match(metadata_1=_config['metadata_infos'],
+                                                                         metadata_2=_creator)
+                                 for _config in _list_config_of_acquisition_time)
+            if not _found_a_match:
+                list_config.append({'acquisition_time': _acquisition_time,
+                                    'name': 'config{}'.format(len(_list_config_of_acquisition_time)),
+                                    'created_at': first_position_of_code[_code],
+                                    'metadata_infos': _metadata_infos})
+
+        for _config in list_config:
+            _acquisition_time = _config['acquisition_time']
+            _code_is_matching = np.array(
+                    [(list_sample[first_position_of_code[_code]][MetadataName.EXPOSURE_TIME.value]['value'] ==
+                      _acquisition_time) and
+                     RetrieveMatchingOBDC.all_metadata_match(metadata_1=_config['metadata_infos'],
+                                                             metadata_2=list_sample[first_position_of_code[_code]])
+                     for _code in range(len(unique_row_code))])
+            _is_member = _code_is_matching[row_code] & (position >= _config['created_at'])
+            _list_position = np.flatnonzero(_is_member)
+            _last_position = _list_position[-1]
+
+            _first_images_dict = {'sample': list_sample[first_image_up_to[_last_position]],
+                                  'ob'    : {},
+                                  'dc'    : {}}
+            _last_images_dict = {'sample': list_sample[last_image_up_to[_last_position]],
+                                 'ob'    : {},
+                                 'dc'    : {}}
+            _temp_dict = {'list_sample'          : [list_sample[_position] for _position in _list_position],
+                          'first_images'         : _first_images_dict,
+                          'last_images'          : _last_images_dict,
+                          'list_ob'              : [],
+                          'list_dc'              : [],
+                          'time_range_s_selected': {'before': np.NaN,
+                                                    'after' : np.NaN},
+                          'time_range_s'         : {'before': np.NaN,
+                                                    'after' : np.NaN},
+                          'metadata_infos'       : _config['metadata_infos']}
+
+            if _acquisition_time not in final_full_master_dict.keys():
                 final_full_master_dict[_acquisition_time] = {}
-                final_full_master_dict[_acquisition_time]['config0'] = _temp_dict
-            else:
-                # check that all the metadata_infos match for the first group of that acquisition time,
-                # otherwise check the next one or create a group
-                if _acquisition_time in final_full_master_dict.keys():
-                    _dict_for_this_acquisition_time = final_full_master_dict[_acquisition_time]
-                    _found_a_match = False
-                    for _config_key in _dict_for_this_acquisition_time.keys():
-                        _config = _dict_for_this_acquisition_time[_config_key]
-                        if (RetrieveMatchingOBDC.all_metadata_match(metadata_1=_config['metadata_infos'],
-                                                                    metadata_2=_instrument_metadata)):
-                            _config['list_sample'].append(_dict_file_index)
-
-                            _first_images_dict = {'sample': first_sample_image,
-                                                  'ob'    : {},
-                                                  'dc'    : {}}
-                            _last_images_dict = {'sample': last_sample_image,
-                                                 'ob'    : {},
-                                                 'dc'    : {}}
-
-                            _config['first_images'] = _first_images_dict
-                            _config['last_images'] = _last_images_dict
-                            _found_a_match = True
-
-                    if not _found_a_match:
-                        _first_images_dict = {'sample': first_sample_image,
-                                              'ob'    : {},
-                                              'dc'    : {}}
-                        _last_images_dict = {'sample': last_sample_image,
-                                             'ob'    : {},
-                                             'dc'    : {}}
-
-                        _temp_dict = {'list_sample'          : [_dict_file_index],
-                                      'first_images'         : _first_images_dict,
-                                      'last_images'          : _last_images_dict,
-                                      'list_ob'              : [],
-                                      'list_dc'              : [],
-                                      'time_range_s_selected': {'before': np.NaN,
-                                                                'after' : np.NaN},
-                                      'time_range_s'         : {'before': np.NaN,
-                                                                'after' : np.NaN},
-                                      'metadata_infos'       : RetrieveMatchingOBDC.get_instrument_metadata_only(
-                                              _instrument_metadata)}
-                        nbr_config = len(_dict_for_this_acquisition_time.keys())
-                        _dict_for_this_acquisition_time['config{}'.format(nbr_config)] = _temp_dict
-
-                else:
-                    _first_images_dict = {'sample': first_sample_image,
-                                          'ob'    : {},
-                                          'dc'    : {}}
-                    _last_images_dict = {'sample': last_sample_image,
-                                         'ob'    : {},
-                                         'dc'    : {}}
-
-                    _temp_dict = {'list_sample'          : [_dict_file_index],
-                                  'first_images'         : _first_images_dict,
-                                  'last_images'          : _last_images_dict,
-                                  'list_ob'              : [],
-                                  'list_dc'              : [],
-                                  'time_range_s_selected': {'before': np.NAN,
-                                                            'after' : np.NaN},
-                                  'time_range_s'         : {'before': np.NaN,
-                                                            'after' : np.NaN},
-                                  'metadata_infos'       : RetrieveMatchingOBDC.get_instrument_metadata_only(
-                                          _instrument_metadata)}
-                    final_full_master_dict[_acquisition_time] = {}
-                    final_full_master_dict[_acquisition_time]['config0'] = _temp_dict
+            final_full_master_dict[_acquisition_time][_config['name']] = _temp_dict
 
         self.final_full_master_dict = final_full_master_dict
 
+    @staticmethod
+    def _get_instrument_metadata_row(metadata_dict):
+        """hashable version of the instrument metadata of a file"""
+        _instrument_metadata = RetrieveMatchingOBDC.get_instrument_metadata_only(metadata_dict)
+        return tuple((_key, _instrument_metadata[_key].get('value')) for _key in sorted(_instrument_metadata.keys()))
+
     def get_matching_data_file(self, data_type='ob'):
 
         key = f"list_{data_type}"
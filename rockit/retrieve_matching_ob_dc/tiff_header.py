@@ -0,0 +1,150 @@
+import struct
+from PIL import Image
+
+# number of bytes read at once around the first IFD. The CG1D tags (65000-65070) are short ascii strings
+# that are usually written right after the IFD, so one read is most of the time enough
+IFD_READ_SIZE = 4096
+
+# TIFF field type -> (struct format, size in bytes)
+FIELD_TYPES = {1: ('B', 1),    # BYTE
+               2: ('s', 1),    # ASCII
+               3: ('H', 2),    # SHORT
+               4: ('L', 4),    # LONG
+               5: ('LL', 8),   # RATIONAL
+               6: ('b', 1),    # SBYTE
+               7: ('s', 1),    # UNDEFINED
+               8: ('h', 2),    # SSHORT
+               9: ('l', 4),    # SLONG
+               10: ('ll', 8),  # SRATIONAL
+               11: ('f', 4),   # FLOAT
+               12: ('d', 8),   # DOUBLE
+               13: ('L', 4),   # IFD
+               16: ('Q', 8),   # LONG8 (BigTIFF)
+               17: ('q', 8),   # SLONG8 (BigTIFF)
+               18: ('Q', 8),   # IFD8 (BigTIFF)
+               }
+
+
+class TiffHeaderError(Exception):
+    pass
+
+
+class _BufferedFile:
+    """keeps the last block read in memory so the IFD entries and their values
+    do not trigger one read each"""
+
+    def __init__(self, file_object):
+        self.file_object = file_object
+        self.buffer_offset = 0
+        self.buffer = b""
+
+    def read(self, offset, size):
+        if (offset >= self.buffer_offset) and (offset + size <= self.buffer_offset + len(self.buffer)):
+            start = offset - self.buffer_offset
+            return self.buffer[start: start + size]
+
+        self.file_object.seek(offset)
+        self.buffer = self.file_object.read(max(size, IFD_READ_SIZE))
+        self.buffer_offset = offset
+        if len(self.buffer) < size:
+            raise TiffHeaderError(f"unexpected end of file at offset {offset}")
+        return self.buffer[:size]
+
+
+def _unpack_value(byte_order, field_type, count, data):
+    _format, _ = FIELD_TYPES[field_type]
+
+    if field_type == 2:
+        # same as PIL, drop the trailing null byte
+        if data.endswith(b"\0"):
+            data = data[:-1]
+        return data.decode("latin-1", "replace")
+
+    if field_type == 7:
+        return data
+
+    if field_type in (5, 10):
+        values = struct.unpack(byte_order + _format * count, data)
+        values = tuple(_num / _den if _den else float('nan') for _num, _den in zip(values[::2], values[1::2]))
+    else:
+        values = struct.unpack(byte_order + _format * count, data)
+
+    if count == 1:
+        return values[0]
+    return values
+
+
+def read_tiff_tags(file_name, list_tags=None):
+    """return a dictionary {tag: value} of the first IFD of the TIFF file
+
+    Only the file header, the first IFD and the values of the requested tags are read, the image itself
+    is never loaded. The values follow the same convention as PIL tag_v2 for the CG1D custom tags
+    (str for ascii, scalar for a single value, tuple otherwise).
+
+    list_tags: list of tags (int) to retrieve. If None, all the tags are returned
+    """
+    list_tags = None if list_tags is None else set(list_tags)
+
+    with open(file_name, 'rb') as f:
+        o_file = _BufferedFile(f)
+        header = o_file.read(0, 16)
+
+        if header[:2] == b"II":
+            byte_order = "<"
+        elif header[:2] == b"MM":
+            byte_order = ">"
+        else:
+            raise TiffHeaderError(f"{file_name} is not a TIFF file")
+
+        magic_number = struct.unpack(byte_order + "H", header[2:4])[0]
+        if magic_number == 42:
+            ifd_offset = struct.unpack(byte_order + "L", header[4:8])[0]
+            count_format, count_size, entry_size, pointer_format, pointer_size = "H", 2, 12, "L", 4
+        elif magic_number == 43:
+            ifd_offset = struct.unpack(byte_order + "Q", header[8:16])[0]
+            count_format, count_size, entry_size, pointer_format, pointer_size = "Q", 8, 20, "Q", 8
+        else:
+            raise TiffHeaderError(f"{file_name} is not a TIFF file")
+
+        number_of_entries = struct.unpack(byte_order + count_format, o_file.read(ifd_offset, count_size))[0]
+        entries = o_file.read(ifd_offset + count_size, number_of_entries * entry_size)
+
+        tags = {}
+        for _index in range(number_of_entries):
+            _entry = entries[_index * entry_size: (_index + 1) * entry_size]
+            _tag, _field_type = struct.unpack(byte_order + "HH", _entry[:4])
+            if (list_tags is not None) and (_tag not in list_tags):
+                continue
+            if _field_type not in FIELD_TYPES:
+                continue
+
+            _count = struct.unpack(byte_order + pointer_format, _entry[4: 4 + pointer_size])[0]
+            _data_size = FIELD_TYPES[_field_type][1] * _count
+            _value_field = _entry[4 + pointer_size:]
+            if _data_size <= pointer_size:
+                _data = _value_field[:_data_size]
+            else:
+                _value_offset = struct.unpack(byte_order + pointer_format, _value_field)[0]
+                _data = o_file.read(_value_offset, _data_size)
+
+            tags[_tag] = _unpack_value(byte_order, _field_type, _count, _data)
+
+    return tags
+
+
+def read_tiff_tags_with_pil(file_name, list_tags=None):
+    """slower fallback that loads the image with PIL"""
+    with Image.open(file_name) as image:
+        metadata = image.tag_v2
+        if list_tags is None:
+            return dict(metadata)
+        return {_tag: metadata.get(_tag) for _tag in list_tags if _tag in metadata}
+
+
+def get_tiff_tags(file_name, list_tags=None):
+    """read the tags of the first IFD in a single open of the file, using PIL if the header
+    can not be parsed directly"""
+    try:
+        return read_tiff_tags(file_name, list_tags=list_tags)
+    except (TiffHeaderError, struct.error, UnicodeDecodeError):
+        return read_tiff_tags_with_pil(file_name, list_tags=list_tags)
@@ -4,27 +4,27 @@ import logging
 import os
 import glob
 import shutil
+import tempfile
 from datetime import datetime
 import pathlib
 
-import dxchange
-from tomopy import find_center_pc, circ_mask, normalize, minus_log
-import tomopy.recon as reconstruction
-from tomopy.prep.alignment import find_slits_corners_aps_1id, remove_slits_aps_1id
-from tomopy.misc.corr import remove_outlier
-from tomopy.prep.normalize import normalize_bg
-from tomopy.prep.stripe import remove_all_stripe
-
 import numpy as np
-import bm3d_streak_removal as bm3d_rmv
-from imars3d.backend.diagnostics import tilt
-from utilites import get_ind_list, find_proj180_ind, read_tiff_stack, read_tiff_from_full_name_list, set_roi
+# the scientific stacks (dxchange, tomopy, bm3d_streak_removal, imars3d) are imported with lazy_import
+# by the stage that needs them, so runs that exit early (empty folder, no OB/DC) start quickly
+from utilites import get_ind_list, find_proj180_ind, read_tiff_stack, lazy_import, \
+    get_import_time_report
 
 import warnings
 
 warnings.filterwarnings('ignore')
 
-from samffr.retrieve_matching_ob_dc import RetrieveMatchingOBDC
+from retrieve_matching_ob_dc.retrieve_matching_ob_dc import RetrieveMatchingOBDC, MetadataName
+from streaming import run_streaming_reconstruction
+from progressive import ProgressiveReconstruction, DEFAULT_ACQUISITION_TIME_COEFFICIENT
+from instrumentation import StageRecorder
+from gridrec_engine import ChunkedGridrec, parse_core_list, pin_to_cores
+from reference_images import compute_reference_image, get_ob_crop_box, get_default_reference_cache_folder, \
+    REFERENCE_METHODS
 
 DEBUG = False
 SUCCESSFUL_MESSAGE = "RECONSTRUCTION WAS SUCCESSFUL!"
@@ -37,6 +37,21 @@ else:
 
 LOG_EXTENSION = "_autoreduce.log"
 METADATA_JSON = "_sample_ob_dc_metadata.json"
+STAGES_JSON = "_autoreduce_stages.json"
+STAGES_CSV = "_autoreduce_stages.csv"
+# default scratch folder of the progressive mode (not the output folder, emptied by each attempt, so a new
+# attempt can go on from the projections preprocessed by the previous one)
+PROGRESSIVE_SCRATCH_FOLDER = "shared/autoreduce/progressive_scratch"
+
+
+def prepare_output_folder(ipts_number, input_folder):
+    """(empty) folder the reconstructed slices of the input folder are exported to"""
+    base_input_folder_name = os.path.basename(input_folder)
+    output_folder = f"{TOP_FOLDER}/IPTS-{ipts_number}/shared/autoreduce/{base_input_folder_name}/"
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+    return output_folder
 
 
 def main(args):
@@ -65,6 +80,22 @@ def main(args):
     if automatic_edge_cropping is None:
         automatic_edge_cropping = True
 
+    scratch_folder = args.scratch_folder if args.scratch_folder else None
+    loading_workers = args.loading_workers if args.loading_workers else None
+    streaming = args.streaming
+    slab_size = args.slab_size if args.slab_size else None
+    progressive = args.progressive
+    acquisition_time_coefficient = args.acquisition_time_coefficient if args.acquisition_time_coefficient else \
+        DEFAULT_ACQUISITION_TIME_COEFFICIENT
+    scan_angular_range = args.scan_angular_range if args.scan_angular_range else None
+    low_memory = args.low_memory
+    cores = parse_core_list(args.cores) if args.cores else None
+    recon_workers = args.recon_workers if args.recon_workers else None
+    recon_ncore = args.recon_ncore if args.recon_ncore else None
+    ob_dc_reduction = args.ob_dc_reduction if args.ob_dc_reduction else 'mean'
+    reference_cache_folder = None if args.no_reference_cache else get_default_reference_cache_folder(ipts_folder)
+    reference_cache_size_mb = args.reference_cache_size_mb if args.reference_cache_size_mb else None
+
     maximum_number_of_obs_to_use = args.maximum_number_of_obs if args.maximum_number_of_obs else None
     maximum_time_difference_between_sample_and_ob_acquisition = \
         args.maximum_time_difference_between_sample_and_ob_acquisition if \
@@ -88,6 +119,28 @@ def main(args):
                 f"{maximum_time_difference_between_sample_and_ob_acquisition}")
     logger.info(f"ring_removal: {ring_removal}")
     logger.info(f"automatic_edge_cropping: {automatic_edge_cropping}")
+    logger.info(f"scratch_folder: {scratch_folder}")
+    logger.info(f"loading_workers: {loading_workers}")
+    logger.info(f"streaming: {streaming}")
+    logger.info(f"slab_size: {slab_size}")
+    logger.info(f"progressive: {progressive}")
+    logger.info(f"low_memory: {low_memory}")
+    logger.info(f"cores: {cores}")
+    logger.info(f"recon_workers: {recon_workers}")
+    logger.info(f"recon_ncore: {recon_ncore}")
+    logger.info(f"ob_dc_reduction: {ob_dc_reduction}")
+    logger.info(f"reference_cache_folder: {reference_cache_folder}")
+
+    # wall time, cpu time and memory of each stage, saved next to the log file
+    log_file_base_name = os.path.join(reduction_log_folder, str(pathlib.Path(input_folder).name))
+    recorder = StageRecorder(json_file_name=log_file_base_name + STAGES_JSON,
+                             csv_file_name=log_file_base_name + STAGES_CSV,
+                             metadata={'ipts': ipts_number,
+                                       'input_folder': input_folder,
+                                       'streaming': streaming,
+                                       'progressive': progressive,
+                                       'low_memory': low_memory,
+                                       'ob_dc_reduction': ob_dc_reduction})
 
     # checking that input folder exists
     if not os.path.exists(input_folder):
@@ -106,22 +159,22 @@ def main(args):
         logger.info(f"Input folder is empty. Leaving rockit now!")
         exit(0)
 
-    matching_files_start = datetime.now()
-    logger.info(f"Looking for matching OB and DC!")
-    logger.info(f"- raw_folder: {raw_folder}")
-    o_main = RetrieveMatchingOBDC(list_sample_data=list_sample_data,
-                                  IPTS_folder=raw_folder,
-                                  maximum_number_of_files_to_use=maximum_number_of_obs_to_use,
-                                  maximum_time_offset_mn=maximum_time_difference_between_sample_and_ob_acquisition)
-    o_main.run()
+    if cores:
+        pin_to_cores(cores)
+
+    with recorder.stage("Looking for matching OB and DC"):
+        logger.info(f"- raw_folder: {raw_folder}")
+        o_main = RetrieveMatchingOBDC(list_sample_data=list_sample_data,
+                                      IPTS_folder=raw_folder,
+                                      maximum_number_of_files_to_use=maximum_number_of_obs_to_use,
+                                      maximum_time_offset_mn=maximum_time_difference_between_sample_and_ob_acquisition)
+        o_main.run()
 
-    list_ob = o_main.get_matching_ob()
-    list_dc = o_main.get_matching_dc()
+        list_ob = o_main.get_matching_ob()
+        list_dc = o_main.get_matching_dc()
 
-    logger.info(f"- found {len(list_ob)} matching OB!")
-    logger.info(f"- found {len(list_dc)} matching DC!")
-    matching_files_end = datetime.now()
-    logger.info(f"Looking for matching OB and DC took {matching_files_end - matching_files_start}")
+        logger.info(f"- found {len(list_ob)} matching OB!")
+        logger.info(f"- found {len(list_dc)} matching DC!")
 
     # if no ob or dc found, stop here
     if (len(list_ob) == 0) or (len(list_dc) == 0):
@@ -149,162 +202,210 @@ def main(args):
 
     # build script to run yuxuan's code
 
-    # projections
-    loading_projections_start = datetime.now()
-    print("loading projections")
-    ct_name, ang_deg, theta, ind_list = get_ind_list(os.listdir(input_folder))
-    proj180_ind = find_proj180_ind(ang_deg)[0]
-    logger.info(f"- Found index of 180 degree projections: {proj180_ind}")
-    logger.info(f"Loading projections ....")
-    proj = read_tiff_stack(fdir=input_folder, fname=ct_name)
-    loading_projections_end = datetime.now()
-    logger.info(f"Loading CT projections .... Done in {loading_projections_end - loading_projections_start}")
-
-    # ob
-    loading_ob_start = datetime.now()
-    print("loading ob")
-    logger.info(f"Loading OB ({len(list_ob)} files) ....")
-    ob = read_tiff_from_full_name_list(list_ob)
-    loading_ob_end = datetime.now()
-    logger.info(f"Loading OB .... Done in {loading_ob_end - loading_ob_start}!")
-
-    # dc
-    loading_dc_start = datetime.now()
-    print("loading dc")
-    logger.info(f"Loading DC ({len(list_dc)} files) ...")
-    dc = read_tiff_from_full_name_list(list_dc)
-    loading_dc_end = datetime.now()
-    logger.info(f"Loading DC ... Done in {loading_dc_end - loading_dc_start}!")
-
-    # detect and crop the slits
+    # detect the slits on the first OB image (or read them from the reference cache), so only the cropped area
+    # of each file has to be loaded
     if automatic_edge_cropping:
-        detect_start = datetime.now()
-        print("detecting and cropping the slits")
-        logger.info(f"Detecting and cropping the slits ....")
-        slit_box_corners = find_slits_corners_aps_1id(img=ob[0], method='simple')
-        logger.info(f"-> slit_box_corners: {slit_box_corners}")
-        proj = remove_slits_aps_1id(proj, slit_box_corners)
-        ob = remove_slits_aps_1id(ob, slit_box_corners)
-        dc = remove_slits_aps_1id(dc, slit_box_corners)
-        detect_end = datetime.now()
-        logger.info(f"Detecting and cropping the slits .... Done in {detect_end - detect_start}!")
+        print("detecting the slits")
     else:
         print("detecting and cropping - SKIPPED")
         logger.info(f"Detecting and cropping the slits is OFF")
+    with recorder.stage("Detecting the slits"):
+        crop_box = get_ob_crop_box(list_ob[0],
+                                   automatic_edge_cropping=automatic_edge_cropping,
+                                   cache_folder=reference_cache_folder,
+                                   cache_size_mb=reference_cache_size_mb)
 
-    # Define the ROI
-    roi_start = datetime.now()
+    # Define the ROI (relative to the area left by the slits)
     print("Cropping sample")
     logger.info(f"cropping data ...")
     if roi == [None, None, None, None]:
         logger.info(f"-> nothing to crop!")
-        proj_crop = proj
-        ob_crop = ob
-        dc_crop = dc
     else:
-        [height, width] = np.shape(proj[0])
+        [height, width] = [crop_box[1] - crop_box[0], crop_box[3] - crop_box[2]]
         xmin = roi[0] if roi[0] else 0
         ymin = roi[1] if roi[1] else 0
         xmax = roi[2] if roi[2] else width - 1
         ymax = roi[3] if roi[3] else height - 1
         logger.info(f"-> cropping using xmin:{xmin}, ymin:{ymin}, xmax:{xmax}, ymax:{ymax}")
-        roi_corners = set_roi(corners=slit_box_corners, xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
-        logger.info(f"- corners detected are {roi_corners}")
-        proj_crop = remove_slits_aps_1id(proj, roi_corners)
-        ob_crop = remove_slits_aps_1id(ob, roi_corners)
-        dc_crop = remove_slits_aps_1id(dc, roi_corners)
-    roi_end = datetime.now()
-    logger.info(f"cropping data ... Done in {roi_end - roi_start}!")
+        crop_box = [crop_box[0] + ymin, min(crop_box[0] + ymax, crop_box[1]),
+                    crop_box[2] + xmin, min(crop_box[2] + xmax, crop_box[3])]
+    logger.info(f"-> area loaded [ymin, ymax, xmin, xmax]: {crop_box}")
+
+    # ob
+    print("loading ob")
+    with recorder.stage("Loading OB") as _stage:
+        logger.info(f"- {len(list_ob)} files")
+        logger.info(f"- reduced to a single {ob_dc_reduction} image")
+        ob_crop = compute_reference_image(list_ob, method=ob_dc_reduction, crop_box=crop_box,
+                                          max_workers=loading_workers,
+                                          cache_folder=reference_cache_folder,
+                                          cache_size_mb=reference_cache_size_mb)[np.newaxis]
+        _stage.add_array("ob", ob_crop)
+
+    # dc
+    print("loading dc")
+    with recorder.stage("Loading DC") as _stage:
+        logger.info(f"- {len(list_dc)} files")
+        logger.info(f"- reduced to a single {ob_dc_reduction} image")
+        dc_crop = compute_reference_image(list_dc, method=ob_dc_reduction, crop_box=crop_box,
+                                          max_workers=loading_workers,
+                                          cache_folder=reference_cache_folder,
+                                          cache_size_mb=reference_cache_size_mb)[np.newaxis]
+        _stage.add_array("dc", dc_crop)
+
+    engine = ChunkedGridrec(chunk_size=slab_size, number_of_workers=recon_workers, ncore=recon_ncore)
+
+    if progressive:
+        output_folder = prepare_output_folder(ipts_number, input_folder)
+        sample_metadata = list(o_main.sample_metadata_dict.values())[0]
+        exposure_time = float(sample_metadata[MetadataName.EXPOSURE_TIME.value]['value'])
+        logger.info(f"progressive reconstruction, exporting the slices to {output_folder}")
+        logger.info(f"- the scan is complete once its last angle is written (or when no new projection arrived "
+                    f"for {acquisition_time_coefficient} x {exposure_time}s)")
+        progressive_scratch_folder = scratch_folder if scratch_folder else \
+            os.path.join(ipts_folder, PROGRESSIVE_SCRATCH_FOLDER)
+        o_progressive = ProgressiveReconstruction(input_folder=input_folder,
+                                                  ob=ob_crop,
+                                                  dc=dc_crop,
+                                                  scratch_folder=progressive_scratch_folder,
+                                                  crop_box=crop_box,
+                                                  max_workers=loading_workers,
+                                                  recorder=recorder,
+                                                  angular_range=scan_angular_range)
+        o_progressive.run(output_folder,
+                          exposure_time=exposure_time,
+                          acquisition_time_coefficient=acquisition_time_coefficient,
+                          ring_removal=ring_removal,
+                          slab_size=slab_size,
+                          engine=engine)
+
+        full_process_end_time = datetime.now()
+        full_process_delta_time = full_process_end_time - full_process_start_time
+        logger.info(f"Full CT reconstruction took {full_process_delta_time}")
+        logger.info(f"{SUCCESSFUL_MESSAGE}")
+        return
+
+    # projections
+    print("loading projections")
+    ct_name, ang_deg, theta, ind_list = get_ind_list(os.listdir(input_folder))
+    proj180_ind = find_proj180_ind(ang_deg)[0]
+    logger.info(f"- Found index of 180 degree projections: {proj180_ind}")
+
+    if streaming:
+        output_folder = prepare_output_folder(ipts_number, input_folder)
+        logger.info(f"streaming reconstruction, exporting the slices to {output_folder}")
+        # the stack of the projections is memory mapped on a node local disk, not on the network file system of
+        # the output folder
+        run_streaming_reconstruction(list_files=[os.path.join(input_folder, _name) for _name in ct_name],
+                                     theta=theta,
+                                     proj180_ind=proj180_ind,
+                                     ob=ob_crop,
+                                     dc=dc_crop,
+                                     output_folder=output_folder,
+                                     scratch_folder=scratch_folder if scratch_folder else tempfile.gettempdir(),
+                                     crop_box=crop_box,
+                                     ring_removal=ring_removal,
+                                     slab_size=slab_size,
+                                     max_workers=loading_workers,
+                                     recorder=recorder,
+                                     engine=engine)
+
+        full_process_end_time = datetime.now()
+        full_process_delta_time = full_process_end_time - full_process_start_time
+        logger.info(f"Full CT reconstruction took {full_process_delta_time}")
+        logger.info(f"{SUCCESSFUL_MESSAGE}")
+        return
+
+    with recorder.stage("Loading CT projections") as _stage:
+        proj_crop = read_tiff_stack(fdir=input_folder, fname=ct_name, scratch_folder=scratch_folder,
+                                    max_workers=loading_workers, crop_box=crop_box)
+        _stage.add_array("proj", proj_crop)
 
     # Remove outliers
-    outliers_start = datetime.now()
     print("remove outliers")
-    logger.info(f"removing outliers ...")
-    logger.info(f"- parameter used: 50")
-    proj_crop = remove_outlier(proj_crop, 50)
-    outliers_end = datetime.now()
-    logger.info(f"removing outliers ... Done in {outliers_end - outliers_start}!")
+    with recorder.stage("removing outliers") as _stage:
+        remove_outlier = lazy_import("tomopy.misc.corr").remove_outlier
+        logger.info(f"- parameter used: 50")
+        proj_crop = remove_outlier(proj_crop, 50)
+        _stage.add_array("proj", proj_crop)
 
     # Normalization
-    normalization_start = datetime.now()
     print("normalization")
-    logger.info(f"Normalization ...")
-    proj_norm = normalize(proj_crop, ob_crop, dc_crop)
-    normalization_end = datetime.now()
-    logger.info(f"Normalization ... Done in {normalization_end - normalization_start}!")
+    with recorder.stage("Normalization") as _stage:
+        tomopy = lazy_import("tomopy")
+        if low_memory:
+            # remove_outlier returned a float32 array, the normalized data can overwrite it
+            proj_norm = tomopy.normalize(proj_crop, ob_crop, dc_crop, out=proj_crop)
+            del proj_crop, ob_crop, dc_crop
+        else:
+            proj_norm = tomopy.normalize(proj_crop, ob_crop, dc_crop)
+        _stage.add_array("proj_norm", proj_norm)
 
     # beam fluctuation correction
-    beam_start = datetime.now()
     print(f"beam fluctuation")
-    logger.info(f"Beam fluctuation ....")
-    logger.info(f"- air: 50")
-    proj_norm = normalize_bg(proj_norm, air=50)
-    beam_end = datetime.now()
-    logger.info(f"Beam fluctuation .... Done in {beam_end - beam_start}!")
+    with recorder.stage("Beam fluctuation") as _stage:
+        normalize_bg = lazy_import("tomopy.prep.normalize").normalize_bg
+        logger.info(f"- air: 50")
+        proj_norm = normalize_bg(proj_norm, air=50)
+        _stage.add_array("proj_norm", proj_norm)
 
     # minus log conversion
-    minus_start = datetime.now()
     print("minus log conversion")
-    logger.info(f"minus log conversion ...")
-    proj_mlog = minus_log(proj_norm)
-    minus_end = datetime.now()
-    logger.info(f"minus log conversion ... Done in {minus_end - minus_start}!")
+    with recorder.stage("minus log conversion") as _stage:
+        if low_memory:
+            proj_mlog = tomopy.minus_log(proj_norm, out=proj_norm)
+            del proj_norm
+        else:
+            proj_mlog = tomopy.minus_log(proj_norm)
+        _stage.add_array("proj_mlog", proj_mlog)
 
     # ring artifact removal
-    ring_start = datetime.now()
     if ring_removal:
         print("ring artifact removal")
-        logger.info(f"ring artifact removal using bm3d!")
-        proj_bm3d_norm = bm3d_rmv.extreme_streak_attenuation(proj_mlog)
-        proj_rmv = bm3d_rmv.multiscale_streak_removal(proj_bm3d_norm)
-        # proj_rmv = remove_all_stripe(proj_mlog)
-        ring_end = datetime.now()
-        logger.info(f"ring artifact removal ... Done in {ring_end - ring_start}!")
+        with recorder.stage("ring artifact removal using bm3d") as _stage:
+            bm3d_rmv = lazy_import("bm3d_streak_removal")
+            proj_bm3d_norm = bm3d_rmv.extreme_streak_attenuation(proj_mlog)
+            if low_memory:
+                del proj_mlog
+            proj_rmv = bm3d_rmv.multiscale_streak_removal(proj_bm3d_norm)
+            if low_memory:
+                del proj_bm3d_norm
+            # proj_rmv = remove_all_stripe(proj_mlog)
+            _stage.add_array("proj_rmv", proj_rmv)
     else:
         proj_rmv = proj_mlog
+        if low_memory:
+            del proj_mlog
         print("ring artifact removal - SKIPPED")
         logger.info(f"ring artifact removal skipped by user!")
 
     # find and correct tilt
-    tilt_start = datetime.now()
     print(f"find and correct tilt")
-    logger.info(f"find and correct tilt")
-    tilt_ang = tilt.calculate_tilt(image0=proj_rmv[0], image180=proj_rmv[proj180_ind])
-    logger.info(f"- tilt angle: {tilt_ang.x}")
-    proj_tilt = tilt.apply_tilt_correction(proj_rmv, tilt_ang.x)
-    tilt_end = datetime.now()
-    logger.info(f"find and correct tilt ... Done in {tilt_end - tilt_start}!")
+    with recorder.stage("find and correct tilt") as _stage:
+        tilt = lazy_import("imars3d.backend.diagnostics.tilt")
+        tilt_ang = tilt.calculate_tilt(image0=proj_rmv[0], image180=proj_rmv[proj180_ind])
+        logger.info(f"- tilt angle: {tilt_ang.x}")
+        proj_tilt = tilt.apply_tilt_correction(proj_rmv, tilt_ang.x)
+        if low_memory:
+            del proj_rmv
+        _stage.add_array("proj_tilt", proj_tilt)
 
     # find center of rotation
-    center_start = datetime.now()
     print(f"center of rotation")
-    logger.info(f"center of rotation")
-    rot_center = find_center_pc(np.squeeze(proj_tilt[0, :, :]),
-                                np.squeeze(proj_tilt[proj180_ind, :, :]), tol=0.5)
-    center_end = datetime.now()
-    logger.info(f"center of rotation ... Done in {center_end - center_start}!")
-
-    # reconstruction
-    reconstruction_start = datetime.now()
+    with recorder.stage("center of rotation"):
+        rot_center = tomopy.find_center_pc(np.squeeze(proj_tilt[0, :, :]),
+                                           np.squeeze(proj_tilt[proj180_ind, :, :]), tol=0.5)
+        logger.info(f"- center of rotation: {rot_center}")
+
+    # reconstruction, the slices being exported as soon as their chunk is reconstructed
     print(f"reconstruction")
-    logger.info(f"reconstruction")
-    recon = reconstruction(proj_tilt, theta, center=rot_center, algorithm='gridrec', sinogram_order=False)
-    recon = circ_mask(recon, axis=0, ratio=0.95)
-    reconstruction_end = datetime.now()
-    logger.info(f"reconstruction ... done in {reconstruction_end - reconstruction_start}!")
-
-    # exporting the reconstructed slices
-    export_start = datetime.now()
-    print(f"exporting the reconstructed slices")
-    base_input_folder_name = os.path.basename(input_folder)
-    output_folder = f"{TOP_FOLDER}/IPTS-{ipts_number}/shared/autoreduce/{base_input_folder_name}/"
-    if os.path.exists(output_folder):
-        shutil.rmtree(output_folder)
-    os.makedirs(output_folder)
-    logger.info(f"exporting the slices to {output_folder}")
-    dxchange.write_tiff_stack(recon, fname=output_folder + 'reconstruction', overwrite=True)
-    export_end = datetime.now()
-    logger.info(f"exporting the slices ... Done in {export_end - export_start}!")
+    with recorder.stage("reconstruction") as _stage:
+        output_folder = prepare_output_folder(ipts_number, input_folder)
+        logger.info(f"- output folder: {output_folder}")
+        engine.reconstruct(proj_tilt, theta, rot_center, output_folder, stage=_stage)
+        _stage.add_array("proj_tilt", proj_tilt)
+        if low_memory:
+            del proj_tilt
 
     full_process_end_time = datetime.now()
     full_process_delta_time = full_process_end_time - full_process_start_time
@@ -313,7 +414,7 @@ def main(args):
     logger.info(f"{SUCCESSFUL_MESSAGE}")
 
 
-if __name__ == "__main__":
+def get_argument_parser():
     parser = argparse.ArgumentParser(description="""
 	Reconstruct a set of projections from a given folder,
 
@@ -356,7 +457,77 @@ if __name__ == "__main__":
     parser.add_argument('-ring_removal_algorithm',
                         type=str,
                         help="Name of the ring removal algorithm [Vos, bm3d] (default being Vos)")
+    parser.add_argument('-scratch_folder',
+                        type=str,
+                        help="Folder (fast local disk) used to memory map the projections, ob and dc stacks "
+                             "instead of loading them in memory (--streaming: default being the temporary folder "
+                             "of the node, $TMPDIR or /tmp)")
+    parser.add_argument('-loading_workers',
+                        type=int,
+                        help="Number of threads reading the projections, ob and dc files (1 to read them one "
+                             "at a time)")
+    parser.add_argument('--streaming',
+                        action="store_true",
+                        help="Preprocess the projections by chunks into a scratch file, then reconstruct "
+                             "the slices by slabs, so the memory used does not depend on the size of the scan")
+    parser.add_argument('-slab_size',
+                        type=int,
+                        help="Number of slices reconstructed at once, by each reconstruction worker (default 64)")
+    parser.add_argument('--progressive',
+                        action="store_true",
+                        help="Start while the scan is acquired: preprocess each projection as soon as it is in "
+                             "the input folder, and reconstruct once the scan is complete")
+    parser.add_argument('-acquisition_time_coefficient',
+                        type=float,
+                        help="Progressive mode: when the angles of the projections can not tell the end of "
+                             "the scan, it is complete when no new projection arrived for that many exposure "
+                             "times (default 5)")
+    parser.add_argument('-scan_angular_range',
+                        type=float,
+                        help="Progressive mode: angular range of the scan (default: found from the angles of "
+                             "the projections, 180 or 360 degrees)")
+    parser.add_argument('-cores',
+                        type=str,
+                        help="Cores the reconstruction runs on, ex: 0-7,16-23 (default: all the cores available), "
+                             "to share a node between several reconstructions")
+    parser.add_argument('-recon_workers',
+                        type=int,
+                        help="Number of slabs of slices reconstructed at the same time (default 1)")
+    parser.add_argument('-recon_ncore',
+                        type=int,
+                        help="Number of threads of each reconstruction worker (default: the cores divided by "
+                             "the number of workers)")
+    parser.add_argument('--low_memory',
+                        action="store_true",
+                        help="Run the preprocessing steps in place and release each intermediate stack "
+                             "as soon as the next step used it")
+    parser.add_argument('-ob_dc_reduction',
+                        type=str,
+                        choices=REFERENCE_METHODS,
+                        help="How the OB and DC files are reduced to a single reference image (default mean)")
+    parser.add_argument('--no_reference_cache',
+                        action="store_true",
+                        help="Do not use (nor fill) the cache of OB and DC reference images of the IPTS "
+                             "(shared/autoreduce/reference_cache)")
+    parser.add_argument('-reference_cache_size_mb',
+                        type=int,
+                        help="Maximum size of the cache of OB and DC reference images (default 2048)")
+    parser.add_argument('--import_time_report',
+                        action="store_true",
+                        help="Log how long the import of each scientific module took")
 
+    return parser
+
+
+if __name__ == "__main__":
+    parser = get_argument_parser()
     args = parser.parse_args()
 
-    main(args)
+    try:
+        main(args)
+    finally:
+        if args.import_time_report:
+            logger = logging.getLogger("rockit")
+            logger.info(f"import time report:")
+            for _line in get_import_time_report():
+                logger.info(f"- {_line}")
@@ -7,13 +7,13 @@ from datetime import datetime
 import subprocess
 from pathlib import Path
 
-from utilites import load_json, save_json, replace_value_of_tags, create_json_config_file_name
+from utilites import load_json, save_json, replace_value_of_tags, create_json_config_file_name, lazy_import
 
 import warnings
 
 warnings.filterwarnings('ignore')
 
-from samffr.retrieve_matching_ob_dc import RetrieveMatchingOBDC
+from retrieve_matching_ob_dc.retrieve_matching_ob_dc import RetrieveMatchingOBDC
 
 DEBUG = False
 SUCCESSFUL_MESSAGE = "RECONSTRUCTION LAUNCHED!"
@@ -35,6 +35,30 @@ else:
 
 
 def main(args):
+    json_config_file_name, log_file_name = prepare_imars3d_config(args)
+    if json_config_file_name is None:
+        return
+
+    cmd = f"source /opt/anaconda/etc/profile.d/conda.sh; conda activate imars3d; python -m imars3d.backend {json_config_file_name}"
+    logger = logging.getLogger("rockit")
+    logger.info(f"About to run {cmd =} using os.system")
+    cmd += f"; echo 'Done!' >> {log_file_name}"
+    #proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, universal_newlines=True)
+    #proc.communicate()
+    os.system(cmd)
+    logger.info(f"{SUCCESSFUL_MESSAGE}")
+
+
+def run_imars3d_workflow(json_config_file_name):
+    """run the imars3d workflow of the json config file in this process (what python -m imars3d.backend does)"""
+    engine = lazy_import("imars3d.backend.workflow.engine")
+    config = load_json(json_config_file_name)
+    return engine.WorkflowEngineAuto(config).run()
+
+
+def prepare_imars3d_config(args):
+    """find the matching OB and DC, and create the imars3d json config file of the reconstruction.
+    Returns (json config file name, log file name), (None, None) if the reconstruction can not be done"""
 
     # parsing arguments
     ipts_number = args.ipts_number
@@ -137,7 +161,7 @@ def main(args):
         with open(sample_ob_dc_metadata_json, 'w') as outfile:
             json.dump(metadata_dict, outfile)
 
-        return
+        return None, None
 
     # now we need to create the imars3d json config file
     ipts = f"IPTS-{ipts_number}"
@@ -173,16 +197,10 @@ def main(args):
                                                          name=name)
     save_json(json_config_file_name, json_template_loaded)
 
-    cmd = f"source /opt/anaconda/etc/profile.d/conda.sh; conda activate imars3d; python -m imars3d.backend {json_config_file_name}"
-    logger.info(f"About to run {cmd =} using os.system")
-    cmd += f"; echo 'Done!' >> {log_file_name}"
-    #proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, universal_newlines=True)
-    #proc.communicate()
-    os.system(cmd)
-    logger.info(f"{SUCCESSFUL_MESSAGE}")
+    return json_config_file_name, log_file_name
 
 
-if __name__ == "__main__":
+def get_argument_parser():
     parser = argparse.ArgumentParser(description="""
 	Reconstruct a set of projections from a given folder,
 
@@ -226,6 +244,11 @@ if __name__ == "__main__":
                         type=str,
                         help="Name of the ring removal algorithm [Vos, bm3d] (default being Vos)")
 
+    return parser
+
+
+if __name__ == "__main__":
+    parser = get_argument_parser()
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import statistics
+
+from PIL import Image
+
+logger = logging.getLogger("rockit")
+
+# angles (degrees) covered by a scan, from its first projection to its last one. None: found from the angles
+# of the projections, among ANGULAR_RANGES
+DEFAULT_ANGULAR_RANGE = None
+ANGULAR_RANGES = [180, 360]
+
+# a scan whose last angle may be its end but may also be followed by more projections (ex: 180 degrees of a
+# 360 degrees scan, or 360 - step when 360 is never acquired) is complete when no projection was added for
+# that many acquisition intervals (time between two projections of the scan), and for at least
+# acquisition_time_coefficient x exposure time (a scan can pause longer than two intervals, ex: 180 degrees)
+NUMBER_OF_INTERVALS_TO_WAIT = 2
+DEFAULT_ACQUISITION_TIME_COEFFICIENT = 5
+
+# a projection modified less than that many seconds ago may still be being written (only used when the
+# projections do not all have the same size)
+MINIMUM_FILE_AGE = 2
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def parse_projection_name(file_name):
+    """(index, angle in degrees) of <prefix>_<angle integer part>_<angle decimal part>_<index>.tiff
+    (same naming as utilites.get_ind_list), None if the name does not follow it"""
+    _split = os.path.splitext(os.path.basename(file_name))[0].split('_')
+    if len(_split) < 4:
+        return None
+    try:
+        return int(_split[-1]), float(_split[-3] + '.' + _split[-2])
+    except ValueError:
+        return None
+
+
+class ScanProgress:
+    """growth of a scan folder, followed from the names of its projections
+
+    o_progress = ScanProgress(folder)
+    o_progress.update()          # only the files new since the last update are looked at
+    o_progress.is_complete()     # True as soon as the projection at the last angle is written
+
+    The angular step comes from the angles of the projections received so far. The scan ends at
+    (first angle + range) or (first angle + range - step), range being angular_range, or, when it is None,
+    one of ANGULAR_RANGES (the range and the number of projections expected are then known once the scan is
+    complete). The scan is complete as soon as the projection at the largest end possible is written; at any
+    other end, as the scan may go on, once no projection was added for NUMBER_OF_INTERVALS_TO_WAIT acquisition
+    intervals (learned from the modification times of the projections) nor for acquisition_time_coefficient x
+    exposure time, whichever is longer.
+
+    is_idle is the fallback when the names can not tell (scan stopped before its end, other naming): no new
+    projection for acquisition_time_coefficient x exposure time, the exposure time being read (once) from the
+    first projection.
+    """
+
+    def __init__(self, folder, angular_range=DEFAULT_ANGULAR_RANGE):
+        self.folder = folder
+        self.angular_range = angular_range
+
+        # file name: (index, angle), and its modification time
+        self.projections = {}
+        self.modification_times = {}
+        self.list_unparsed = []
+        self.first_file_size = None
+        self.last_growth_time = None
+        self.exposure_time = None
+        self._last_projection = None
+
+    @property
+    def number_of_projections(self):
+        return len(self.projections) + len(self.list_unparsed)
+
+    def update(self):
+        """record the projections new since the last update, returns how many there are"""
+        list_known = set(self.projections.keys()) | set(self.list_unparsed)
+        number_of_new_files = 0
+        try:
+            with os.scandir(self.folder) as it:
+                list_entries = [_entry for _entry in it
+                                if _entry.name.lower().endswith(TIFF_EXTENSIONS) and _entry.name not in list_known]
+        except OSError as error:
+            logger.info(f"-> unable to list {self.folder}: {error}")
+            return 0
+
+        for _entry in list_entries:
+            try:
+                _stat = _entry.stat()
+            except OSError:
+                continue
+            number_of_new_files += 1
+            if (self.last_growth_time is None) or (_stat.st_mtime > self.last_growth_time):
+                self.last_growth_time = _stat.st_mtime
+
+            _parsed = parse_projection_name(_entry.name)
+            if _parsed is None:
+                self.list_unparsed.append(_entry.name)
+                continue
+            self.projections[_entry.name] = _parsed
+            self.modification_times[_entry.name] = _stat.st_mtime
+            if (self._last_projection is None) or (_parsed[0] > self.projections[self._last_projection][0]):
+                self._last_projection = _entry.name
+
+        if (self.first_file_size is None) and self.projections:
+            _first = min(self.projections.keys(), key=lambda _name: self.projections[_name][0])
+            try:
+                self.first_file_size = os.path.getsize(os.path.join(self.folder, _first))
+            except OSError:
+                pass
+        return number_of_new_files
+
+    def get_angles(self):
+        """angles of the projections, sorted by index"""
+        return [_angle for _, _angle in sorted(self.projections.values())]
+
+    def get_angular_step(self):
+        list_angles = self.get_angles()
+        if len(list_angles) < 2:
+            return None
+        list_steps = [abs(_next - _previous) for _previous, _next in zip(list_angles[:-1], list_angles[1:])]
+        step = statistics.median(list_steps)
+        return step if step > 0 else None
+
+    def get_acquisition_interval(self):
+        """median time (s) between two consecutive projections, None before the second one"""
+        list_times = [self.modification_times[_name] for _name in
+                      sorted(self.projections.keys(), key=lambda _name: self.projections[_name][0])]
+        if len(list_times) < 2:
+            return None
+        return max(0., statistics.median([_next - _previous for _previous, _next in zip(list_times[:-1],
+                                                                                          list_times[1:])]))
+
+    def get_possible_ends(self):
+        """[(angular range, angles from the first projection to the last one), ...] of the ends the scan can
+        have, the largest last"""
+        step = self.get_angular_step()
+        if step is None:
+            return []
+        list_ranges = [self.angular_range] if self.angular_range else ANGULAR_RANGES
+        return sorted([(_range, _span) for _range in list_ranges for _span in (_range - step, _range)],
+                      key=lambda _end: _end[1])
+
+    def get_end_reached(self):
+        """(angular range, span) of the end of the scan the last projection is at, None if it is not at one"""
+        step = self.get_angular_step()
+        if step is None:
+            return None
+        list_angles = self.get_angles()
+        span = abs(list_angles[-1] - list_angles[0])
+        for _range, _span in reversed(self.get_possible_ends()):
+            if abs(span - _span) <= step / 2:
+                return _range, _span
+        return None
+
+    def get_angular_range(self):
+        """range of the scan, if given or once its last projection is at one of the possible ends"""
+        if self.angular_range:
+            return self.angular_range
+        end = self.get_end_reached()
+        return end[0] if end else None
+
+    def get_expected_number_of_projections(self):
+        """number of projections of the scan, from the end its last projection reached (or the largest end
+        possible while the scan is going on)"""
+        step = self.get_angular_step()
+        if step is None:
+            return None
+        end = self.get_end_reached()
+        if end is None:
+            end = self.get_possible_ends()[-1]
+        return int(round(end[1] / step)) + 1
+
+    def is_complete(self, acquisition_time_coefficient=DEFAULT_ACQUISITION_TIME_COEFFICIENT, exposure_time=None):
+        """True once the projection at the last angle of the scan is fully written
+
+        exposure_time: read from the first projection when not given (only needed at the ends the scan may go
+        on from)
+        """
+        end = self.get_end_reached()
+        if end is None:
+            return False
+
+        last_file = os.path.join(self.folder, self._last_projection)
+        try:
+            _stat = os.stat(last_file)
+        except OSError:
+            return False
+        if _stat.st_size != self.first_file_size:
+            # still being written, or projections of different sizes (compressed)
+            if time.time() - _stat.st_mtime < MINIMUM_FILE_AGE:
+                return False
+
+        if end != self.get_possible_ends()[-1]:
+            # the scan may go on
+            interval = self.get_acquisition_interval() or 0.
+            if exposure_time is None:
+                exposure_time = self.get_exposure_time()
+            time_to_wait = max(NUMBER_OF_INTERVALS_TO_WAIT * interval + MINIMUM_FILE_AGE,
+                               acquisition_time_coefficient * exposure_time)
+            if time.time() - self.last_growth_time < time_to_wait:
+                return False
+
+        step = self.get_angular_step()
+        logger.info(f"-> last angle {self.get_angles()[-1]} reached with {len(self.projections)} projections "
+                    f"({self.get_expected_number_of_projections()} expected over {end[0]} degrees with a step "
+                     f"of {step} degrees)")
+        return True
+
+    def get_exposure_time(self):
+        """exposure time (s) of the first projection, read once"""
+        if self.exposure_time is None:
+            list_names = sorted(self.projections.keys(), key=lambda _name: self.projections[_name][0]) + \
+                         sorted(self.list_unparsed)
+            if len(list_names) == 0:
+                return None
+            o_image = Image.open(os.path.join(self.folder, list_names[0]))
+            o_dict = dict(o_image.tag_v2)
+            name, value = o_dict[65027].split(":")
+            self.exposure_time = float(value)
+        return self.exposure_time
+
+    def is_idle(self, acquisition_time_coefficient=DEFAULT_ACQUISITION_TIME_COEFFICIENT):
+        """True when no projection was added for acquisition_time_coefficient x exposure time"""
+        if self.last_growth_time is None:
+            return False
+        exposure_time = self.get_exposure_time()
+        return time.time() > (self.last_growth_time + acquisition_time_coefficient * exposure_time)
@@ -0,0 +1,122 @@
+import logging
+
+import numpy as np
+
+from utilites import lazy_import, create_scratch_array, read_tiff_from_full_name_list
+from instrumentation import StageRecorder
+from gridrec_engine import ChunkedGridrec
+
+logger = logging.getLogger("rockit")
+
+# number of rows of the projections (= number of slices) reconstructed at once
+DEFAULT_SLAB_SIZE = 64
+
+# number of projections loaded and preprocessed at once
+DEFAULT_PROJECTION_CHUNK_SIZE = 32
+
+
+def preprocess_projections(proj, ob, dc):
+    """remove outliers, normalize by ob and dc, correct the beam fluctuation and convert to attenuation.
+    Every step works on each projection independently, so proj can be any chunk of the projections"""
+    tomopy = lazy_import("tomopy")
+    remove_outlier = lazy_import("tomopy.misc.corr").remove_outlier
+    normalize_bg = lazy_import("tomopy.prep.normalize").normalize_bg
+
+    proj = remove_outlier(proj, 50)
+    proj = tomopy.normalize(proj, ob, dc)
+    proj = normalize_bg(proj, air=50)
+    return tomopy.minus_log(proj)
+
+
+def run_streaming_reconstruction(list_files, theta, proj180_ind, ob, dc, output_folder, scratch_folder,
+                                 crop_box=None, ring_removal=True, slab_size=None, projection_chunk_size=None,
+                                 max_workers=None, recorder=None, engine=None):
+    """reconstruct the projections without keeping the full stacks in memory
+
+    1. the tilt is calculated from the preprocessed 0 and 180 degrees projections
+    2. the projections are loaded, preprocessed and tilt corrected projection_chunk_size at a time,
+       into a stack memory mapped on a scratch file of scratch_folder
+    3. the center of rotation is found on that stack
+    4. the stack is reconstructed slab_size rows at a time (ring removal, gridrec) and each slab of
+       slices is written to output_folder as soon as it is done
+
+    Only the ring removal is done after the tilt correction (it is done before in the full memory mode).
+
+    recorder: StageRecorder recording each of those steps
+    engine: ChunkedGridrec reconstructing the slabs (one slab at a time with all the cores by default)
+    """
+    tilt = lazy_import("imars3d.backend.diagnostics.tilt")
+
+    if recorder is None:
+        recorder = StageRecorder()
+    if projection_chunk_size is None:
+        projection_chunk_size = DEFAULT_PROJECTION_CHUNK_SIZE
+
+    # tomopy.normalize averages the ob and dc stacks every time it is called, do it once here
+    ob = np.mean(ob, axis=0, keepdims=True, dtype=np.float32)
+    dc = np.mean(dc, axis=0, keepdims=True, dtype=np.float32)
+
+    # tilt
+    with recorder.stage("find tilt"):
+        _references = read_tiff_from_full_name_list([list_files[0], list_files[proj180_ind]],
+                                                    crop_box=crop_box,
+                                                    max_workers=1)
+        _references = preprocess_projections(_references, ob, dc)
+        tilt_ang = tilt.calculate_tilt(image0=_references[0], image180=_references[1])
+        del _references
+        logger.info(f"- tilt angle: {tilt_ang.x}")
+
+    # preprocessing, chunk of projections by chunk of projections
+    number_of_projections = len(list_files)
+    with recorder.stage("preprocessing") as _stage:
+        logger.info(f"- {number_of_projections} projections, {projection_chunk_size} at a time")
+        stack = None
+        for _start in range(0, number_of_projections, projection_chunk_size):
+            _end = min(_start + projection_chunk_size, number_of_projections)
+            _proj = read_tiff_from_full_name_list(list_files[_start: _end],
+                                                  crop_box=crop_box,
+                                                  max_workers=max_workers)
+            _proj = preprocess_projections(_proj, ob, dc)
+            _proj = tilt.apply_tilt_correction(_proj, tilt_ang.x)
+            if stack is None:
+                stack = create_scratch_array((number_of_projections, _proj.shape[1], _proj.shape[2]),
+                                             np.float32,
+                                             scratch_folder)
+            stack[_start: _end] = _proj
+            logger.info(f"- preprocessed {_end}/{number_of_projections}")
+        del _proj
+        _stage.add_array("stack", stack)
+
+    reconstruct_by_slabs(stack, theta, proj180_ind, output_folder, ring_removal=ring_removal, slab_size=slab_size,
+                         recorder=recorder, engine=engine)
+
+
+def reconstruct_by_slabs(stack, theta, proj180_ind, output_folder, ring_removal=True, slab_size=None, order=None,
+                         recorder=None, engine=None):
+    """find the center of rotation of the (preprocessed and tilt corrected) stack of projections, then
+    reconstruct it slab_size rows at a time (ring removal, gridrec) and write each slab of slices to
+    output_folder as soon as it is done
+
+    order: order of the projections (matching theta) when it is not the order of the stack
+    engine: ChunkedGridrec reconstructing the slabs (its chunk size is the slab size)
+    """
+    tomopy = lazy_import("tomopy")
+
+    if recorder is None:
+        recorder = StageRecorder()
+    if engine is None:
+        engine = ChunkedGridrec(chunk_size=slab_size if slab_size else DEFAULT_SLAB_SIZE)
+    if order is None:
+        index_0, index_180 = 0, proj180_ind
+    else:
+        index_0, index_180 = order[0], order[proj180_ind]
+
+    # center of rotation
+    with recorder.stage("center of rotation"):
+        rot_center = tomopy.find_center_pc(np.array(stack[index_0]), np.array(stack[index_180]), tol=0.5)
+        logger.info(f"- center of rotation: {rot_center}")
+
+    # ring removal and reconstruction, slab of rows by slab of rows
+    with recorder.stage("reconstruction") as _stage:
+        engine.reconstruct(stack, theta, rot_center, output_folder, order=order, ring_removal=ring_removal,
+                           stage=_stage)
@@ -1,16 +1,55 @@
+import importlib
 import math
-import dxchange
 import numpy as np
 import os
 import glob
-import tomopy
 import json
+import resource
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
 # import svmbir
 # import bm3d_streak_removal as bm3d_rmv
 
+# time (s) spent importing each module loaded with lazy_import
+IMPORT_TIMES = OrderedDict()
+
+# number of threads decoding the tiff files of a stack (the decoding and the reads release the GIL)
+DEFAULT_LOADING_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def lazy_import(module_name):
+    """import the module the first time a stage needs it (dxchange, tomopy, ... take seconds to import),
+    and record how long the import took"""
+    if module_name in IMPORT_TIMES:
+        return importlib.import_module(module_name)
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    IMPORT_TIMES[module_name] = time.perf_counter() - start
+    return module
+
+
+def get_import_time_report():
+    """list of lines 'module: time' of the modules imported with lazy_import"""
+    return [f"{_module}: {_time:.3f}s" for _module, _time in IMPORT_TIMES.items()]
+
+
+def get_memory_usage():
+    """current and peak resident memory of the process, in MB"""
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+    try:
+        with open("/proc/self/statm") as f:
+            current_mb = int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except (OSError, IndexError, ValueError):
+        current_mb = np.NaN
+    return current_mb, peak_mb
+
+
 def get_ind_list(name_list: list):
     ind = []
     ang_deg = []
@@ -53,31 +92,126 @@ def get_list(name_list: list):
     return list(ind_dict_sorted.values()), ind
 
 
-def _init_arr_from_stack(fname, number_of_files, slc=None):
+def _init_arr_from_stack(fname, number_of_files, slc=None, scratch_folder=None, crop_box=None):
     """
     Initialize numpy array from files in a folder.
+
+    If scratch_folder is provided, the array is a np.memmap backed by a scratch file created in that
+    folder, so the stack can be larger than the memory of the node. The scratch file is removed right
+    away and its space is released when the array is garbage collected.
+    If crop_box [ymin, ymax, xmin, xmax] is provided, the array has the size of the cropped images.
     """
-    _arr = dxchange.read_tiff(fname, slc)
+    if crop_box is None:
+        dxchange = lazy_import("dxchange")
+        _arr = dxchange.read_tiff(fname, slc)
+    else:
+        _arr = read_tiff_roi(fname, crop_box)
     size = (number_of_files, _arr.shape[0], _arr.shape[1])
-    return np.empty(size, dtype=_arr.dtype)
+    if scratch_folder is None:
+        return np.empty(size, dtype=_arr.dtype)
+    return create_scratch_array(size, _arr.dtype, scratch_folder)
+
+
+def create_scratch_array(shape, dtype, scratch_folder):
+    """np.memmap of that shape and dtype backed by an (already removed) file of the scratch folder"""
+    os.makedirs(scratch_folder, exist_ok=True)
+    _fd, _scratch_file = tempfile.mkstemp(prefix="rockit_", suffix=".dat", dir=scratch_folder)
+    try:
+        os.close(_fd)
+        arr = np.memmap(_scratch_file, dtype=dtype, mode='w+', shape=tuple(shape))
+    finally:
+        # the mapping keeps the data alive, the file itself is not needed anymore
+        os.remove(_scratch_file)
+    return arr
+
+
+def get_crop_box(corners):
+    """[ymin, ymax, xmin, xmax] of the box defined by the 4 corners [[x, y], ...] (upper left, lower left,
+    lower right, upper right), same crop as tomopy.prep.alignment.remove_slits_aps_1id"""
+    xmin, ymin = corners[0]
+    xmax, ymax = corners[2]
+    return [int(ymin), int(ymax), int(xmin), int(xmax)]
 
 
-def read_tiff_stack(fdir, fname: list):
-    arr = _init_arr_from_stack(os.path.join(fdir, fname[0]), len(fname))
-    for m, name in enumerate(fname):
-        arr[m] = dxchange.read_tiff(os.path.join(fdir, name))
+def read_tiff_roi(file_name, crop_box=None):
+    """read the rows [ymin, ymax) and the columns [xmin, xmax) of the image, crop_box = [ymin, ymax, xmin, xmax]
+
+    For uncompressed strip images (the detector images) only the bytes of the rows needed are read,
+    any other tiff file is fully decoded then cropped.
+    """
+    tifffile = lazy_import("tifffile")
+    with tifffile.TiffFile(file_name) as tif:
+        page = tif.pages[0]
+        if crop_box is None:
+            return page.asarray()
+
+        height, width = page.imagelength, page.imagewidth
+        ymin, ymax, xmin, xmax = crop_box
+        ymin, ymax = max(0, ymin), min(height, ymax)
+        xmin, xmax = max(0, xmin), min(width, xmax)
+
+        if (page.compression != 1) or page.is_tiled or (page.samplesperpixel != 1) or \
+                (page.bitspersample % 8 != 0):
+            return page.asarray()[ymin: ymax, xmin: xmax]
+
+        dtype = np.dtype(page.dtype).newbyteorder(tif.byteorder)
+        row_bytes = width * dtype.itemsize
+        rows_per_strip = min(page.rowsperstrip, height)
+        arr = np.empty((max(0, ymax - ymin), max(0, xmax - xmin)), dtype=page.dtype)
+
+        file_handle = tif.filehandle
+        row = ymin
+        while row < ymax:
+            strip = row // rows_per_strip
+            last_row = min(ymax, (strip + 1) * rows_per_strip)
+            file_handle.seek(page.dataoffsets[strip] + (row - strip * rows_per_strip) * row_bytes)
+            _data = np.frombuffer(file_handle.read((last_row - row) * row_bytes), dtype=dtype)
+            arr[row - ymin: last_row - ymin] = _data.reshape(last_row - row, width)[:, xmin: xmax]
+            row = last_row
+        return arr
+
+
+def _fill_stack(arr, list_files, max_workers=None, crop_box=None):
+    """read each file of list_files into arr[m], m being the position of the file in the list.
+    The files are decoded in a pool of max_workers threads (DEFAULT_LOADING_WORKERS if None), 1 forces
+    the serial mode. Only the crop_box [ymin, ymax, xmin, xmax] of each file is read if provided"""
+    dxchange = lazy_import("dxchange")
+    if max_workers is None:
+        max_workers = DEFAULT_LOADING_WORKERS
+
+    def _read_one(m):
+        if crop_box is None:
+            arr[m] = dxchange.read_tiff(list_files[m])
+        else:
+            arr[m] = read_tiff_roi(list_files[m], crop_box)
+
+    if (max_workers <= 1) or (len(list_files) < 2):
+        for m in range(len(list_files)):
+            _read_one(m)
+        return arr
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # result() re-raises the first error met by a thread
+        for _future in [executor.submit(_read_one, m) for m in range(len(list_files))]:
+            _future.result()
     return arr
 
 
+def read_tiff_stack(fdir, fname: list, scratch_folder=None, max_workers=None, crop_box=None):
+    arr = _init_arr_from_stack(os.path.join(fdir, fname[0]), len(fname), scratch_folder=scratch_folder,
+                               crop_box=crop_box)
+    return _fill_stack(arr, [os.path.join(fdir, name) for name in fname], max_workers=max_workers,
+                       crop_box=crop_box)
+
+
 def read_tiff(full_file_name):
+    dxchange = lazy_import("dxchange")
     dxchange.read_tiff(os.path.join(fdir, name))
 
 
-def read_tiff_from_full_name_list(list_files: list):
-    arr = _init_arr_from_stack(list_files[0], len(list_files))
-    for m, _file in enumerate(list_files):
-        arr[m] = dxchange.read_tiff(_file)
-    return arr
+def read_tiff_from_full_name_list(list_files: list, scratch_folder=None, max_workers=None, crop_box=None):
+    arr = _init_arr_from_stack(list_files[0], len(list_files), scratch_folder=scratch_folder, crop_box=crop_box)
+    return _fill_stack(arr, list_files, max_workers=max_workers, crop_box=crop_box)
 
 
 def find_proj180_ind(ang_list: list):
@@ -130,48 +264,53 @@ def get_name_and_idx(fdir):
     return fname, idx_list
 
 
-def load_ct(fdir, ang1=0, ang2=360, name="raw*"):
+def load_ct(fdir, ang1=0, ang2=360, name="raw*", scratch_folder=None, max_workers=None, crop_box=None):
     if is_routine_ct(fdir):
         ct_list = os.listdir(fdir)
         ct_name, ang_deg, theta, idx_list = get_ind_list(ct_list)
     else:
         ct_list = glob.glob(fdir + "/" + name)
         ct_name, idx_list = get_list(ct_list)
+        tomopy = lazy_import("tomopy")
         theta = tomopy.angles(len(idx_list), ang1=ang1, ang2=ang2)  # Default 360 degree rotation
         ang_deg = np.rad2deg(theta)
     proj180_ind = find_proj180_ind(ang_deg)[0]
     print('Found index of 180 degree projections: ', proj180_ind)
     print('Loading CT projections...')
-    proj = read_tiff_stack(fdir=fdir, fname=ct_name)
+    proj = read_tiff_stack(fdir=fdir, fname=ct_name, scratch_folder=scratch_folder, max_workers=max_workers,
+                           crop_box=crop_box)
     print('Loading CT projections...Done!')
     return proj, theta, proj180_ind
 
 
-def load_ob(fdir, name="ob*"):
+def load_ob(fdir, name="ob*", scratch_folder=None, max_workers=None, crop_box=None):
     if is_routine_ct(fdir):
         ob_name, idx_list = get_name_and_idx(fdir)
     else:
         ob_list = glob.glob(fdir + "/" + name)
         ob_name, idx_list = get_list(ob_list)
     print("Loading Open Beam (OB)...")
-    ob = read_tiff_stack(fdir=fdir, fname=ob_name)
+    ob = read_tiff_stack(fdir=fdir, fname=ob_name, scratch_folder=scratch_folder, max_workers=max_workers,
+                         crop_box=crop_box)
     print("Loading Open Beam (OB)...Done!")
     return ob
 
 
-def load_dc(fdir, name="dc*"):
+def load_dc(fdir, name="dc*", scratch_folder=None, max_workers=None, crop_box=None):
     if is_routine_ct(fdir):
         dc_name, idx_list = get_name_and_idx(fdir)
     else:
         dc_list = glob.glob(fdir + "/" + name)
         dc_name, idx_list = get_list(dc_list)
     print("Loading Dark Current (DC)...")
-    dc = read_tiff_stack(fdir=fdir, fname=dc_name)
+    dc = read_tiff_stack(fdir=fdir, fname=dc_name, scratch_folder=scratch_folder, max_workers=max_workers,
+                         crop_box=crop_box)
     print("Loading Dark Current (DC)...Done!")
     return dc
 
 
 def remove_ring(proj, algorithm="Vo"):
+    tomopy = lazy_import("tomopy")
     # if algorithm == "Vo":
     proj_rmv = tomopy.prep.stripe.remove_all_stripe(proj)
     # elif algorithm == "bm3d":
@@ -180,7 +319,7 @@ def remove_ring(proj, algorithm="Vo"):
     return proj_rmv
 
 
-def recon(proj, theta, rot_center, algorithm="gridrec"):
+def recon(proj, theta, rot_center, algorithm="gridrec", ncore=None):
     # if algorithm == "svMBIR":
     #     # T, P, sharpness, snr_db: parameters of reconstruction, usually keep fixed. (Can be played with)
     #     T = 2.0
@@ -194,8 +333,10 @@ def recon(proj, theta, rot_center, algorithm="gridrec"):
     #                          positivity=False, max_iterations=100,
     #                          num_threads= 112, verbose=0) # verbose: display of reconstruction: 0 is minimum, 1 is regular
     # else:
-    recon = tomopy.recon(proj, theta, center=rot_center, algorithm=algorithm, sinogram_order=False)
-    recon = tomopy.circ_mask(recon, axis=0, ratio=1)
+    tomopy = lazy_import("tomopy")
+    # ncore: tomopy starts one thread per core of the node by default, even when the process is pinned to a few
+    recon = tomopy.recon(proj, theta, center=rot_center, algorithm=algorithm, sinogram_order=False, ncore=ncore)
+    recon = tomopy.circ_mask(recon, axis=0, ratio=1, ncore=ncore)
     return recon
 
 
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# rockit/ and autoreduce/ are flat folders of modules importing each other by name (ex: from utilites import ...)
+TOP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _folder in ("rockit", "autoreduce"):
+    _path = os.path.join(TOP_FOLDER, _folder)
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import shlex
+import subprocess
+import time
+
+import job_scheduler
+from job_scheduler import JobScheduler, PENDING, RUNNING, DONE, FAILED
+from worker_client import WORKER_UNAVAILABLE_RETURNCODE
+
+WORKER_CLIENT = os.path.join(os.path.dirname(__file__), "..", "autoreduce", "worker_client.py")
+
+
+def _get_scheduler(tmp_path, **kwargs):
+    kwargs.setdefault('max_jobs', 2)
+    kwargs.setdefault('memory_per_job_gb', 0)
+    kwargs.setdefault('retry_delay', 0)
+    return JobScheduler(str(tmp_path / "queue.json"), **kwargs)
+
+
+def _load_jobs(o_scheduler):
+    with open(o_scheduler.queue_file) as f:
+        return {_job['folder']: _job for _job in json.load(f)['jobs']}
+
+
+def _get_dead_pid():
+    proc = subprocess.Popen(["true"])
+    proc.wait()
+    return proc.pid
+
+
+def _new_job(folder, status, **kwargs):
+    job = {'folder': folder, 'cmd': "true", 'status': status, 'attempts': 1, 'submitted_time': 0,
+           'next_start_time': 0, 'start_time': 0, 'end_time': None, 'returncode': None, 'pid': None,
+           'owner_pid': None, 'cores': None}
+    job.update(kwargs)
+    return job
+
+
+def test_done_and_failed_after_retries(tmp_path):
+    list_changes = []
+    o_scheduler = _get_scheduler(tmp_path, max_retries=1,
+                                 on_status_change=lambda folder, status, job: list_changes.append((folder, status)))
+    o_scheduler.submit("ok", "true")
+    o_scheduler.submit("ko", "exit 3")
+    o_scheduler.wait(poll_interval=0.05)
+
+    jobs = _load_jobs(o_scheduler)
+    assert (jobs["ok"]['status'], jobs["ok"]['attempts'], jobs["ok"]['returncode']) == (DONE, 1, 0)
+    assert (jobs["ko"]['status'], jobs["ko"]['attempts'], jobs["ko"]['returncode']) == (FAILED, 2, 3)
+    assert [_status for _folder, _status in list_changes if _folder == "ko"] == [RUNNING, PENDING, RUNNING, FAILED]
+    assert [_status for _folder, _status in list_changes if _folder == "ok"] == [RUNNING, DONE]
+
+
+def test_worker_unavailable_not_counted_as_failure(tmp_path):
+    o_scheduler = _get_scheduler(tmp_path, max_retries=0)
+    flag = shlex.quote(str(tmp_path / "worker_up"))
+    o_scheduler.submit("a", f"if [ -e {flag} ]; then true; else touch {flag}; exit {WORKER_UNAVAILABLE_RETURNCODE}; fi")
+    o_scheduler.wait(poll_interval=0.05)
+
+    job = _load_jobs(o_scheduler)["a"]
+    assert (job['status'], job['attempts'], job['returncode']) == (DONE, 1, 0)
+
+
+def test_worker_client_fallback(tmp_path):
+    socket_file = str(tmp_path / "no_worker.sock")
+    cmd = f"{shlex.quote(sys.executable)} {shlex.quote(WORKER_CLIENT)} -socket {shlex.quote(socket_file)}"
+    o_scheduler = _get_scheduler(tmp_path, max_retries=0, retry_delay=60)
+    o_scheduler.submit("fallback", f"{cmd} -fallback 'exit 3' rockit_cli a b")
+    o_scheduler.submit("no_fallback", f"{cmd} rockit_cli a b")
+    o_scheduler.update()
+    end_time = time.time() + 30
+    while (RUNNING in [_job['status'] for _job in _load_jobs(o_scheduler).values()]) and (time.time() < end_time):
+        time.sleep(0.05)
+        o_scheduler.update()
+
+    jobs = _load_jobs(o_scheduler)
+    # the fallback command ran and failed
+    assert (jobs["fallback"]['status'], jobs["fallback"]['returncode']) == (FAILED, 3)
+    # waiting for the worker, the attempt is not counted
+    assert (jobs["no_fallback"]['status'], jobs["no_fallback"]['attempts'],
+            jobs["no_fallback"]['returncode']) == (PENDING, 0, WORKER_UNAVAILABLE_RETURNCODE)
+
+
+def test_submit_twice(tmp_path):
+    o_scheduler = _get_scheduler(tmp_path)
+    o_scheduler.submit("a", "true")
+    o_scheduler.submit("a", "true")
+    assert len(_load_jobs(o_scheduler)) == 1
+
+
+def test_max_jobs(tmp_path):
+    o_scheduler = _get_scheduler(tmp_path, max_jobs=1)
+    o_scheduler.submit("a", "sleep 0.2")
+    o_scheduler.submit("b", "true")
+    o_scheduler.update()
+    jobs = _load_jobs(o_scheduler)
+    assert (jobs["a"]['status'], jobs["b"]['status']) == (RUNNING, PENDING)
+    o_scheduler.wait(poll_interval=0.05)
+    assert {_job['status'] for _job in _load_jobs(o_scheduler).values()} == {DONE}
+
+
+def test_job_of_a_dead_scheduler(tmp_path):
+    """the reconstruction started by a scheduler that stopped is followed until it ends, then counted as
+    failed (its return code is unknown)"""
+    o_scheduler = _get_scheduler(tmp_path, max_retries=0)
+    proc = subprocess.Popen(["sleep", "30"])
+    try:
+        o_scheduler._save([_new_job("a", RUNNING, pid=proc.pid, owner_pid=_get_dead_pid())])
+        o_scheduler.update()
+        assert _load_jobs(o_scheduler)["a"]['status'] == RUNNING
+    finally:
+        proc.kill()
+        proc.wait()
+
+    o_scheduler.update()
+    job = _load_jobs(o_scheduler)["a"]
+    assert (job['status'], job['returncode']) == (FAILED, -1)
+
+
+def test_job_of_a_dead_scheduler_retried(tmp_path):
+    o_scheduler = _get_scheduler(tmp_path, max_retries=1)
+    o_scheduler._save([_new_job("a", RUNNING, pid=_get_dead_pid(), owner_pid=_get_dead_pid())])
+    o_scheduler.update()
+    # found lost, then started again by this scheduler
+    job = _load_jobs(o_scheduler)["a"]
+    assert (job['status'], job['attempts']) == (RUNNING, 2)
+    o_scheduler.wait(poll_interval=0.05)
+    assert _load_jobs(o_scheduler)["a"]['status'] == DONE
+
+
+def test_finished_jobs_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_scheduler, "MAX_NUMBER_OF_FINISHED_JOBS", 3)
+    o_scheduler = _get_scheduler(tmp_path)
+    list_jobs = [_new_job(f"done_{_index}", DONE, returncode=0) for _index in range(5)]
+    list_jobs.insert(2, _new_job("pending", PENDING, next_start_time=1e20))
+    o_scheduler._save(list_jobs)
+    assert list(_load_jobs(o_scheduler).keys()) == ["pending", "done_2", "done_3", "done_4"]
+
+
+def test_get_free_cores(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_scheduler.os, "sched_getaffinity", lambda pid: set(range(8)))
+    o_scheduler = _get_scheduler(tmp_path, cores_per_job=3, pin_cores=True)
+    list_jobs = [_new_job("a", RUNNING, cores=[0, 1, 2]),
+                 _new_job("b", DONE, cores=[3, 4, 5]),
+                 _new_job("c", RUNNING, cores=[6])]
+    assert o_scheduler._get_free_cores(list_jobs) == [3, 4, 5]
+    list_jobs.append(_new_job("d", RUNNING, cores=[3, 4, 5]))
+    # only the core 7 is free
+    assert o_scheduler._get_free_cores(list_jobs) is None
+
+
+def test_unreadable_queue_file(tmp_path):
+    o_scheduler = _get_scheduler(tmp_path)
+    with open(o_scheduler.queue_file, 'w') as f:
+        f.write("{not json")
+    o_scheduler.submit("a", "true")
+    assert list(_load_jobs(o_scheduler).keys()) == ["a"]
+
+
+def test_progressive_jobs_have_their_own_slots(tmp_path):
+    """a progressive reconstruction waiting for its scan does not hold back the scans already complete"""
+    o_scheduler = _get_scheduler(tmp_path, max_jobs=1, max_progressive_jobs=1)
+    o_scheduler.submit("progressive_1", "sleep 0.5", progressive=True)
+    o_scheduler.submit("progressive_2", "true", progressive=True)
+    o_scheduler.submit("complete", "true")
+    o_scheduler.update()
+    jobs = _load_jobs(o_scheduler)
+    assert (jobs["progressive_1"]['status'], jobs["progressive_2"]['status'], jobs["complete"]['status']) == \
+        (RUNNING, PENDING, RUNNING)
+    o_scheduler.wait(poll_interval=0.05)
+    assert {_job['status'] for _job in _load_jobs(o_scheduler).values()} == {DONE}
@@ -0,0 +1,51 @@
+import glob
+import os
+import time
+
+import numpy as np
+
+from progressive import ProgressiveReconstruction
+
+
+def _write_scan(folder, list_angles, last_time):
+    os.makedirs(folder)
+    for _index, _angle in enumerate(list_angles):
+        _file_name = os.path.join(folder, f"scan_{int(_angle):03d}_000_{_index:04d}.tiff")
+        with open(_file_name, 'wb') as f:
+            f.write(b"0" * 100)
+        _time = last_time - (len(list_angles) - 1 - _index) * 10
+        os.utime(_file_name, (_time, _time))
+    return sorted(glob.glob(os.path.join(folder, "*.tiff")))
+
+
+def _get_progressive(tmp_path, folder):
+    return ProgressiveReconstruction(folder, ob=np.ones((1, 4, 4)), dc=np.zeros((1, 4, 4)),
+                                     scratch_folder=str(tmp_path / "scratch"))
+
+
+def test_complete_at_last_angle(tmp_path):
+    """the reconstruction starts once the last angle is stored, without waiting for exposure times"""
+    folder = str(tmp_path / "scan")
+    list_files = _write_scan(folder, range(0, 361, 10), last_time=time.time() - 3)
+    o_progressive = _get_progressive(tmp_path, folder)
+    try:
+        o_progressive.list_files = list_files[:-1]
+        o_progressive.get_new_files()
+        assert not o_progressive.is_scan_complete(exposure_time=1000)
+        o_progressive.list_files = list_files
+        assert o_progressive.is_scan_complete(exposure_time=1000)
+    finally:
+        o_progressive.close()
+
+
+def test_idle_fallback(tmp_path):
+    folder = str(tmp_path / "scan")
+    list_files = _write_scan(folder, range(0, 101, 10), last_time=time.time() - 3)
+    o_progressive = _get_progressive(tmp_path, folder)
+    try:
+        o_progressive.list_files = list_files
+        o_progressive.get_new_files()
+        assert not o_progressive.is_scan_complete(exposure_time=1000)
+        assert o_progressive.is_scan_complete(exposure_time=0.1)
+    finally:
+        o_progressive.close()
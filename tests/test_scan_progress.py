@@ -0,0 +1,114 @@
+import os
+import time
+
+import pytest
+
+from scan_progress import ScanProgress, parse_projection_name
+
+FILE_SIZE = 100
+
+
+def _write_scan(folder, list_angles, last_time=None, interval=30.):
+    """one projection per angle, acquired every interval seconds, the last one at last_time"""
+    if last_time is None:
+        last_time = time.time() - 3600
+    os.makedirs(folder, exist_ok=True)
+    for _index, _angle in enumerate(list_angles):
+        _integer, _decimal = f"{_angle:.3f}".split('.')
+        _file_name = os.path.join(folder, f"scan_{int(_integer):03d}_{_decimal}_{_index:04d}.tiff")
+        with open(_file_name, 'wb') as f:
+            f.write(b"0" * FILE_SIZE)
+        _time = last_time - (len(list_angles) - 1 - _index) * interval
+        os.utime(_file_name, (_time, _time))
+    return folder
+
+
+def _angles(first, last, step):
+    return [first + _index * step for _index in range(int(round((last - first) / step)) + 1)]
+
+
+def _get_progress(folder, angular_range=None):
+    o_progress = ScanProgress(folder, angular_range=angular_range)
+    o_progress.update()
+    return o_progress
+
+
+def test_parse_projection_name():
+    assert parse_projection_name("20200824_sample_0010_359_500_2157.tiff") == (2157, 359.5)
+    assert parse_projection_name("image.tiff") is None
+
+
+def test_scan_0_to_360(tmp_path):
+    o_progress = _get_progress(_write_scan(str(tmp_path / "scan"), _angles(0, 360, 0.5)))
+    assert o_progress.is_complete()
+    assert o_progress.get_angular_range() == 360
+    assert o_progress.get_expected_number_of_projections() == 721
+
+
+def test_scan_0_to_360_minus_step(tmp_path):
+    o_progress = _get_progress(_write_scan(str(tmp_path / "scan"), _angles(0, 359.5, 0.5)))
+    assert o_progress.is_complete(exposure_time=30)
+    assert o_progress.get_angular_range() == 360
+    assert o_progress.get_expected_number_of_projections() == 720
+
+
+def test_scan_0_to_180(tmp_path):
+    o_progress = _get_progress(_write_scan(str(tmp_path / "scan"), _angles(0, 180, 0.5)))
+    assert o_progress.is_complete(exposure_time=30)
+    assert o_progress.get_angular_range() == 180
+    assert o_progress.get_expected_number_of_projections() == 361
+
+
+def test_scan_0_to_360_complete_as_soon_as_last_angle_is_written(tmp_path):
+    o_progress = _get_progress(_write_scan(str(tmp_path / "scan"), _angles(0, 360, 0.5),
+                                           last_time=time.time() - 3))
+    assert o_progress.is_complete()
+
+
+@pytest.mark.parametrize("last_angle", [180, 359.5])
+def test_scan_that_may_go_on(tmp_path, last_angle):
+    """at 180 degrees, or 360 - step, a scan of 360 degrees may still be acquired"""
+    folder = _write_scan(str(tmp_path / "scan"), _angles(0, last_angle, 0.5), last_time=time.time() - 3)
+    assert not _get_progress(folder).is_complete(exposure_time=30)
+
+
+@pytest.mark.parametrize("seconds_since_last", [80, 160])
+def test_scan_of_360_paused_at_180(tmp_path, seconds_since_last):
+    """a pause at 180 degrees longer than two intervals is not the end of the scan before
+    acquisition_time_coefficient x exposure time (5 x 30s)"""
+    folder = _write_scan(str(tmp_path / "scan"), _angles(0, 180, 0.5), last_time=time.time() - seconds_since_last,
+                         interval=35.)
+    o_progress = _get_progress(folder)
+    assert o_progress.is_complete(acquisition_time_coefficient=5, exposure_time=30) == (seconds_since_last > 150)
+
+
+def test_scan_going_on(tmp_path):
+    o_progress = _get_progress(_write_scan(str(tmp_path / "scan"), _angles(0, 100, 0.5)))
+    assert not o_progress.is_complete()
+    assert o_progress.get_angular_range() is None
+    assert o_progress.get_expected_number_of_projections() == 721
+
+
+def test_incremental_update(tmp_path):
+    folder = str(tmp_path / "scan")
+    list_angles = _angles(0, 360, 0.5)
+    _write_scan(folder, list_angles[:400])
+    o_progress = _get_progress(folder)
+    assert not o_progress.is_complete()
+    _write_scan(folder, list_angles)
+    assert o_progress.update() == len(list_angles) - 400
+    assert o_progress.is_complete()
+
+
+def test_given_angular_range(tmp_path):
+    folder = _write_scan(str(tmp_path / "scan"), _angles(0, 180, 0.5))
+    assert not _get_progress(folder, angular_range=360).is_complete()
+    assert _get_progress(folder, angular_range=180).is_complete()
+
+
+def test_last_projection_being_written(tmp_path):
+    folder = _write_scan(str(tmp_path / "scan"), _angles(0, 360, 0.5), last_time=time.time())
+    last_file = sorted(os.listdir(folder))[-1]
+    with open(os.path.join(folder, last_file), 'wb') as f:
+        f.write(b"0" * (FILE_SIZE // 2))
+    assert not _get_progress(folder).is_complete()
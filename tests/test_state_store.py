@@ -0,0 +1,167 @@
+import json
+import threading
+
+import pytest
+
+from state_store import StateStore, SEEN, INCOMPLETE, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "state.sqlite")
+
+
+@pytest.fixture
+def scan_folder(tmp_path):
+    folder = tmp_path / "scan"
+    folder.mkdir()
+    for _index in range(3):
+        (folder / f"scan_000_000_{_index:04d}.tiff").write_bytes(b"0" * 10)
+    return str(folder)
+
+
+def test_mark_seen_once(db_file, scan_folder):
+    o_store = StateStore(db_file)
+    assert o_store.get_status(scan_folder) is None
+    o_store.mark_seen(scan_folder, 27158)
+    first_seen_time = o_store.get_folder(scan_folder)['first_seen_time']
+    o_store.set_status(scan_folder, INCOMPLETE)
+    o_store.mark_seen(scan_folder, 27158)
+    folder = o_store.get_folder(scan_folder)
+    assert (folder['status'], folder['first_seen_time'], folder['ipts']) == (INCOMPLETE, first_seen_time, "27158")
+
+
+def test_only_one_claim_wins(db_file, scan_folder):
+    o_store_1 = StateStore(db_file)
+    o_store_2 = StateStore(db_file)
+    o_store_1.mark_seen(scan_folder, 27158)
+    assert o_store_2.get_status(scan_folder) == SEEN
+
+    assert o_store_1.claim(scan_folder, worker="daemon")
+    assert not o_store_2.claim(scan_folder, worker="cron")
+    folder = o_store_2.get_folder(scan_folder)
+    assert (folder['status'], folder['worker'], folder['number_of_files']) == (QUEUED, "daemon", 3)
+
+
+def test_concurrent_claims(db_file, scan_folder):
+    StateStore(db_file).mark_seen(scan_folder, 27158)
+    list_stores = [StateStore(db_file) for _ in range(8)]
+    list_results = [None] * len(list_stores)
+    barrier = threading.Barrier(len(list_stores))
+
+    def _claim(index):
+        barrier.wait()
+        list_results[index] = list_stores[index].claim(scan_folder, worker=str(index))
+
+    list_threads = [threading.Thread(target=_claim, args=(_index,)) for _index in range(len(list_stores))]
+    for _thread in list_threads:
+        _thread.start()
+    for _thread in list_threads:
+        _thread.join()
+    assert list_results.count(True) == 1
+
+
+def test_claim_incomplete_folder(db_file, scan_folder):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    o_store.set_status(scan_folder, INCOMPLETE)
+    assert o_store.claim(scan_folder)
+
+
+@pytest.mark.parametrize("status", [RUNNING, DONE, FAILED])
+def test_no_claim_once_handled(db_file, scan_folder, status):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    o_store.set_status(scan_folder, status)
+    assert not o_store.claim(scan_folder)
+
+
+def test_reopen_done_folder_once_changed(db_file, scan_folder, tmp_path):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    assert o_store.claim(scan_folder)
+    o_store.set_status(scan_folder, DONE)
+    assert not o_store.reopen_if_changed(scan_folder)
+
+    # the scan went on after it was queued
+    (tmp_path / "scan" / "scan_000_000_0003.tiff").write_bytes(b"0" * 10)
+    assert o_store.reopen_if_changed(scan_folder)
+    assert o_store.get_status(scan_folder) == SEEN
+    assert o_store.claim(scan_folder)
+    assert o_store.get_folder(scan_folder)['number_of_files'] == 4
+
+
+def test_no_reopen_without_fingerprint(db_file, scan_folder):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    o_store.set_status(scan_folder, DONE)
+    assert not o_store.reopen_if_changed(scan_folder)
+    assert o_store.get_status(scan_folder) == DONE
+
+
+def test_status_from_job_callbacks(db_file, scan_folder):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    assert o_store.claim(scan_folder)
+
+    job = {'start_time': 100., 'end_time': None, 'attempts': 1, 'returncode': None}
+    o_store.update_from_job(scan_folder, "running", job)
+    folder = o_store.get_folder(scan_folder)
+    assert (folder['status'], folder['start_time'], folder['attempts']) == (RUNNING, 100., 1)
+
+    # failed, waiting to be tried again
+    job.update(end_time=110., returncode=3)
+    o_store.update_from_job(scan_folder, "pending", job)
+    folder = o_store.get_folder(scan_folder)
+    assert (folder['status'], folder['returncode']) == (QUEUED, 3)
+
+    job.update(start_time=200., end_time=None, attempts=2, returncode=None)
+    o_store.update_from_job(scan_folder, "running", job)
+    folder = o_store.get_folder(scan_folder)
+    assert (folder['status'], folder['end_time'], folder['returncode']) == (RUNNING, None, None)
+
+    job.update(end_time=260., returncode=0)
+    o_store.update_from_job(scan_folder, "done", job)
+    folder = o_store.get_folder(scan_folder)
+    assert (folder['status'], folder['duration'], folder['attempts'], folder['returncode']) == (DONE, 60., 2, 0)
+
+
+def test_set_status_unknown_column(db_file, scan_folder):
+    o_store = StateStore(db_file)
+    o_store.mark_seen(scan_folder, 27158)
+    with pytest.raises(KeyError):
+        o_store.set_status(scan_folder, DONE, not_a_column=1)
+
+
+def test_import_json_once(db_file, tmp_path):
+    json_file = str(tmp_path / "ct_scans_folder_processed.json")
+    with open(json_file, 'w') as f:
+        json.dump({'list_folders': ["/HFIR/CG1D/IPTS-27158/raw/ct_scans/a/",
+                                    "/HFIR/CG1D/IPTS-27158/raw/ct_scans/b"]}, f)
+
+    o_store = StateStore(db_file)
+    o_store.import_json(json_file, 27158)
+    assert [_folder['folder'] for _folder in o_store.list_folders(ipts=27158, status=DONE)] == \
+        ["/HFIR/CG1D/IPTS-27158/raw/ct_scans/a", "/HFIR/CG1D/IPTS-27158/raw/ct_scans/b"]
+
+    # the json file is only imported the first time the store is used for that IPTS
+    o_store.set_status("/HFIR/CG1D/IPTS-27158/raw/ct_scans/a", FAILED)
+    with open(json_file, 'w') as f:
+        json.dump({'list_folders': ["/HFIR/CG1D/IPTS-27158/raw/ct_scans/c"]}, f)
+    o_store.import_json(json_file, 27158)
+    assert o_store.get_status("/HFIR/CG1D/IPTS-27158/raw/ct_scans/a") == FAILED
+    assert o_store.get_status("/HFIR/CG1D/IPTS-27158/raw/ct_scans/c") is None
+
+    # other IPTS
+    o_store.import_json(json_file, 12345)
+    assert o_store.get_status("/HFIR/CG1D/IPTS-27158/raw/ct_scans/c") == DONE
+
+
+def test_import_missing_or_broken_json(db_file, tmp_path):
+    o_store = StateStore(db_file)
+    o_store.import_json(str(tmp_path / "missing.json"), 27158)
+    broken_json_file = str(tmp_path / "broken.json")
+    with open(broken_json_file, 'w') as f:
+        f.write("{")
+    o_store.import_json(broken_json_file, 27158)
+    assert o_store.list_folders() == []
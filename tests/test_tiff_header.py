@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+
+from retrieve_matching_ob_dc import tiff_header
+from retrieve_matching_ob_dc.tiff_header import read_tiff_tags, get_tiff_tags, TiffHeaderError
+
+# CG1D like tags: ascii "name:value" strings, a double and a multi value tag
+CG1D_TAGS = [(65000, 's', 0, "Manufacturer:Andor", True),
+             (65027, 's', 0, "ExposureTime:30.000000", True),
+             (65028, 's', 0, "MotSlitHR.RBV:0.000000", True),
+             (65050, 'd', 1, 123.456, True),
+             (65060, 'H', 3, (1, 2, 3), True),
+             (65070, 's', 0, "IPTS:27158", True)]
+LIST_CG1D_TAGS = [_tag[0] for _tag in CG1D_TAGS]
+
+
+def _write_tiff(file_name, byteorder='<', bigtiff=False):
+    image = np.arange(64 * 32, dtype=np.uint16).reshape(64, 32)
+    tifffile.imwrite(file_name, image, byteorder=byteorder, bigtiff=bigtiff, extratags=CG1D_TAGS)
+    return file_name
+
+
+def _pil_tags(file_name, list_tags):
+    with Image.open(file_name) as image:
+        return {_tag: image.tag_v2[_tag] for _tag in list_tags}
+
+
+@pytest.mark.parametrize("byteorder, bigtiff", [('<', False), ('>', False), ('<', True)])
+def test_cg1d_tags_same_as_pil(tmp_path, byteorder, bigtiff):
+    file_name = _write_tiff(str(tmp_path / "image.tiff"), byteorder=byteorder, bigtiff=bigtiff)
+    assert read_tiff_tags(file_name, list_tags=LIST_CG1D_TAGS) == _pil_tags(file_name, LIST_CG1D_TAGS)
+
+
+def test_big_endian_bigtiff(tmp_path):
+    """PIL does not read big endian BigTIFF files, compare to the little endian one"""
+    little_endian_file_name = _write_tiff(str(tmp_path / "little.tiff"), byteorder='<', bigtiff=True)
+    big_endian_file_name = _write_tiff(str(tmp_path / "big.tiff"), byteorder='>', bigtiff=True)
+    assert read_tiff_tags(big_endian_file_name, list_tags=LIST_CG1D_TAGS) == \
+        _pil_tags(little_endian_file_name, LIST_CG1D_TAGS)
+
+
+def test_all_tags(tmp_path):
+    file_name = _write_tiff(str(tmp_path / "image.tiff"))
+    tags = read_tiff_tags(file_name)
+    assert tags[65027] == "ExposureTime:30.000000"
+    assert tags[256] == 32   # width
+    assert tags[257] == 64   # height
+    assert set(LIST_CG1D_TAGS) <= set(tags.keys())
+
+
+def test_only_requested_tags(tmp_path):
+    file_name = _write_tiff(str(tmp_path / "image.tiff"))
+    assert read_tiff_tags(file_name, list_tags=[65027, 1]) == {65027: "ExposureTime:30.000000"}
+
+
+def test_truncated_image_data(tmp_path):
+    """the image is never read, so the tags of a file cut in its image data are still there"""
+    file_name = _write_tiff(str(tmp_path / "image.tiff"))
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    expected = _pil_tags(file_name, LIST_CG1D_TAGS)
+    first_pixels = content.find(np.arange(8, dtype='<u2').tobytes())
+    assert first_pixels > 0
+    with open(file_name, 'wb') as f:
+        f.write(content[:first_pixels + 16])
+    assert get_tiff_tags(file_name, list_tags=LIST_CG1D_TAGS) == expected
+
+
+def test_fallback_to_pil_on_truncated_header(tmp_path, monkeypatch):
+    file_name = _write_tiff(str(tmp_path / "image.tiff"))
+    with open(file_name, 'rb') as f:
+        content = f.read()
+    truncated_file_name = str(tmp_path / "truncated.tiff")
+    with open(truncated_file_name, 'wb') as f:
+        f.write(content[:6])
+
+    with pytest.raises(TiffHeaderError):
+        read_tiff_tags(truncated_file_name)
+
+    list_calls = []
+
+    def _read_tiff_tags_with_pil(file_name, list_tags=None):
+        list_calls.append(file_name)
+        return {65027: "from PIL"}
+
+    monkeypatch.setattr(tiff_header, "read_tiff_tags_with_pil", _read_tiff_tags_with_pil)
+    assert get_tiff_tags(truncated_file_name, list_tags=[65027]) == {65027: "from PIL"}
+    assert list_calls == [truncated_file_name]
+
+
+def test_not_a_tiff_file(tmp_path):
+    file_name = str(tmp_path / "image.tiff")
+    with open(file_name, 'wb') as f:
+        f.write(b"not a tiff file at all")
+    with pytest.raises(TiffHeaderError):
+        read_tiff_tags(file_name)